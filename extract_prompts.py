@@ -1,45 +1,32 @@
-import re
 import json
+import sys
+from image_generator.prompt_extract import extract_prompts_from_file, extract_prompts_from_string
 
-def extract_visual_prompts_from_file(filename):
+def save_prompts(prompts, output_filename="visual_prompts_output.json"):
+    """
+    Writes prompts to a JSON array file as they arrive and returns them
+    """
+    all_strings = []
+    with open(output_filename, 'w', encoding='utf-8') as outfile:
+        outfile.write('[')
+        for prompt in prompts:
+            outfile.write(',\n  ' if all_strings else '\n  ')
+            json.dump(prompt, outfile, ensure_ascii=False)
+            all_strings.append(prompt)
+        outfile.write('\n]\n' if all_strings else ']\n')
+
+    print(f"✅ Successfully extracted {len(all_strings)} visual prompts")
+    print(f"✅ Saved to '{output_filename}'")
+
+    return all_strings
+
+def extract_visual_prompts_from_file(filename, key='text'):
     """
     Reads a text file and extracts all visual prompt strings from 'text' arrays
     Saves the result to an output JSON file
     """
     try:
-        # Read the file content
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # Extract visual prompts using regex
-        pattern = r'text\s*\[\s*((?:"(?:[^"\\]|\\.)*"(?:\s*,\s*)?)*)\s*\]'
-        matches = re.findall(pattern, content, re.DOTALL | re.MULTILINE)
-        
-        all_strings = []
-        
-        for match in matches:
-            strings_text = match.strip()
-            if strings_text:
-                # Extract individual quoted strings
-                string_pattern = r'"((?:[^"\\]|\\.)*)"'
-                individual_strings = re.findall(string_pattern, strings_text)
-                
-                for s in individual_strings:
-                    if s.strip():
-                        # Clean up escape sequences
-                        cleaned_string = s.replace('\\"', '"').replace('\\\\', '\\')
-                        all_strings.append(cleaned_string.strip())
-        
-        # Save to output file
-        output_filename = "visual_prompts_output.json"
-        with open(output_filename, 'w', encoding='utf-8') as outfile:
-            json.dump(all_strings, outfile, indent=2, ensure_ascii=False)
-        
-        print(f"✅ Successfully extracted {len(all_strings)} visual prompts")
-        print(f"✅ Saved to '{output_filename}'")
-        
-        return all_strings
-        
+        return save_prompts(extract_prompts_from_file(filename, key=key))
     except FileNotFoundError:
         print(f"❌ Error: File '{filename}' not found.")
         return []
@@ -47,47 +34,25 @@ def extract_visual_prompts_from_file(filename):
         print(f"❌ Error: {e}")
         return []
 
-def extract_visual_prompts_from_string(content, output_filename="visual_prompts_output.json"):
+def extract_visual_prompts_from_string(content, output_filename="visual_prompts_output.json", key='text'):
     """
     Alternative version that takes string content directly
     """
-    pattern = r'text\s*\[\s*((?:"(?:[^"\\]|\\.)*"(?:\s*,\s*)?)*)\s*\]'
-    matches = re.findall(pattern, content, re.DOTALL | re.MULTILINE)
-    
-    all_strings = []
-    
-    for match in matches:
-        strings_text = match.strip()
-        if strings_text:
-            string_pattern = r'"((?:[^"\\]|\\.)*)"'
-            individual_strings = re.findall(string_pattern, strings_text)
-            
-            for s in individual_strings:
-                if s.strip():
-                    cleaned_string = s.replace('\\"', '"').replace('\\\\', '\\')
-                    all_strings.append(cleaned_string.strip())
-    
-    # Save to output file
-    with open(output_filename, 'w', encoding='utf-8') as outfile:
-        json.dump(all_strings, outfile, indent=2, ensure_ascii=False)
-    
-    print(f"✅ Successfully extracted {len(all_strings)} visual prompts")
-    print(f"✅ Saved to '{output_filename}'")
-    
-    return all_strings
+    return save_prompts(extract_prompts_from_string(content, key=key), output_filename)
 
 # Main execution
 def main():
-    # Method 1: Read from file
-    filename = "paste.txt"
-    visual_prompts = extract_visual_prompts_from_file(filename)
-    
+    # Method 1: Read from file; pass "" as the second argument to take every string array
+    filename = sys.argv[1] if len(sys.argv) > 1 else "paste.txt"
+    key = sys.argv[2] if len(sys.argv) > 2 else "text"
+    visual_prompts = extract_visual_prompts_from_file(filename, key=key)
+
     # Display first few examples for verification
     if visual_prompts:
         print(f"\n📋 First 3 examples:")
         for i, prompt in enumerate(visual_prompts[:3]):
             print(f"[{i}]: {prompt[:100]}...")
-    
+
     return visual_prompts
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WhiskSettings, BulkImageRequest, ImagePrompt
+from .models import WhiskSettings, BulkImageRequest, ImagePrompt, ProviderCredential
 
 @admin.register(WhiskSettings)
 class WhiskSettingsAdmin(admin.ModelAdmin):
@@ -13,3 +13,10 @@ class WhiskSettingsAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         # Prevent deletion of the only instance
         return False
+
+@admin.register(ProviderCredential)
+class ProviderCredentialAdmin(admin.ModelAdmin):
+    list_display = ('label', 'api_provider', 'project_id', 'weight', 'daily_quota', 'is_active', 'updated_at')
+    list_filter = ('api_provider', 'is_active')
+    list_editable = ('weight', 'daily_quota', 'is_active')
+    readonly_fields = ('created_at', 'updated_at')
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class ImageGeneratorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'image_generator'
+
+    def ready(self):
+        from . import metrics, settings_cache
+        from .models import ImageFXSettings, ProviderCredential, WhiskSettings
+
+        for model in (WhiskSettings, ImageFXSettings, ProviderCredential):
+            post_save.connect(settings_cache.on_settings_saved, sender=model, dispatch_uid=f'settings_cache_{model.__name__}_save')
+            post_delete.connect(settings_cache.on_settings_saved, sender=model, dispatch_uid=f'settings_cache_{model.__name__}_delete')
+        connection_created.connect(metrics.install_query_counter, dispatch_uid='metrics_query_counter')
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+import httpx
+from . import events, generation, http_client, leases, metrics, rate_limit, renditions, scheduler, transitions
+from .exceptions import CircuitOpenError, ProviderError, ServerError
+from .models import ImagePrompt
+from .redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTransport:
+    """generation.SyncTransport for an event loop
+
+    Blocking helpers run in threads, and upstream calls go through an httpx
+    client and an asyncio Redis client for the rate limiter.
+    """
+
+    def __init__(self, http, redis_client):
+        self.http = http
+        self.redis = redis_client
+
+    async def run(self, func, *args):
+        return await sync_to_async(func)(*args)
+
+    async def offload(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    def slot(self, provider, auth_token):
+        return rate_limit.aprovider_slot(provider, auth_token, self.redis)
+
+    async def post(self, provider, url, headers, data):
+        started = time.monotonic()
+        status = 'error'
+        try:
+            response = await self.http.post(url, headers=headers, json=data)
+            status = response.status_code
+            return response
+        except httpx.HTTPError as e:
+            raise ServerError(f'{provider} request failed: {e}', provider) from e
+        finally:
+            await metrics.aobserve(
+                self.redis, 'image_generator_upstream_request_seconds',
+                time.monotonic() - started, {'provider': provider, 'status': status}
+            )
+
+
+class AsyncGenerationEngine:
+    """Keep up to ``concurrency`` prompts in flight from a single process
+
+    Pending prompts are claimed from the database and generated by the same
+    generation coroutines as generate_image_task, over an AsyncTransport so
+    waiting on the upstream costs a coroutine instead of a worker process.
+    """
+
+    def __init__(self, concurrency=50, poll_interval=2.0, max_retries=3):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.http = None
+        self.redis = None
+        self.transport = None
+        self.stopping = False
+        self.active = set()
+        # One lease owner for the whole process; heartbeats renew every claimed prompt at once
+        self.owner = leases.new_owner()
+        self.leased = set()
+
+    async def run(self, stop_when_idle=False):
+        self.http = http_client.create_async_client(self.concurrency)
+        self.redis = get_async_redis()
+        self.transport = AsyncTransport(self.http, self.redis)
+        logger.info(f"Async generation engine {self.owner} started with {self.concurrency} slots")
+        heartbeat = asyncio.create_task(self.heartbeat())
+        try:
+            while not self.stopping:
+                free = self.concurrency - len(self.active)
+                # Spread free slots across bulk requests by priority, as the Celery scheduler does
+                prompt_ids = await sync_to_async(scheduler.claim_prompts)(free, self.owner) if free else []
+                self.leased.update(prompt_ids)
+                for prompt_id in prompt_ids:
+                    task = asyncio.create_task(self.process_prompt(prompt_id))
+                    self.active.add(task)
+                    task.add_done_callback(self.active.discard)
+                if not prompt_ids:
+                    if stop_when_idle and not self.active:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+            if self.active:
+                logger.info(f"Waiting for {len(self.active)} prompts to finish")
+                await asyncio.gather(*self.active, return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+            await self.http.aclose()
+            await self.redis.aclose()
+
+    def stop(self):
+        self.stopping = True
+
+    async def heartbeat(self):
+        """Renew the leases on every prompt this engine is still working on"""
+        while True:
+            await asyncio.sleep(settings.PROMPT_LEASE_HEARTBEAT_SECONDS)
+            if not self.leased:
+                continue
+            try:
+                renewed = await sync_to_async(leases.extend)(list(self.leased), self.owner)
+            except Exception as e:
+                logger.warning(f"Could not renew prompt leases: {e}")
+                continue
+            if renewed < len(self.leased):
+                logger.warning(f"Lost the lease on {len(self.leased) - renewed} prompt(s); they were reaped or reset")
+
+    async def process_prompt(self, prompt_id):
+        try:
+            await self.generate_prompt(prompt_id)
+        finally:
+            self.leased.discard(prompt_id)
+
+    async def generate_prompt(self, prompt_id):
+        """Generate one claimed prompt, retrying transient errors in place"""
+        image_prompt = await ImagePrompt.objects.select_related('bulk_request').defer('generated_image').aget(id=prompt_id)
+        bulk_request = image_prompt.bulk_request
+        variant_hashes = []
+        providers = generation.failover_order(bulk_request.failover_policy, image_prompt.api_provider, bulk_request.candidates_count)
+        await sync_to_async(events.publish_prompt_status)(image_prompt)
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                stored_images, cache_hit, generated_provider = await generation.agenerate_images_with_failover(
+                    self.transport,
+                    providers,
+                    image_prompt.prompt_text,
+                    bypass_cache=bulk_request.bypass_cache,
+                    count=bulk_request.candidates_count
+                )
+                if not stored_images:
+                    raise Exception('Failed to generate image (empty response).')
+                image_prompt.set_image(stored_images[0], generated_provider)
+                await image_prompt.areplace_variants(stored_images)
+                if len(stored_images) > 1:
+                    variant_hashes = [image.sha256 for image in stored_images]
+                image_prompt.status = 'completed'
+                source = f'{generated_provider} cache' if cache_hit else generated_provider
+                logger.info(f"Stored {len(stored_images)} image(s) from {source} for prompt {prompt_id}")
+                break
+            except CircuitOpenError as e:
+                # Does not count as an attempt, as in generate_image_task
+                delay = (e.retry_after or settings.CIRCUIT_BREAKER_COOLDOWN) + random.uniform(0, settings.CIRCUIT_BREAKER_COOLDOWN)
+                logger.warning(f"Deferring prompt {prompt_id} for {delay:.0f}s: {e}")
+                reason = type(e).__name__
+            except ProviderError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    logger.error(f"Error generating image for prompt {prompt_id}: {e}")
+                    image_prompt.status = 'failed'
+                    break
+                delay = generation.retry_countdown(attempt, e.retry_after)
+                attempt += 1
+                logger.warning(f"Retryable error for prompt {prompt_id} (attempt {attempt}), retrying in {delay:.0f}s: {e}")
+                reason = type(e).__name__
+            except Exception as e:
+                logger.error(f"Error generating image for prompt {prompt_id}: {e}")
+                image_prompt.status = 'failed'
+                break
+            if self.stopping:
+                # Hand the prompt back rather than holding shutdown for a long backoff
+                image_prompt.status = 'pending'
+                break
+            if delay > settings.GENERATION_MAX_COUNTDOWN:
+                # Free the slot; the scheduler leaves the prompt alone until the wait is over
+                logger.warning(f"Handing prompt {prompt_id} back to the scheduler for {delay:.0f}s")
+                image_prompt.status = 'pending'
+                image_prompt.defer_until = timezone.now() + timedelta(seconds=delay)
+                break
+            await metrics.ainc(self.redis, 'image_generator_task_retries_total', {'task': 'async_engine', 'reason': reason})
+            await asyncio.sleep(delay)
+        await metrics.aobserve(
+            self.redis, 'image_generator_task_seconds', time.monotonic() - started,
+            {'task': 'async_engine', 'state': image_prompt.status}
+        )
+
+        # Transactional status change that also moves the bulk request's counters
+        saved = await sync_to_async(transitions.transition_prompt)(
+            image_prompt, image_prompt.status, ['processing'], fields=[*ImagePrompt.IMAGE_FIELDS, 'defer_until'], owner=self.owner
+        )
+        if not saved:
+            logger.warning(f"Prompt {prompt_id} was moved on by another process; discarding this result")
+            return
+        await sync_to_async(events.publish_prompt_status)(image_prompt, variant_hashes)
+        if image_prompt.status == 'completed':
+            await self.create_renditions(image_prompt)
+
+    async def create_renditions(self, image_prompt):
+        try:
+            if not await sync_to_async(renditions.reuse_renditions)(image_prompt):
+                await asyncio.to_thread(renditions.apply_renditions, image_prompt)
+        except Exception as e:
+            logger.error(f"Error creating renditions for prompt {image_prompt.id}: {e}")
+            return
+        await image_prompt.asave(update_fields=['thumbnail_hash', 'preview_hash', 'updated_at'])
+        await sync_to_async(events.publish_prompt_status)(image_prompt)
@@ -0,0 +1,111 @@
+import logging
+import time
+from contextlib import contextmanager
+import redis
+from django.conf import settings
+from .exceptions import CircuitOpenError, ProviderError
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'image_generator:circuit'
+
+
+def _key(provider, name):
+    return f'{KEY_PREFIX}:{provider}:{name}'
+
+
+def _now():
+    return time.time()
+
+
+def before_call(provider):
+    """Raise CircuitOpenError unless a call to the provider may go ahead
+
+    While open, every call is refused. Once the cooldown has passed the
+    circuit is half-open: a single probe call is let through, and its outcome
+    closes or re-opens the circuit.
+    """
+    client = get_redis()
+    try:
+        open_until = client.get(_key(provider, 'open_until'))
+        if open_until is None:
+            return
+        remaining = float(open_until) - _now()
+        if remaining > 0:
+            raise CircuitOpenError(f'{provider} circuit is open', provider, retry_after=int(remaining) + 1)
+        probe_timeout = settings.CIRCUIT_BREAKER_COOLDOWN
+        if not client.set(_key(provider, 'probe'), 1, nx=True, ex=probe_timeout):
+            raise CircuitOpenError(f'{provider} circuit is half-open and a probe is running', provider, retry_after=probe_timeout)
+        logger.info(f"{provider} circuit half-open, sending probe request")
+    except redis.RedisError as e:
+        logger.warning(f"Circuit breaker unavailable for {provider}: {e}")
+
+
+def record_success(provider):
+    try:
+        get_redis().delete(_key(provider, 'open_until'), _key(provider, 'failures'), _key(provider, 'probe'))
+    except redis.RedisError as e:
+        logger.warning(f"Circuit breaker unavailable for {provider}: {e}")
+
+
+def record_failure(provider):
+    client = get_redis()
+    try:
+        failures_key = _key(provider, 'failures')
+        failures = client.incr(failures_key)
+        if failures == 1:
+            client.expire(failures_key, settings.CIRCUIT_BREAKER_WINDOW)
+        half_open = client.exists(_key(provider, 'open_until'))
+        if half_open or failures >= settings.CIRCUIT_BREAKER_THRESHOLD:
+            cooldown = settings.CIRCUIT_BREAKER_COOLDOWN
+            client.set(_key(provider, 'open_until'), _now() + cooldown, ex=cooldown * 10)
+            client.delete(_key(provider, 'probe'))
+            logger.warning(f"{provider} circuit opened for {cooldown}s after {failures} failures")
+    except redis.RedisError as e:
+        logger.warning(f"Circuit breaker unavailable for {provider}: {e}")
+
+
+def release_probe(provider):
+    """Let another call probe a half-open circuit; ours never reached the provider"""
+    try:
+        get_redis().delete(_key(provider, 'probe'))
+    except redis.RedisError as e:
+        logger.warning(f"Circuit breaker unavailable for {provider}: {e}")
+
+
+def record_outcome(provider, error=None):
+    """Update the circuit after a call that before_call let through"""
+    if error is None:
+        record_success(provider)
+    elif not error.reached_provider:
+        # Our own rate limiter or credential pool refused the call
+        release_probe(provider)
+    elif error.trips_circuit:
+        record_failure(provider)
+    else:
+        # The provider answered; a rejected prompt says nothing about its health
+        record_success(provider)
+
+
+@contextmanager
+def guard(provider):
+    """Run an upstream call under the provider's circuit breaker"""
+    before_call(provider)
+    try:
+        yield
+    except ProviderError as e:
+        record_outcome(provider, e)
+        raise
+    record_outcome(provider)
+
+
+def get_state(provider):
+    """Return 'closed', 'open' or 'half-open' for display"""
+    try:
+        open_until = get_redis().get(_key(provider, 'open_until'))
+    except redis.RedisError:
+        return 'unknown'
+    if open_until is None:
+        return 'closed'
+    return 'open' if float(open_until) > _now() else 'half-open'
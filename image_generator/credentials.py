@@ -0,0 +1,258 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+import redis
+from django.conf import settings
+from . import settings_cache
+from .exceptions import AuthExpiredError, ProviderError, RateLimitedError
+from .models import ImageFXSettings, ProviderCredential, WhiskSettings
+from .rate_limit import token_id
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'image_generator:credentials'
+# Credentials with an error rate this close to 1 still get picked now and then
+MIN_HEALTH = 0.05
+# Daily usage counters are kept a little past midnight UTC
+USAGE_KEY_TTL = 2 * 24 * 3600
+
+# Count one call against today's usage and the error window, which starts
+# with its first call. Returns {calls, errors} in the current window.
+RECORD_CALL_SCRIPT = """
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+local calls = redis.call('INCR', KEYS[2])
+if calls == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+local errors = tonumber(redis.call('GET', KEYS[3])) or 0
+if ARGV[1] == '1' then
+    errors = redis.call('INCR', KEYS[3])
+    if errors == 1 then
+        redis.call('EXPIRE', KEYS[3], math.max(1, redis.call('TTL', KEYS[2])))
+    end
+end
+return {calls, errors}
+"""
+
+
+class CredentialsExhaustedError(RateLimitedError):
+    """Every credential in the pool is cooling down or out of quota"""
+    # Our own pool said no; the provider itself is not misbehaving
+    trips_circuit = False
+    reached_provider = False
+
+
+class NoCredentialsError(ProviderError):
+    """The provider has no credentials configured, so it cannot be called"""
+    reached_provider = False
+
+
+def _key(credential, name):
+    return f'{KEY_PREFIX}:{credential.api_provider}:{token_id(credential.auth_token)}:{name}'
+
+
+def _today():
+    return datetime.now(dt_timezone.utc).strftime('%Y%m%d')
+
+
+def _seconds_until_midnight():
+    now = datetime.now(dt_timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((midnight - now).total_seconds()) + 1
+
+
+def load_credentials():
+    return list(ProviderCredential.objects.filter(is_active=True).exclude(auth_token=''))
+
+
+def get_pool(provider):
+    """Active credentials for a provider
+
+    Falls back to the single token on the provider's settings page, so an
+    installation without a pool keeps working unchanged.
+    """
+    pool = [
+        credential
+        for credential in settings_cache.get_settings(ProviderCredential, load_credentials)
+        if credential.api_provider == provider
+    ]
+    if provider == 'whisk' and not WhiskSettings.get_settings().project_id:
+        pool = [credential for credential in pool if credential.project_id]
+    if pool:
+        return pool
+    if provider == 'imagefx':
+        imagefx_settings = ImageFXSettings.get_settings()
+        if imagefx_settings.auth_token:
+            return [ProviderCredential(api_provider=provider, label='Settings token', auth_token=imagefx_settings.auth_token)]
+    else:
+        whisk_settings = WhiskSettings.get_settings()
+        if whisk_settings.auth_token and whisk_settings.project_id:
+            return [ProviderCredential(
+                api_provider=provider, label='Settings token',
+                auth_token=whisk_settings.auth_token, project_id=whisk_settings.project_id
+            )]
+    return []
+
+
+def is_configured(provider):
+    return bool(get_pool(provider))
+
+
+def whisk_project_id(credential):
+    """Project to generate in; credentials without their own use the settings page's"""
+    return credential.project_id or WhiskSettings.get_settings().project_id
+
+
+def _read_health(pool):
+    """Return a health dict per credential, read in one Redis round trip"""
+    pipe = get_redis().pipeline()
+    for credential in pool:
+        pipe.get(_key(credential, 'cooldown_until'))
+        pipe.get(_key(credential, f'used:{_today()}'))
+        pipe.get(_key(credential, 'calls'))
+        pipe.get(_key(credential, 'errors'))
+    values = pipe.execute()
+    now = time.time()
+    health = []
+    for index, credential in enumerate(pool):
+        cooldown_until, used, calls, errors = values[index * 4:index * 4 + 4]
+        calls = int(calls or 0)
+        errors = int(errors or 0)
+        health.append({
+            'cooldown': max(0, float(cooldown_until) - now) if cooldown_until else 0,
+            'used_today': int(used or 0),
+            'calls': calls,
+            'errors': errors,
+            'error_rate': errors / calls if calls else 0.0,
+        })
+    return health
+
+
+def choose(provider):
+    """Pick a credential for one upstream call
+
+    Credentials cooling down or out of daily quota are skipped. The rest are
+    picked at random in proportion to their weight, scaled down by their
+    recent error rate.
+    """
+    pool = get_pool(provider)
+    if not pool:
+        raise NoCredentialsError(f'No {provider} credentials configured', provider)
+    try:
+        health = _read_health(pool)
+    except redis.RedisError as e:
+        logger.warning(f"Credential health unavailable, picking {provider} credentials by weight only: {e}")
+        return random.choices(pool, [credential.weight for credential in pool])[0]
+
+    candidates, weights, retry_after = [], [], []
+    for credential, state in zip(pool, health):
+        if state['cooldown']:
+            retry_after.append(state['cooldown'])
+            continue
+        if credential.daily_quota and state['used_today'] >= credential.daily_quota:
+            retry_after.append(_seconds_until_midnight())
+            continue
+        score = 1.0
+        if state['calls'] >= settings.CREDENTIAL_MIN_CALLS:
+            score = max(MIN_HEALTH, 1 - state['error_rate'])
+        candidates.append(credential)
+        weights.append(credential.weight * score)
+    if not candidates:
+        raise CredentialsExhaustedError(
+            f'All {len(pool)} {provider} credentials are cooling down or out of quota',
+            provider, retry_after=int(min(retry_after)) + 1
+        )
+    return random.choices(candidates, weights)[0]
+
+
+def cool_down(credential, seconds, reason):
+    try:
+        get_redis().set(_key(credential, 'cooldown_until'), time.time() + seconds, ex=int(seconds) + 1)
+    except redis.RedisError as e:
+        logger.warning(f"Could not cool down credential {credential}: {e}")
+        return
+    logger.warning(f"Credential {credential} taken out of rotation for {int(seconds)}s: {reason}")
+
+
+def record_call(credential, failed):
+    """Count a call against the credential's daily quota and its error window"""
+    client = get_redis()
+    try:
+        calls, errors = client.eval(
+            RECORD_CALL_SCRIPT, 3,
+            _key(credential, f'used:{_today()}'), _key(credential, 'calls'), _key(credential, 'errors'),
+            1 if failed else 0, settings.CREDENTIAL_ERROR_WINDOW, USAGE_KEY_TTL
+        )
+        if failed and calls >= settings.CREDENTIAL_MIN_CALLS and errors / calls >= settings.CREDENTIAL_ERROR_THRESHOLD:
+            cool_down(credential, settings.CREDENTIAL_COOLDOWN, f'{errors} of its last {calls} calls failed')
+            # Start a fresh window once it is back in rotation
+            client.delete(_key(credential, 'calls'), _key(credential, 'errors'))
+    except redis.RedisError as e:
+        logger.warning(f"Could not record call for credential {credential}: {e}")
+
+
+def record_outcome(credential, error=None):
+    """Record the outcome of an upstream call made with ``credential``
+
+    A rejected token leaves the rotation until CREDENTIAL_AUTH_COOLDOWN has
+    passed, a throttled one for as long as the provider asked. Rejected
+    prompts count as healthy calls: the provider answered.
+    """
+    if error is None:
+        record_call(credential, failed=False)
+        return
+    if not error.reached_provider:
+        # Our own limiter or pool gave up; nothing reached the provider
+        return
+    record_call(credential, failed=error.trips_circuit or isinstance(error, AuthExpiredError))
+    if isinstance(error, AuthExpiredError):
+        cool_down(credential, settings.CREDENTIAL_AUTH_COOLDOWN, 'auth token rejected')
+    elif isinstance(error, RateLimitedError):
+        cool_down(credential, max(error.retry_after or 0, settings.CREDENTIAL_COOLDOWN), 'rate limited')
+
+
+@contextmanager
+def track(credential):
+    """Run an upstream call with ``credential`` and record its outcome"""
+    try:
+        yield
+    except ProviderError as e:
+        record_outcome(credential, e)
+        raise
+    record_outcome(credential)
+
+
+def get_pool_status(provider, in_flight=None):
+    """Per-credential health and quota use for display
+
+    ``in_flight`` maps token ids to their in-flight calls, as returned by
+    rate_limit.get_utilisation.
+    """
+    pool = get_pool(provider)
+    try:
+        health = _read_health(pool)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read {provider} credential health: {e}")
+        health = [None] * len(pool)
+    rows = []
+    for credential, state in zip(pool, health):
+        row = {
+            'credential': credential,
+            'token_id': token_id(credential.auth_token),
+            'in_flight': (in_flight or {}).get(token_id(credential.auth_token), 0),
+            'health': state,
+        }
+        if state is None:
+            row['state'] = 'unknown'
+        elif state['cooldown']:
+            row['state'] = 'cooling down'
+        elif credential.daily_quota and state['used_today'] >= credential.daily_quota:
+            row['state'] = 'quota exhausted'
+        else:
+            row['state'] = 'active'
+        rows.append(row)
+    return rows
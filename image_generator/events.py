@@ -0,0 +1,87 @@
+import json
+import logging
+import time
+import redis
+from .models import blob_url
+from .redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Browsers reconnect after this many milliseconds if the stream drops
+SSE_RETRY_MS = 3000
+# Comment lines keep proxies from closing an idle stream
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def bulk_channel(bulk_request_id):
+    return f'image_generator:bulk:{bulk_request_id}:events'
+
+
+def publish(bulk_request_id, event):
+    """Publish an event for a bulk request; never let Redis trouble fail the caller"""
+    try:
+        get_redis().publish(bulk_channel(bulk_request_id), json.dumps(event))
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish event for bulk request {bulk_request_id}: {e}")
+
+
+def publish_prompt_status(prompt, variant_hashes=None):
+    event = {
+        'type': 'prompt',
+        'id': prompt.id,
+        'status': prompt.status,
+        'image_url': prompt.image_url,
+        'thumbnail_url': blob_url(prompt.thumbnail_hash),
+        'preview_url': blob_url(prompt.preview_hash),
+        'generated_provider': prompt.generated_provider,
+    }
+    if variant_hashes:
+        event['variant_urls'] = [blob_url(image_hash) for image_hash in variant_hashes]
+    publish(prompt.bulk_request_id, event)
+
+
+def publish_bulk_status(bulk_request):
+    publish(bulk_request.id, {
+        'type': 'bulk',
+        'id': bulk_request.id,
+        'status': bulk_request.status,
+    })
+
+
+def format_sse(data, event=None):
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream_bulk_events(bulk_request_id):
+    """Yield Server-Sent Events for a bulk request until it completes"""
+    client = get_async_redis()
+    pubsub = client.pubsub()
+    await pubsub.subscribe(bulk_channel(bulk_request_id))
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        last_sent = time.monotonic()
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_HEARTBEAT_SECONDS)
+            if message is None:
+                if time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                continue
+
+            data = message['data']
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            event = json.loads(data)
+            yield format_sse(data, event.get('type'))
+            last_sent = time.monotonic()
+
+            if event.get('type') == 'bulk' and event.get('status') == 'completed':
+                break
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,79 @@
+import time
+from email.utils import parsedate_to_datetime
+
+
+class ProviderError(Exception):
+    """An image provider call failed
+
+    ``retryable`` tells the task whether trying again later can help,
+    ``trips_circuit`` whether the failure counts towards opening the
+    provider's circuit breaker, and ``reached_provider`` whether the call
+    went out at all; errors we raise ourselves before calling upstream say
+    nothing about the provider's health.
+    """
+    retryable = False
+    trips_circuit = False
+    reached_provider = True
+
+    def __init__(self, message, provider=None, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RateLimitedError(ProviderError):
+    """The provider throttled us (HTTP 429)"""
+    retryable = True
+    trips_circuit = True
+
+
+class AuthExpiredError(ProviderError):
+    """The auth token was rejected; retrying will not help until it is replaced"""
+
+
+class ServerError(ProviderError):
+    """The provider failed, timed out or returned garbage (5xx, network errors)"""
+    retryable = True
+    trips_circuit = True
+
+
+class ContentRejectedError(ProviderError):
+    """The provider refused the prompt or returned no images for it"""
+
+
+class CircuitOpenError(ProviderError):
+    """The provider's circuit breaker is open, so the call was not attempted"""
+    retryable = True
+    reached_provider = False
+
+
+def parse_retry_after(value):
+    """Return the seconds a Retry-After header asks us to wait, or None"""
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, int(parsedate_to_datetime(value).timestamp() - time.time()))
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_response(provider, response):
+    """Raise the ProviderError matching a non-2xx upstream response"""
+    if 200 <= response.status_code < 300:
+        return
+    status_code = response.status_code
+    message = f'{provider} returned HTTP {status_code}: {response.text[:200]}'
+    if status_code == 429:
+        raise RateLimitedError(message, provider, status_code, parse_retry_after(response.headers.get('Retry-After')))
+    if status_code in (401, 403):
+        raise AuthExpiredError(message, provider, status_code)
+    if status_code >= 500:
+        raise ServerError(message, provider, status_code, parse_retry_after(response.headers.get('Retry-After')))
+    if status_code == 400:
+        raise ContentRejectedError(message, provider, status_code)
+    raise ProviderError(message, provider, status_code)
@@ -0,0 +1,265 @@
+import base64
+import logging
+import random
+from contextlib import asynccontextmanager
+import requests
+from django.conf import settings
+from . import whisk, imagefx, generation_cache, circuit_breaker, credentials, http_client, rate_limit
+from .exceptions import AuthExpiredError, CircuitOpenError, ProviderError, RateLimitedError, ServerError
+from .storage import get_image_store
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ['whisk', 'imagefx']
+# Failures that say the provider, not the prompt, is in trouble; another provider may succeed
+FAILOVER_ERRORS = (RateLimitedError, ServerError, AuthExpiredError, CircuitOpenError)
+
+
+def provider_params(api_provider):
+    """Return the (model, aspect ratio, seed) a provider client sends upstream"""
+    client = imagefx if api_provider == 'imagefx' else whisk
+    return client.IMAGE_MODEL, client.ASPECT_RATIO, client.SEED
+
+
+def check_provider_configured(api_provider):
+    """Raise if the provider's credentials have not been set up yet"""
+    if credentials.is_configured(api_provider):
+        return
+    if api_provider == 'imagefx':
+        raise Exception('ImageFX API settings not configured. Please configure auth token.')
+    raise Exception('Whisk API settings not configured. Please configure auth token and project ID.')
+
+
+class SyncTransport:
+    """Runs each generation step in the calling thread, for Celery tasks and views
+
+    The generation steps below are written once as coroutines and take a
+    transport for everything that blocks: Redis and database helpers
+    (``run``), CPU-heavy work (``offload``), the rate-limited slot and the
+    HTTP call. None of these methods ever suspends, so run_sync drives a
+    coroutine over this transport to completion without an event loop. The
+    async engine passes its own transport with the same methods.
+    """
+
+    async def run(self, func, *args):
+        return func(*args)
+
+    async def offload(self, func, *args):
+        return func(*args)
+
+    @asynccontextmanager
+    async def slot(self, provider, auth_token):
+        with rate_limit.provider_slot(provider, auth_token):
+            yield
+
+    async def post(self, provider, url, headers, data):
+        try:
+            return http_client.post(provider, url, headers=headers, json=data)
+        except requests.RequestException as e:
+            raise ServerError(f'{provider} request failed: {e}', provider) from e
+
+
+def run_sync(coroutine):
+    """Return the result of a generation coroutine running over SyncTransport"""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError('Generation coroutine suspended; use an async transport')
+
+
+async def acall_provider(transport, api_provider, prompt_text, count=1):
+    """Call the provider's API and return its raw imagePanels response
+
+    Takes a credential from the pool and an upstream slot from the rate
+    limiter, and records the outcome against both the credential and the
+    provider's circuit breaker. Raises a ProviderError subclass on failure,
+    including CircuitOpenError without calling upstream while the circuit is
+    open.
+    """
+    await transport.run(circuit_breaker.before_call, api_provider)
+    try:
+        credential = await transport.run(credentials.choose, api_provider)
+        if api_provider == 'imagefx':
+            url, headers, data = imagefx.build_generate_request(
+                credential.auth_token, prompt_text, count=min(count, imagefx.MAX_CANDIDATES)
+            )
+            parse = lambda response: imagefx.format_images(imagefx.parse_generate_response(response))
+        else:
+            project_id = await transport.run(credentials.whisk_project_id, credential)
+            url, headers, data = whisk.build_generate_request(prompt_text, credential.auth_token, project_id)
+            parse = whisk.parse_generate_response
+        try:
+            async with transport.slot(api_provider, credential.auth_token):
+                response = await transport.post(api_provider, url, headers, data)
+            result = parse(response)
+        except ProviderError as e:
+            await transport.run(credentials.record_outcome, credential, e)
+            raise
+        await transport.run(credentials.record_outcome, credential)
+    except ProviderError as e:
+        await transport.run(circuit_breaker.record_outcome, api_provider, e)
+        raise
+    await transport.run(circuit_breaker.record_outcome, api_provider)
+    return result
+
+
+def call_provider(api_provider, prompt_text, count=1):
+    return run_sync(acall_provider(SyncTransport(), api_provider, prompt_text, count))
+
+
+def store_response_images(image_data, limit=1):
+    """Decode up to ``limit`` images from a provider response into the image store"""
+    store = get_image_store()
+    stored_images = []
+    for panel in image_data.get('imagePanels', []):
+        for image in panel.get('generatedImages', []):
+            encoded_image = image.get('encodedImage')
+            if not encoded_image:
+                continue
+            stored_images.append(store.save(base64.b64decode(encoded_image)))
+            if len(stored_images) >= limit:
+                return stored_images
+    return stored_images
+
+
+async def arequest_images(transport, api_provider, prompt_text, count=1):
+    """Collect ``count`` distinct images using as few upstream calls as possible
+
+    ImageFX fills up to four variants per call; providers that return a single
+    image are called again. Stops early if a call only repeats known images.
+    """
+    stored_images = []
+    seen = set()
+    for _ in range(max_provider_calls(api_provider, count)):
+        remaining = count - len(stored_images)
+        try:
+            image_data = await acall_provider(transport, api_provider, prompt_text, count=remaining)
+        except ProviderError as e:
+            if not stored_images:
+                raise
+            # Keep the variants we already have rather than losing them to a later call
+            logger.warning(f"Stopping after {len(stored_images)} of {count} images: {e}")
+            break
+        if not image_data:
+            break
+        # Decoding and hashing megabytes of base64 would stall an event loop
+        images = await transport.offload(store_response_images, image_data, remaining)
+        new_images = new_distinct_images(images, seen)
+        if not new_images:
+            break
+        stored_images.extend(new_images)
+        if len(stored_images) >= count:
+            break
+    return stored_images
+
+
+def request_images(api_provider, prompt_text, count=1):
+    return run_sync(arequest_images(SyncTransport(), api_provider, prompt_text, count))
+
+
+def max_provider_calls(api_provider, count):
+    """Upstream calls needed for ``count`` images when every call returns fresh ones"""
+    if api_provider == 'imagefx':
+        return -(-count // imagefx.MAX_CANDIDATES)
+    return count
+
+
+def new_distinct_images(images, seen):
+    """Drop images whose hash is already in ``seen`` and record the rest there"""
+    new_images = [image for image in images if image.sha256 not in seen]
+    seen.update(image.sha256 for image in new_images)
+    return new_images
+
+
+async def agenerate_images(transport, api_provider, prompt_text, bypass_cache=False, count=1):
+    """Generate ``count`` images for a prompt, reusing a cached result when one exists
+
+    Returns ``(stored_images, cache_hit)``; ``stored_images`` is empty when the
+    provider returned nothing usable and may be shorter than ``count``.
+    """
+    use_cache = generation_cache.is_enabled() and not bypass_cache
+    cache_key = generation_cache.make_cache_key(
+        api_provider, prompt_text, *provider_params(api_provider), candidates=count
+    )
+
+    if use_cache:
+        cached_images = await transport.run(generation_cache.lookup, cache_key)
+        if cached_images:
+            logger.info(f"Generation cache hit for {api_provider} prompt: {prompt_text[:50]}")
+            return cached_images, True
+
+    stored_images = await arequest_images(transport, api_provider, prompt_text, count)
+    if stored_images and generation_cache.is_enabled():
+        # Bypassing only skips the read; a fresh result still refreshes the cache
+        await transport.run(generation_cache.put, cache_key, api_provider, prompt_text, stored_images)
+    return stored_images, False
+
+
+def generate_images(api_provider, prompt_text, bypass_cache=False, count=1):
+    return run_sync(agenerate_images(SyncTransport(), api_provider, prompt_text, bypass_cache, count))
+
+
+def provider_cost(api_provider, count):
+    """Relative cost of ``count`` images: PROVIDER_COSTS per call times the calls needed"""
+    return settings.PROVIDER_COSTS.get(api_provider, 1.0) * max_provider_calls(api_provider, count)
+
+
+def failover_order(policy, api_provider, count=1):
+    """Providers to try for a prompt, in order, under a bulk request's failover policy
+
+    ``ordered`` tries the request's provider first and the other one next;
+    ``cost`` starts with whichever is cheapest for ``count`` images, the
+    request's provider winning ties.
+    """
+    if policy == 'ordered':
+        return [api_provider] + [provider for provider in PROVIDERS if provider != api_provider]
+    if policy == 'cost':
+        return sorted(PROVIDERS, key=lambda provider: (provider_cost(provider, count), provider != api_provider))
+    return [api_provider]
+
+
+def pick_failover_error(errors):
+    """The error to report once every provider failed
+
+    A retryable error wins, so the prompt is tried again rather than failed
+    because one of its providers is misconfigured.
+    """
+    return next((error for error in errors if error.retryable), errors[0])
+
+
+async def agenerate_images_with_failover(transport, providers, prompt_text, bypass_cache=False, count=1):
+    """Generate with the first of ``providers`` that is configured and healthy
+
+    Moves on to the next provider only after FAILOVER_ERRORS. Returns
+    ``(stored_images, cache_hit, provider)`` where ``provider`` produced the
+    images.
+    """
+    configured = [provider for provider in providers if await transport.run(credentials.is_configured, provider)]
+    if not configured:
+        await transport.run(check_provider_configured, providers[0])
+    errors = []
+    for api_provider in configured:
+        try:
+            stored_images, cache_hit = await agenerate_images(transport, api_provider, prompt_text, bypass_cache, count)
+            return stored_images, cache_hit, api_provider
+        except FAILOVER_ERRORS as e:
+            errors.append(e)
+            if api_provider != configured[-1]:
+                logger.warning(f"{api_provider} failed, failing over: {e}")
+    raise pick_failover_error(errors)
+
+
+def generate_images_with_failover(providers, prompt_text, bypass_cache=False, count=1):
+    return run_sync(agenerate_images_with_failover(SyncTransport(), providers, prompt_text, bypass_cache, count))
+
+
+def retry_countdown(retries, retry_after=None):
+    """Exponential backoff with jitter, never sooner than the provider asked for"""
+    backoff = min(settings.GENERATION_RETRY_BACKOFF_CAP, settings.GENERATION_RETRY_BACKOFF_BASE * 2 ** retries)
+    # Equal jitter: keep half the backoff, randomise the rest so retries spread out
+    countdown = backoff / 2 + random.uniform(0, backoff / 2)
+    if retry_after:
+        countdown = max(countdown, retry_after)
+    return countdown
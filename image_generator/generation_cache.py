@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import unicodedata
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from .models import GenerationCacheEntry
+from .redis_client import get_redis
+from .storage import StoredImage, get_image_store
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'image_generator:generation_cache:stats'
+
+
+def normalize_prompt(prompt_text):
+    """Collapse the differences users introduce when resubmitting the same prompt"""
+    prompt_text = unicodedata.normalize('NFKC', prompt_text)
+    return re.sub(r'\s+', ' ', prompt_text).strip()
+
+
+def make_cache_key(api_provider, prompt_text, model, aspect_ratio, seed, candidates=1):
+    payload = json.dumps({
+        'provider': api_provider,
+        'model': model,
+        'aspect_ratio': aspect_ratio,
+        'seed': seed,
+        'candidates': candidates,
+        'prompt': normalize_prompt(prompt_text),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_enabled():
+    return getattr(settings, 'GENERATION_CACHE_ENABLED', True)
+
+
+def _record(outcome):
+    try:
+        get_redis().hincrby(STATS_KEY, outcome, 1)
+    except redis.RedisError as e:
+        logger.debug(f"Could not record generation cache {outcome}: {e}")
+
+
+def get_stats():
+    """Return hit/miss counters and current cache size"""
+    try:
+        counters = {k.decode(): int(v) for k, v in get_redis().hgetall(STATS_KEY).items()}
+    except redis.RedisError:
+        counters = {}
+    hits = counters.get('hits', 0)
+    misses = counters.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': (hits / (hits + misses) * 100) if hits + misses else 0,
+        'entries': GenerationCacheEntry.objects.count(),
+    }
+
+
+def reset_stats():
+    get_redis().delete(STATS_KEY)
+
+
+def lookup(cache_key):
+    """Return the cached StoredImage list for a key, or None on a miss"""
+    ttl = timedelta(seconds=settings.GENERATION_CACHE_TTL)
+    entry = GenerationCacheEntry.objects.filter(
+        cache_key=cache_key,
+        created_at__gte=timezone.now() - ttl
+    ).only('id', 'images').first()
+
+    images = [StoredImage.from_dict(image) for image in entry.images] if entry else []
+    # An entry whose blob has gone missing is as good as no entry
+    store = get_image_store()
+    if not images or not all(store.exists(image.sha256) for image in images):
+        _record('misses')
+        return None
+
+    GenerationCacheEntry.objects.filter(id=entry.id).update(
+        hit_count=F('hit_count') + 1,
+        last_used_at=timezone.now()
+    )
+    _record('hits')
+    return images
+
+
+def put(cache_key, api_provider, prompt_text, stored_images):
+    """Remember the images a provider returned for a request"""
+    if not stored_images:
+        return
+    values = {
+        'api_provider': api_provider,
+        'prompt_text': normalize_prompt(prompt_text),
+        'images': [image.to_dict() for image in stored_images],
+        'created_at': timezone.now(),
+        'last_used_at': timezone.now(),
+    }
+    try:
+        GenerationCacheEntry.objects.update_or_create(cache_key=cache_key, defaults=values)
+    except IntegrityError:
+        # Another worker cached the same request at the same moment
+        pass
+
+    if random.random() < settings.GENERATION_CACHE_PRUNE_PROBABILITY:
+        prune()
+
+
+def prune():
+    """Drop expired entries, then the least recently used ones above the size cap"""
+    ttl = timedelta(seconds=settings.GENERATION_CACHE_TTL)
+    expired, _ = GenerationCacheEntry.objects.filter(created_at__lt=timezone.now() - ttl).delete()
+
+    evicted = 0
+    max_entries = settings.GENERATION_CACHE_MAX_ENTRIES
+    cutoff = (
+        GenerationCacheEntry.objects.order_by('-last_used_at')
+        .values_list('last_used_at', flat=True)[max_entries:max_entries + 1]
+        .first()
+    )
+    if cutoff is not None:
+        evicted, _ = GenerationCacheEntry.objects.filter(last_used_at__lte=cutoff).delete()
+
+    if expired or evicted:
+        logger.info(f"Pruned generation cache: {expired} expired, {evicted} evicted")
+    return expired, evicted
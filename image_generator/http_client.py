@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+import httpx
+import redis
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'image_generator:http:stats'
+
+_session = None
+_session_pid = None
+
+
+def _create_session():
+    session = requests.Session()
+    # Retries are handled by the task layer, which knows which errors are worth retrying
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+def get_session():
+    """Return this process's pooled session, recreated after a fork
+
+    Sockets must not be shared between a Celery parent and its forked children,
+    so each process builds its own pool on first use.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = _create_session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def create_async_client(max_connections):
+    """Build an httpx client for an asyncio engine, pooled like the sync session"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max(settings.HTTP_POOL_MAXSIZE, max_connections),
+        ),
+        headers={'Accept-Encoding': 'gzip, deflate'},
+    )
+
+
+def get_timeout():
+    """Separate connect and read timeouts for upstream calls"""
+    return (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+
+
+def _connections_opened(session):
+    """Total connections urllib3 has opened across this session's pools"""
+    total = 0
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+    return total
+
+
+def _record(provider, new_connections):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(STATS_KEY, f'{provider}:requests', 1)
+        if new_connections:
+            pipe.hincrby(STATS_KEY, f'{provider}:connections', new_connections)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug(f"Could not record HTTP stats: {e}")
+
+
+def post(provider, url, **kwargs):
+    """POST through the pooled session and count whether a new connection was needed"""
+    session = get_session()
+    kwargs.setdefault('timeout', get_timeout())
+    opened_before = _connections_opened(session)
+    started = time.monotonic()
+    status = 'error'
+    try:
+        response = session.post(url, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe('image_generator_upstream_request_seconds', time.monotonic() - started, {'provider': provider, 'status': status})
+        _record(provider, _connections_opened(session) - opened_before)
+
+
+def get_stats():
+    """Return requests, new connections and reuse ratio per provider across all processes"""
+    try:
+        raw = get_redis().hgetall(STATS_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read HTTP stats: {e}")
+        raw = {}
+    stats = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        provider, counter = field.split(':', 1)
+        stats.setdefault(provider, {'provider': provider, 'requests': 0, 'connections': 0})[counter] = int(value)
+    for provider_stats in stats.values():
+        requests_made = provider_stats['requests']
+        reused = max(0, requests_made - provider_stats['connections'])
+        provider_stats['reuse_ratio'] = reused / requests_made if requests_made else 0.0
+    return sorted(stats.values(), key=lambda provider_stats: provider_stats['provider'])
+
+
+def reset_stats():
+    get_redis().delete(STATS_KEY)
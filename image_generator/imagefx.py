@@ -1,9 +1,17 @@
 import requests
-from .models import ImageFXSettings
+from django.conf import settings
+from . import http_client, rate_limit
+from .exceptions import ContentRejectedError, ServerError, raise_for_response
 
-def generate_image_api(auth_token, prompt, count=4, aspect_ratio="IMAGE_ASPECT_RATIO_LANDSCAPE", model="IMAGEN_3_5", return_response=False):
-    """Generate images using the ImageFX API"""
-    url = "https://aisandbox-pa.googleapis.com/v1:runImageFx"
+IMAGE_MODEL = "IMAGEN_3_5"
+ASPECT_RATIO = "IMAGE_ASPECT_RATIO_LANDSCAPE"
+SEED = 0
+# Most candidates ImageFX returns from a single call
+MAX_CANDIDATES = 4
+
+def build_generate_request(auth_token, prompt, count=MAX_CANDIDATES, aspect_ratio=ASPECT_RATIO, model=IMAGE_MODEL, seed=SEED):
+    """Return the (url, headers, body) of a runImageFx call"""
+    url = f"{settings.PROVIDER_API_BASE_URL}/v1:runImageFx"
     headers = {
         "Authorization": f"Bearer {auth_token}",
         "Content-Type": "application/json"
@@ -12,7 +20,7 @@ def generate_image_api(auth_token, prompt, count=4, aspect_ratio="IMAGE_ASPECT_R
         "userInput": {
             "candidatesCount": count,
             "prompts": [prompt],
-            "seed": 0
+            "seed": seed
         },
         "aspectRatio": aspect_ratio,
         "modelInput": {
@@ -23,36 +31,43 @@ def generate_image_api(auth_token, prompt, count=4, aspect_ratio="IMAGE_ASPECT_R
             "tool": "IMAGE_FX"
         }
     }
+    return url, headers, data
+
+def parse_generate_response(response):
+    """Return the generated images of a runImageFx response or raise a ProviderError
+
+    Works with both ``requests`` and ``httpx`` responses.
+    """
+    raise_for_response('imagefx', response)
     
-    response = requests.post(url, headers=headers, json=data, timeout=60)
-    
-    if return_response:
-        return response
-    
-    if not response.ok:
-        print("Error:", response.status_code, response.text)
-        return None
-    
-    result = response.json()
+    try:
+        result = response.json()
+    except ValueError as e:
+        raise ServerError('imagefx returned invalid JSON', 'imagefx', response.status_code) from e
     if "imagePanels" not in result:
-        return None
+        raise ContentRejectedError('imagefx returned no images for the prompt', 'imagefx', response.status_code)
     
     return result["imagePanels"][0]["generatedImages"]
 
-def generate_image(prompt):
-    """Generate image using ImageFX API with settings from database"""
-    imagefx_settings = ImageFXSettings.get_settings()
-    if not imagefx_settings.auth_token:
-        return None
-    
-    # Use the new API function
-    generated_images = generate_image_api(imagefx_settings.auth_token, prompt)
-    if not generated_images:
-        return None
-    
-    # Format response to match expected structure
+def format_images(generated_images):
+    """Wrap ImageFX images in the imagePanels structure Whisk returns"""
     return {
         "imagePanels": [{
             "generatedImages": generated_images
         }]
-    }
\ No newline at end of file
+    }
+
+def generate_image_api(auth_token, prompt, count=MAX_CANDIDATES, aspect_ratio=ASPECT_RATIO, model=IMAGE_MODEL, return_response=False, seed=SEED):
+    """Generate images using the ImageFX API"""
+    url, headers, data = build_generate_request(auth_token, prompt, count, aspect_ratio, model, seed)
+    
+    try:
+        with rate_limit.provider_slot('imagefx', auth_token):
+            response = http_client.post('imagefx', url, headers=headers, json=data)
+    except requests.RequestException as e:
+        raise ServerError(f'imagefx request failed: {e}', 'imagefx') from e
+    
+    if return_response:
+        return response
+    
+    return parse_generate_response(response)
@@ -0,0 +1,107 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from . import transitions
+from .models import ImagePrompt
+
+logger = logging.getLogger(__name__)
+
+
+def new_owner():
+    """Identify one claim: host, process and a random suffix"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.PROMPT_LEASE_SECONDS)
+
+
+def grant(prompt, owner):
+    """Set a fresh lease on an in-memory prompt before claiming it"""
+    prompt.lease_owner = owner
+    prompt.lease_expires_at = lease_expiry()
+
+
+def expired_q(now=None):
+    """Processing prompts nobody is heartbeating any more
+
+    Rows claimed before leases existed have no expiry; they count as
+    expired once they have not changed for a full lease period.
+    """
+    now = now or timezone.now()
+    return Q(status='processing') & (
+        Q(lease_expires_at__lt=now)
+        | Q(lease_expires_at__isnull=True, updated_at__lt=now - timedelta(seconds=settings.PROMPT_LEASE_SECONDS))
+    )
+
+
+def reap_expired(queryset=None):
+    """Return expired prompts to pending and give back their ids"""
+    queryset = ImagePrompt.objects.all() if queryset is None else queryset
+    # Another reaper may be at it; skip rows it already holds
+    return transitions.transition_prompts(queryset.filter(expired_q()), 'pending', skip_locked=True)
+
+
+def extend(prompt_ids, owner):
+    """Push out the leases ``owner`` still holds; returns how many it holds
+
+    updated_at is left alone so heartbeats do not show up in status polling.
+    """
+    return ImagePrompt.objects.filter(
+        id__in=prompt_ids, status='processing', lease_owner=owner
+    ).update(lease_expires_at=lease_expiry())
+
+
+class Heartbeat:
+    """Keep extending a prompt's lease from a background thread during a blocking call"""
+
+    def __init__(self, prompt_id, owner):
+        self.prompt_id = prompt_id
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'lease-heartbeat-{prompt_id}', daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(settings.PROMPT_LEASE_HEARTBEAT_SECONDS):
+                try:
+                    if not extend([self.prompt_id], self.owner):
+                        logger.warning(f"Lost the lease on prompt {self.prompt_id}; it was reaped or reset")
+                        return
+                except Exception as e:
+                    logger.warning(f"Could not extend lease on prompt {self.prompt_id}: {e}")
+        finally:
+            # Threads get their own database connection; do not leak it
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def hold(prompt_id, owner, seconds):
+    """Keep ``owner``'s lease for ``seconds`` more than usual, e.g. across a retry backoff"""
+    return bool(ImagePrompt.objects.filter(
+        id=prompt_id, status='processing', lease_owner=owner
+    ).update(lease_expires_at=lease_expiry() + timedelta(seconds=seconds)))
+
+
+def release_until(prompt, owner, seconds):
+    """Hand ``owner``'s prompt back to the scheduler, which leaves it pending for ``seconds``
+
+    For waits too long to park a countdown task in the broker. Returns False
+    if the prompt was moved on by another process.
+    """
+    prompt.defer_until = timezone.now() + timedelta(seconds=seconds)
+    return transitions.transition_prompt(prompt, 'pending', ['processing'], fields=['defer_until'], owner=owner)
@@ -0,0 +1,324 @@
+import json
+import os
+import re
+import resource
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.urls import resolve, reverse
+from image_generator import credentials, mock_provider
+from image_generator.models import BulkImageRequest, ImagePrompt, ImageVariant, ProviderCredential
+from image_generator.prompt_import import delete_bulk_request
+from .run_mock_provider import add_mock_arguments, mock_config
+
+REAL_PROVIDER_HOST = 'googleapis.com'
+# Metrics where a lower value is the better one, for --compare
+LOWER_IS_BETTER = {
+    'latency_p50', 'latency_p99', 'seconds', 'submit_seconds', 'zip_seconds', 'db_statements_per_image',
+    'db_transactions_per_image', 'harness_queries_per_image', 'harness_peak_rss_mb', 'workers_peak_rss_mb', 'failed',
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, round(fraction * (len(values) - 1)))]
+
+
+class QueryCounter:
+    """Database execute wrapper counting this thread's queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class RssSampler(threading.Thread):
+    """Track the peak combined resident memory of processes matching a pattern
+
+    Reads /proc, so worker memory is only reported on Linux.
+    """
+
+    def __init__(self, pattern, interval=0.5):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pattern = re.compile(pattern) if pattern else None
+        self.interval = interval
+        self.peak_kb = 0
+        self.processes = 0
+        self.finished = threading.Event()
+
+    def sample(self):
+        total_kb = 0
+        processes = 0
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            if int(pid) == os.getpid():
+                continue
+            try:
+                cmdline = Path(f'/proc/{pid}/cmdline').read_bytes().replace(b'\0', b' ').decode(errors='replace')
+                if not self.pattern.search(cmdline):
+                    continue
+                for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        processes += 1
+            except OSError:
+                continue
+        return total_kb, processes
+
+    def run(self):
+        if not self.pattern or not os.path.isdir('/proc'):
+            return
+        while not self.finished.wait(self.interval):
+            total_kb, processes = self.sample()
+            if total_kb > self.peak_kb:
+                self.peak_kb, self.processes = total_kb, processes
+
+    def stop(self):
+        self.finished.set()
+
+
+def db_statement_count():
+    """Statements run against the database so far, from every process
+
+    Uses pg_stat_statements when the extension is installed; otherwise falls
+    back to committed and rolled back transactions.
+    """
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('SELECT sum(calls) FROM pg_stat_statements WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())')
+            return int(cursor.fetchone()[0] or 0), 'statements'
+        except Exception:
+            cursor.execute('SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()')
+            return int(cursor.fetchone()[0] or 0), 'transactions'
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Command(BaseCommand):
+    help = 'Measure end-to-end throughput of a bulk request against the mock provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prompts', type=int, default=200, help='Prompts in the bulk request (default: 200)')
+        parser.add_argument('--provider', choices=['whisk', 'imagefx'], default='imagefx')
+        parser.add_argument('--candidates', type=int, default=1, help='Images per prompt (default: 1)')
+        parser.add_argument('--failover', choices=[value for value, _ in BulkImageRequest.FAILOVER_CHOICES], default='none')
+        parser.add_argument('--timeout', type=float, default=900, help='Seconds to wait for the request to finish (default: 900)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between status polls (default: 1)')
+        parser.add_argument('--no-zip', action='store_true', help='Skip downloading the ZIP')
+        parser.add_argument(
+            '--start-mock',
+            action='store_true',
+            help='Serve the mock provider from this process on the host and port of PROVIDER_API_BASE_URL',
+        )
+        parser.add_argument(
+            '--worker-pattern',
+            default=r'celery.*worker|run_async_engine',
+            help='Regex matched against process command lines to measure worker memory',
+        )
+        parser.add_argument('--results-dir', default='benchmarks/results', help='Where to save the results JSON')
+        parser.add_argument('--label', default='', help='Free-form note saved with the results')
+        parser.add_argument('--compare', metavar='RESULTS_JSON', help='Print the change against an earlier run')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the bulk request afterwards')
+        add_mock_arguments(parser)
+
+    def handle(self, *args, **options):
+        base_url = settings.PROVIDER_API_BASE_URL
+        if REAL_PROVIDER_HOST in base_url:
+            raise CommandError(
+                'PROVIDER_API_BASE_URL points at the real provider. Start `manage.py run_mock_provider` '
+                'and set PROVIDER_API_BASE_URL to it for this process and the workers.'
+            )
+        mock_server = None
+        if options['start_mock']:
+            address = urlsplit(base_url)
+            mock_server = mock_provider.serve_in_thread(address.hostname, address.port or 80, mock_config(options))
+            self.stdout.write(f'Mock provider serving on {base_url}')
+        self.ensure_credentials(options['provider'])
+        if options['failover'] != 'none':
+            for provider in ('whisk', 'imagefx'):
+                self.ensure_credentials(provider)
+
+        sampler = RssSampler(options['worker_pattern'])
+        sampler.start()
+        counter = QueryCounter()
+        statements_before, statement_kind = db_statement_count()
+        try:
+            with connection.execute_wrapper(counter):
+                bulk_request, timings = self.run_request(options)
+        finally:
+            sampler.stop()
+        # pg_stat counters are flushed by each backend about once a second
+        time.sleep(1.5)
+        statements_after, _ = db_statement_count()
+
+        prompts = ImagePrompt.objects.filter(bulk_request=bulk_request)
+        latencies = [
+            (updated_at - created_at).total_seconds()
+            for created_at, updated_at in prompts.filter(status='completed').values_list('created_at', 'updated_at')
+        ]
+        if bulk_request.candidates_count > 1:
+            images = ImageVariant.objects.filter(prompt__bulk_request=bulk_request).count()
+        else:
+            images = len(latencies)
+        image_bytes = prompts.aggregate(total=Sum('image_size'))['total'] or 0
+
+        metrics = {
+            'prompts': options['prompts'],
+            'completed': len(latencies),
+            'failed': prompts.filter(status='failed').count(),
+            'images': images,
+            'seconds': round(timings['generation'], 3),
+            'images_per_second': round(images / timings['generation'], 3) if timings['generation'] else None,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p99': percentile(latencies, 0.99),
+            'submit_seconds': round(timings['submit'], 3),
+            'status_polls': timings['polls'],
+            'zip_seconds': round(timings['zip'], 3) if timings['zip'] is not None else None,
+            'zip_bytes': timings['zip_bytes'],
+            'image_bytes_per_image': round(image_bytes / len(latencies)) if latencies else None,
+            f'db_{statement_kind}_per_image': round((statements_after - statements_before) / images, 2) if images else None,
+            'harness_queries_per_image': round(counter.count / images, 2) if images else None,
+            'harness_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'workers_peak_rss_mb': round(sampler.peak_kb / 1024, 1) if sampler.processes else None,
+            'worker_processes': sampler.processes,
+        }
+        results = {
+            'revision': git_revision(),
+            'label': options['label'],
+            'finished_at': datetime.now(dt_timezone.utc).isoformat(),
+            'engine': settings.GENERATION_ENGINE,
+            'params': {
+                key: options[key] for key in (
+                    'prompts', 'provider', 'candidates', 'failover', 'latency_median', 'latency_p99',
+                    'error_rate', 'rate_limit_rate', 'auth_error_rate', 'reject_rate', 'image_bytes', 'seed',
+                )
+            },
+            'metrics': metrics,
+        }
+        if mock_server:
+            results['mock'] = mock_server.RequestHandlerClass.stats.snapshot()
+            mock_server.shutdown()
+
+        for name, value in metrics.items():
+            self.stdout.write(f'{name:>28}: {value}')
+        path = self.save(results, options['results_dir'])
+        self.stdout.write(self.style.SUCCESS(f'Saved results to {path}'))
+        if options['compare']:
+            self.compare(options['compare'], results)
+        if options['cleanup']:
+            delete_bulk_request(bulk_request)
+
+    def ensure_credentials(self, provider):
+        """Give a provider a placeholder token the mock accepts, if it has none"""
+        if credentials.is_configured(provider):
+            return
+        ProviderCredential.objects.update_or_create(
+            api_provider=provider, label='benchmark',
+            defaults={'auth_token': 'benchmark-token', 'project_id': 'benchmark', 'is_active': True},
+        )
+        self.stdout.write(f'Added a placeholder {provider} credential labelled "benchmark"')
+
+    def run_request(self, options):
+        """Submit the bulk form, poll status until done and download the ZIP"""
+        allowed_hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        client = Client(HTTP_HOST=allowed_hosts[0] if allowed_hosts else 'localhost')
+        run_id = uuid.uuid4().hex[:8]
+        prompts = [f'Benchmark {run_id} prompt {index}: a lighthouse on a cliff at dusk' for index in range(options['prompts'])]
+
+        started = time.monotonic()
+        response = client.post(reverse('bulk_image_generator'), {
+            'title': f'Benchmark {run_id}',
+            'prompts': json.dumps(prompts),
+            'api_provider': options['provider'],
+            'candidates_count': options['candidates'],
+            'failover_policy': options['failover'],
+            'bypass_cache': 'on',
+        })
+        if response.status_code != 302:
+            raise CommandError(f'Bulk form returned HTTP {response.status_code}; are the provider settings valid?')
+        submitted = time.monotonic()
+        bulk_request_id = resolve(response.url).kwargs['bulk_request_id']
+        self.stdout.write(f'Bulk request #{bulk_request_id} created with {len(prompts)} prompts')
+
+        status_url = reverse('get_bulk_status', args=[bulk_request_id])
+        cursor = None
+        polls = 0
+        while True:
+            data = client.get(status_url, {'since': cursor} if cursor else {}).json()
+            polls += 1
+            cursor = data.get('cursor') or cursor
+            counts = data.get('counts')
+            if counts and counts['completed'] + counts['failed'] >= counts['total']:
+                break
+            if time.monotonic() - started > options['timeout']:
+                self.stdout.write(self.style.WARNING(f'Timed out after {options["timeout"]}s; are workers running?'))
+                break
+            if counts and polls % 10 == 0:
+                self.stdout.write(f'{counts["completed"]} completed, {counts["failed"]} failed of {counts["total"]}')
+            time.sleep(options['poll_interval'])
+        finished = time.monotonic()
+
+        zip_seconds = zip_bytes = None
+        if not options['no_zip']:
+            response = client.get(reverse('download_all_images', args=[bulk_request_id]))
+            zip_bytes = sum(len(chunk) for chunk in response.streaming_content)
+            zip_seconds = time.monotonic() - finished
+
+        timings = {
+            'submit': submitted - started,
+            'generation': finished - started,
+            'polls': polls,
+            'zip': zip_seconds,
+            'zip_bytes': zip_bytes,
+        }
+        return BulkImageRequest.objects.get(id=bulk_request_id), timings
+
+    def save(self, results, results_dir):
+        directory = Path(results_dir)
+        if not directory.is_absolute():
+            directory = Path(settings.BASE_DIR) / directory
+        directory.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        path = directory / f'{timestamp}-{results["revision"]}.json'
+        path.write_text(json.dumps(results, indent=2))
+        return path
+
+    def compare(self, path, results):
+        try:
+            previous = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+        self.stdout.write(f'\nAgainst {previous.get("revision")} ({previous.get("label") or "no label"}):')
+        for name, value in results['metrics'].items():
+            old = previous.get('metrics', {}).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            change = f'{(value - old) / old:+.1%}' if old else 'n/a'
+            line = f'{name:>28}: {old} -> {value} ({change})'
+            if value != old and (value < old) == (name in LOWER_IS_BETTER):
+                self.stdout.write(self.style.SUCCESS(line))
+            elif value != old:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
@@ -0,0 +1,220 @@
+import io
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from image_generator import stats
+from image_generator.models import BulkImageRequest, ImagePrompt
+
+# Title prefix of requests created by --seed, so --cleanup never touches real data
+SEED_TITLE = '[query budget seed]'
+SEED_PROMPTS_PER_REQUEST = 10000
+SEED_BATCH_SIZE = 5000
+# Share of seeded prompts in each status
+SEED_STATUSES = [('completed', 0.90), ('failed', 0.05), ('pending', 0.03), ('processing', 0.02)]
+
+
+# Queries each code path runs, however many prompts the request has. The
+# tests in image_generator.tests.test_query_budgets pin these exact numbers.
+QUERY_BUDGETS = {
+    'bulk_list': 4,
+    'bulk_list filtered': 4,
+    'bulk_status': 2,
+    'get_bulk_status': 2,
+    'get_bulk_status since': 2,
+    'retry_all_failed': 8,
+    'reset_stuck_prompts': 8,
+    'fix_stuck_images': 8,
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that hot views and commands stay within a fixed query budget and '
+        'that their queries use the intended indexes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk-id',
+            type=int,
+            help='Bulk request to exercise (default: the largest seeded request, else the newest)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            metavar='PROMPTS',
+            help=f'Insert this many synthetic prompts first, {SEED_PROMPTS_PER_REQUEST} per bulk request',
+        )
+        parser.add_argument(
+            '--cleanup',
+            action='store_true',
+            help='Delete previously seeded requests and exit',
+        )
+        parser.add_argument(
+            '--skip-explain',
+            action='store_true',
+            help='Only check query counts, not the query plans',
+        )
+
+    def handle(self, *args, **options):
+        if options.get('cleanup'):
+            self.cleanup()
+            return
+        if options.get('seed'):
+            self.seed(options['seed'])
+
+        bulk_request = self.get_bulk_request(options.get('bulk_id'))
+        self.stdout.write(f'Using bulk request {bulk_request.id} with {bulk_request.total_count} prompts')
+
+        failures = self.check_budgets(bulk_request)
+        if not options.get('skip_explain'):
+            failures += self.check_plans(bulk_request)
+
+        if failures:
+            raise CommandError(f'{failures} check(s) failed')
+        self.stdout.write(self.style.SUCCESS('All query budget checks passed'))
+
+    def get_bulk_request(self, bulk_id):
+        bulk_requests = BulkImageRequest.objects.all()
+        if bulk_id:
+            bulk_request = bulk_requests.filter(id=bulk_id).first()
+        else:
+            bulk_request = (
+                bulk_requests.filter(title__startswith=SEED_TITLE).order_by('-total_count').first()
+                or bulk_requests.order_by('-created_at').first()
+            )
+        if not bulk_request:
+            raise CommandError('No bulk request to check; pass --bulk-id or --seed')
+        return bulk_request
+
+    def budgets(self, bulk_request):
+        """(name, callable) for every checked code path
+
+        Budgets are fixed: they must not grow with the number of prompts.
+        """
+        client = Client()
+        bulk_id = bulk_request.id
+        cursor = (timezone.now() - timedelta(minutes=1)).isoformat()
+        return [
+            ('bulk_list', lambda: client.get(reverse('bulk_list'))),
+            ('bulk_list filtered', lambda: client.get(reverse('bulk_list'), {'api_provider': 'whisk', 'page': 2})),
+            ('bulk_status', lambda: client.get(reverse('bulk_status', args=[bulk_id]))),
+            ('get_bulk_status', lambda: client.get(reverse('get_bulk_status', args=[bulk_id]))),
+            ('get_bulk_status since', lambda: client.get(reverse('get_bulk_status', args=[bulk_id]), {'since': cursor})),
+            ('retry_all_failed', lambda: client.post(reverse('retry_all_failed', args=[bulk_id]))),
+            ('reset_stuck_prompts', lambda: client.post(reverse('reset_stuck_prompts', args=[bulk_id]))),
+            ('fix_stuck_images', lambda: call_command('fix_stuck_images', bulk_id=bulk_id, include_pending=True, stdout=io.StringIO())),
+        ]
+
+    def check_budgets(self, bulk_request):
+        failures = 0
+        self.stdout.write('Query budgets:')
+        # Nothing may reach the broker while we exercise the retry paths
+        with override_settings(GENERATION_ENGINE='async', ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, call in self.budgets(bulk_request):
+                budget = QUERY_BUDGETS[name]
+                queries = self.count_queries(call)
+                if queries > budget:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f'  {name}: {queries} queries, budget {budget}'))
+                else:
+                    self.stdout.write(f'  {name}: {queries}/{budget} queries')
+        return failures
+
+    def count_queries(self, call):
+        """Run ``call`` inside a transaction that is always rolled back"""
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    call()
+                raise Rollback
+        except Rollback:
+            pass
+        return len([query for query in context.captured_queries if 'SAVEPOINT' not in query['sql']])
+
+    def plans(self, bulk_request):
+        """(name, queryset, index the planner is expected to use)"""
+        cutoff = timezone.now() - timedelta(minutes=5)
+        prompts = ImagePrompt.objects.all()
+        return [
+            ('stuck sweep', prompts.filter(status__in=['processing', 'pending'], updated_at__lt=cutoff).only('id'), 'imageprompt_active_updated_idx'),
+            ('lease reaper', prompts.filter(status='processing', lease_expires_at__lt=timezone.now()).only('id'), 'imageprompt_lease_idx'),
+            ('scheduler claim', prompts.filter(bulk_request_id=bulk_request.id, status='pending').filter(
+                Q(defer_until__isnull=True) | Q(defer_until__lte=timezone.now())
+            ).order_by('id').only('id')[:50], 'imageprompt_bulk_status_idx'),
+            ('failed of one request', prompts.filter(bulk_request_id=bulk_request.id, status='failed').only('id'), 'imageprompt_bulk_status_idx'),
+            ('status cursor', prompts.filter(bulk_request_id=bulk_request.id, updated_at__gt=timezone.now() - timedelta(seconds=10)).only('id'), 'imageprompt_bulk_updated_idx'),
+            ('bulk list page', BulkImageRequest.objects.order_by('-created_at')[:10], 'bulkrequest_created_idx'),
+        ]
+
+    def check_plans(self, bulk_request):
+        failures = 0
+        self.stdout.write('Query plans:')
+        for name, queryset, index in self.plans(bulk_request):
+            plan = queryset.explain()
+            if index in plan:
+                self.stdout.write(f'  {name}: uses {index}')
+            else:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'  {name}: expected {index}, got:'))
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+        return failures
+
+    def seed(self, total):
+        self.stdout.write(f'Seeding {total} prompts...')
+        now = timezone.now()
+        statuses = [status for status, _ in SEED_STATUSES]
+        weights = [weight for _, weight in SEED_STATUSES]
+        created = 0
+        while created < total:
+            size = min(SEED_PROMPTS_PER_REQUEST, total - created)
+            with transaction.atomic():
+                bulk_request = BulkImageRequest.objects.create(
+                    title=f'{SEED_TITLE} {created // SEED_PROMPTS_PER_REQUEST + 1}',
+                    status='processing',
+                    total_count=size,
+                )
+                for offset in range(0, size, SEED_BATCH_SIZE):
+                    ImagePrompt.objects.bulk_create([
+                        ImagePrompt(
+                            bulk_request=bulk_request,
+                            prompt_text=f'seeded prompt {created + offset + index}',
+                            status=random.choices(statuses, weights)[0],
+                        )
+                        for index in range(min(SEED_BATCH_SIZE, size - offset))
+                    ])
+                # Age everything but a sliver of recent activity, and leave some prompts stuck
+                bulk_request.prompts.update(updated_at=now - timedelta(days=1))
+                recent = bulk_request.prompts.filter(status='completed').values_list('id', flat=True)[:size // 100]
+                ImagePrompt.objects.filter(id__in=list(recent)).update(updated_at=now)
+                stats.record_bulk_created(bulk_request)
+            stats.reconcile_bulk_request(bulk_request.id)
+            created += size
+            self.stdout.write(f'  {created}/{total}')
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {ImagePrompt._meta.db_table}')
+            cursor.execute(f'ANALYZE {BulkImageRequest._meta.db_table}')
+
+    def cleanup(self):
+        seeded = BulkImageRequest.objects.filter(title__startswith=SEED_TITLE)
+        ids = list(seeded.values_list('id', flat=True))
+        for bulk_id in ids:
+            with transaction.atomic():
+                bulk_requests = BulkImageRequest.objects.filter(id=bulk_id).select_for_update()
+                stats.record_bulk_deleted(bulk_requests)
+                ImagePrompt.objects.filter(bulk_request_id=bulk_id).delete()
+                bulk_requests.delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {len(ids)} seeded bulk requests'))
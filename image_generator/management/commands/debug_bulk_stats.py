@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from image_generator.models import BulkImageRequest, ImagePrompt
+from image_generator.stats import count_prompts
 from django.db.models import Count, Q
 
 
@@ -41,23 +42,27 @@ class Command(BaseCommand):
                 self.stdout.write(f'  {status}: {count}')
             self.stdout.write('')
 
-            # Count by status using annotations (like bulk_list view)
-            bulk_with_counts = BulkImageRequest.objects.filter(id=bulk_id).annotate(
-                completed_count=Count('prompts', filter=Q(prompts__status='completed')),
-                failed_count=Count('prompts', filter=Q(prompts__status='failed')),
-                processing_count=Count('prompts', filter=Q(prompts__status='processing')),
-                pending_count=Count('prompts', filter=Q(prompts__status='pending')),
-                total_count=Count('prompts')
-            ).first()
-
-            self.stdout.write('Status counts (annotation method - used in bulk_list view):')
-            self.stdout.write(f'  completed: {bulk_with_counts.completed_count}')
-            self.stdout.write(f'  failed: {bulk_with_counts.failed_count}')
-            self.stdout.write(f'  processing: {bulk_with_counts.processing_count}')
-            self.stdout.write(f'  pending: {bulk_with_counts.pending_count}')
-            self.stdout.write(f'  total: {bulk_with_counts.total_count}')
+            # Counters stored on the request (used in bulk_list view)
+            self.stdout.write('Status counts (stored counters - used in bulk_list view):')
+            self.stdout.write(f'  completed: {bulk_request.completed_count}')
+            self.stdout.write(f'  failed: {bulk_request.failed_count}')
+            self.stdout.write(f'  processing: {bulk_request.in_flight_count}')
+            self.stdout.write(f'  pending: {bulk_request.pending_count}')
+            self.stdout.write(f'  total: {bulk_request.total_count}')
             self.stdout.write('')
 
+            drift = {
+                field: (getattr(bulk_request, field), value)
+                for field, value in count_prompts(bulk_id).items()
+                if getattr(bulk_request, field) != value
+            }
+            if drift:
+                self.stdout.write(self.style.WARNING(
+                    'Stored counters are out of date; run reconcile_bulk_stats --bulk-id '
+                    f'{bulk_id} to rebuild them'
+                ))
+                self.stdout.write('')
+
             # Show actual status distribution
             self.stdout.write('Actual status distribution (direct count):')
             for status in ['pending', 'processing', 'completed', 'failed']:
@@ -0,0 +1,56 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from image_generator import prompt_extract, prompt_import
+from image_generator.models import BulkImageRequest
+
+
+class Command(BaseCommand):
+    help = 'Extract prompts from text arrays in a file and optionally start a bulk request with them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Source file, or '-' for stdin")
+        parser.add_argument(
+            '--key',
+            default='text',
+            help="Name in front of the prompt arrays, e.g. text [ ... ]; pass '' to take every string array",
+        )
+        parser.add_argument('--title', help='Create a bulk request with this title from the extracted prompts')
+        parser.add_argument('--provider', choices=['whisk', 'imagefx'], default='whisk')
+        parser.add_argument('--candidates', type=int, default=1, help='Images to keep per prompt')
+        parser.add_argument('--priority', type=int, choices=[value for value, _ in BulkImageRequest.PRIORITY_CHOICES], default=2)
+        parser.add_argument('--failover', choices=[value for value, _ in BulkImageRequest.FAILOVER_CHOICES], default='none')
+        parser.add_argument('--bypass-cache', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            prompts = prompt_extract.extract_prompts(prompt_extract.read_chunks(sys.stdin), key=options['key'])
+        else:
+            prompts = prompt_extract.extract_prompts_from_file(options['path'], key=options['key'])
+
+        try:
+            if not options['title']:
+                count = 0
+                for count, prompt in enumerate(prompts, 1):
+                    if count <= 3:
+                        self.stdout.write(f'[{count}] {prompt[:100]}')
+                self.stdout.write(self.style.SUCCESS(f'Found {count} prompts; pass --title to start a bulk request with them'))
+                return
+
+            bulk_request = prompt_import.create_bulk_request(
+                prompts,
+                progress=lambda imported: self.stdout.write(f'Imported {imported} prompts'),
+                title=options['title'],
+                api_provider=options['provider'],
+                bypass_cache=options['bypass_cache'],
+                candidates_count=min(max(options['candidates'], 1), BulkImageRequest.MAX_CANDIDATES),
+                priority=options['priority'],
+                failover_policy=options['failover'],
+            )
+        except FileNotFoundError:
+            raise CommandError(f"File '{options['path']}' not found")
+        except UnicodeDecodeError as e:
+            raise CommandError(f'Source is not valid UTF-8: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created bulk request #{bulk_request.id} with {bulk_request.total_count} prompts ({bulk_request.status})'
+        ))
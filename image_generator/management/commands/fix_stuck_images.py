@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
+from image_generator.leases import expired_q
 from image_generator.models import ImagePrompt, BulkImageRequest
-from image_generator.tasks import generate_image_task
+from image_generator.tasks import queue_generation
+from image_generator.transitions import transition_prompts
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.db.models import Q
@@ -24,7 +26,7 @@ class Command(BaseCommand):
             '--older-than',
             type=int,
             default=10,
-            help='Reset images stuck in processing or pending for more than X minutes (default: 10)',
+            help='Reset images stuck in pending for more than X minutes (default: 10); processing images are reset once their lease expires',
         )
         parser.add_argument(
             '--include-pending',
@@ -41,19 +43,16 @@ class Command(BaseCommand):
         # Calculate cutoff time
         cutoff_time = timezone.now() - timedelta(minutes=older_than_minutes)
         
-        # Build status filter
-        status_filter = Q(status='processing')
+        # Build status filter; processing prompts with a live lease are still being generated
+        status_filter = expired_q()
         if include_pending:
-            status_filter |= Q(status='pending')
+            status_filter |= Q(status='pending', updated_at__lt=cutoff_time)
         
         if bulk_id:
             # Fix stuck images for specific bulk request
             try:
                 bulk_request = BulkImageRequest.objects.get(id=bulk_id)
-                stuck_prompts = bulk_request.prompts.filter(
-                    status_filter,
-                    updated_at__lt=cutoff_time
-                )
+                stuck_prompts = bulk_request.prompts.filter(status_filter)
             except BulkImageRequest.DoesNotExist:
                 self.stdout.write(
                     self.style.ERROR(f'Bulk request with ID {bulk_id} not found')
@@ -61,42 +60,23 @@ class Command(BaseCommand):
                 return
         elif reset_all:
             # Fix all stuck images across all bulk requests
-            stuck_prompts = ImagePrompt.objects.filter(
-                status_filter,
-                updated_at__lt=cutoff_time
-            )
+            stuck_prompts = ImagePrompt.objects.filter(status_filter)
         else:
             self.stdout.write(
                 self.style.ERROR('Please specify either --bulk-id or --reset-all')
             )
             return
 
-        if not stuck_prompts.exists():
+        # One UPDATE ... RETURNING; the count is what was actually reset
+        reset_ids = transition_prompts(stuck_prompts, 'pending', skip_locked=True)
+        if not reset_ids:
             status_types = "processing/pending" if include_pending else "processing"
             self.stdout.write(
-                self.style.SUCCESS(f'No stuck {status_types} images found (older than {older_than_minutes} minutes)')
+                self.style.SUCCESS(f'No stuck {status_types} images found')
             )
             return
 
-        count = stuck_prompts.count()
-        self.stdout.write(f'Found {count} stuck images to reset...')
-
-        # Reset status and retry tasks
-        for prompt in stuck_prompts:
-            api_provider = prompt.api_provider or 'whisk'
-            self.stdout.write(f'Resetting prompt ID {prompt.id} ({api_provider}): {prompt.prompt_text[:50]}...')
-            prompt.status = 'pending'
-            prompt.save()
-            
-            # Retry the task
-            generate_image_task.delay(prompt.id)
-
+        queue_generation(reset_ids)
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully reset and retried {count} stuck images')
+            self.style.SUCCESS(f'Successfully reset and retried {len(reset_ids)} stuck images')
         )
-
-        # Update bulk request status if needed
-        if bulk_id:
-            bulk_request.status = 'processing'
-            bulk_request.save()
-            self.stdout.write(f'Updated bulk request {bulk_id} status to processing')
\ No newline at end of file
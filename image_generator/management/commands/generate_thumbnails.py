@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from image_generator.models import ImagePrompt
+from image_generator.renditions import apply_renditions
+from image_generator.tasks import create_image_renditions_task
+
+
+class Command(BaseCommand):
+    help = 'Backfill thumbnail and preview renditions for completed prompts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk-id',
+            type=int,
+            help='Only backfill prompts of a specific bulk request ID',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100,
+            help='Number of prompts loaded per query (default: 100)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate renditions even for prompts that already have them',
+        )
+        parser.add_argument(
+            '--queue',
+            action='store_true',
+            help='Enqueue Celery tasks instead of rendering in this process',
+        )
+
+    def handle(self, *args, **options):
+        bulk_id = options.get('bulk_id')
+        chunk_size = options['chunk_size']
+        force = options.get('force')
+        queue = options.get('queue')
+
+        prompts = ImagePrompt.objects.filter(status='completed').exclude(image_hash='')
+        if bulk_id:
+            prompts = prompts.filter(bulk_request_id=bulk_id)
+        if not force:
+            prompts = prompts.filter(thumbnail_hash='')
+
+        legacy_count = ImagePrompt.objects.filter(
+            status='completed', image_hash='', generated_image__isnull=False
+        ).count()
+        if legacy_count:
+            self.stdout.write(self.style.WARNING(
+                f'{legacy_count} completed prompts still hold base64 images; '
+                f'run migrate_images_to_store first to include them'
+            ))
+
+        total = prompts.count()
+        if not total:
+            self.stdout.write(self.style.SUCCESS('No prompts need renditions'))
+            return
+        self.stdout.write(f'Found {total} prompts to backfill...')
+
+        done = 0
+        failed = 0
+        last_id = 0
+        while True:
+            # Keyset pagination; rows are updated as we go so offsets would shift
+            chunk = list(
+                prompts.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'image_hash', 'thumbnail_hash', 'preview_hash')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            for prompt in chunk:
+                if queue:
+                    create_image_renditions_task.delay(prompt.id)
+                    done += 1
+                    continue
+                try:
+                    apply_renditions(prompt)
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f'Failed to render prompt {prompt.id}: {e}'))
+                    failed += 1
+                    continue
+                prompt.save(update_fields=['thumbnail_hash', 'preview_hash', 'updated_at'])
+                done += 1
+            self.stdout.write(f'Processed {done + failed}/{total} prompts')
+
+        action = 'Queued' if queue else 'Created'
+        self.stdout.write(
+            self.style.SUCCESS(f'{action} renditions for {done} prompts ({failed} failed)')
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from image_generator import generation_cache
+from image_generator.models import GenerationCacheEntry
+
+
+class Command(BaseCommand):
+    help = 'Show statistics for, prune or clear the generation result cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Remove expired entries and evict the least recently used ones above the size cap',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Remove every cache entry and reset the hit/miss counters',
+        )
+
+    def handle(self, *args, **options):
+        if options.get('clear'):
+            deleted, _ = GenerationCacheEntry.objects.all().delete()
+            generation_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS(f'Cleared {deleted} cache entries'))
+            return
+
+        if options.get('prune'):
+            expired, evicted = generation_cache.prune()
+            self.stdout.write(self.style.SUCCESS(f'Pruned {expired} expired and {evicted} evicted entries'))
+
+        stats = generation_cache.get_stats()
+        self.stdout.write('Generation cache statistics:')
+        self.stdout.write(f'  entries: {stats["entries"]}')
+        self.stdout.write(f'  hits: {stats["hits"]}')
+        self.stdout.write(f'  misses: {stats["misses"]}')
+        self.stdout.write(f'  hit rate: {stats["hit_rate"]:.1f}%')
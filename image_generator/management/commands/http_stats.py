@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from image_generator import http_client
+
+
+class Command(BaseCommand):
+    help = 'Show how often upstream HTTP calls reuse pooled keep-alive connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after showing them',
+        )
+
+    def handle(self, *args, **options):
+        stats = http_client.get_stats()
+        if not stats:
+            self.stdout.write('No upstream requests recorded yet')
+        for provider_stats in stats:
+            self.stdout.write(
+                f'{provider_stats["provider"]}: {provider_stats["requests"]} requests, '
+                f'{provider_stats["connections"]} new connections, '
+                f'{provider_stats["reuse_ratio"]:.0%} reused'
+            )
+
+        if options.get('reset'):
+            http_client.reset_stats()
+            self.stdout.write(self.style.SUCCESS('HTTP stats reset'))
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from image_generator.models import ImagePrompt
+from image_generator.storage import get_image_store
+
+
+class Command(BaseCommand):
+    help = 'Move legacy base64 images out of ImagePrompt.generated_image into the image store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100,
+            help='Number of prompts to migrate per transaction (default: 100)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Stop after migrating this many prompts',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        limit = options.get('limit')
+        store = get_image_store()
+
+        legacy_prompts = ImagePrompt.objects.filter(
+            generated_image__isnull=False,
+            image_hash=''
+        ).exclude(generated_image='')
+
+        self.stdout.write(f'Found {legacy_prompts.count()} prompts with inline base64 images')
+
+        migrated = 0
+        skipped = 0
+        last_id = 0
+        while limit is None or migrated < limit:
+            batch_size = chunk_size if limit is None else min(chunk_size, limit - migrated)
+            # Keyset pagination keeps each chunk to a single indexed range scan
+            ids = list(
+                legacy_prompts.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                chunk = ImagePrompt.objects.filter(id__in=ids).only('id', 'api_provider', 'generated_image', 'image_hash').select_for_update()
+                updated = []
+                for prompt in chunk:
+                    try:
+                        image = prompt.get_image_content()
+                    except Exception as e:
+                        self.stdout.write(self.style.WARNING(f'Skipping prompt {prompt.id}: {e}'))
+                        skipped += 1
+                        continue
+                    if not image:
+                        skipped += 1
+                        continue
+                    _, image_content = image
+                    prompt.set_image(store.save(image_content), prompt.api_provider)
+                    updated.append(prompt)
+
+                ImagePrompt.objects.bulk_update(updated, [
+                    'image_hash', 'image_size', 'image_mime_type',
+                    'image_width', 'image_height', 'generated_image', 'generated_provider',
+                ])
+            migrated += len(updated)
+            self.stdout.write(f'Migrated {migrated} images (last id {last_id})')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully migrated {migrated} images ({skipped} skipped)')
+        )
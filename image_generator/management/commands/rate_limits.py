@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from image_generator import rate_limit
+
+PROVIDERS = ['whisk', 'imagefx']
+
+
+class Command(BaseCommand):
+    help = 'Show or change the upstream rate limits shared by all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--provider',
+            choices=PROVIDERS,
+            help='Provider to show or change (default: all for show)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            help='Sustained requests per second per auth token',
+        )
+        parser.add_argument(
+            '--burst',
+            type=int,
+            help='Requests allowed back to back before the rate applies',
+        )
+        parser.add_argument(
+            '--max-in-flight',
+            type=int,
+            help='Concurrent upstream requests allowed per auth token',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Drop runtime overrides and go back to the configured defaults',
+        )
+
+    def handle(self, *args, **options):
+        provider = options.get('provider')
+        changes = {
+            'rate': options.get('rate'),
+            'burst': options.get('burst'),
+            'max_in_flight': options.get('max_in_flight'),
+        }
+
+        if options.get('reset') or any(value is not None for value in changes.values()):
+            if not provider:
+                self.stdout.write(self.style.ERROR('Please specify --provider to change limits'))
+                return
+            if options.get('reset'):
+                rate_limit.reset_limits(provider)
+            rate_limit.set_limits(provider, **changes)
+            self.stdout.write(self.style.SUCCESS(f'Updated {provider} rate limits'))
+
+        for name in [provider] if provider else PROVIDERS:
+            usage = rate_limit.get_utilisation(name)
+            limits = usage['limits']
+            self.stdout.write(
+                f'{name}: {limits["rate"]} req/s, burst {limits["burst"]}, '
+                f'max {limits["max_in_flight"]} in flight'
+            )
+            if not usage['tokens']:
+                self.stdout.write('  no recent activity')
+            for token in usage['tokens']:
+                self.stdout.write(
+                    f'  token {token["token_id"]}: {token["in_flight"]}/{limits["max_in_flight"]} in flight, '
+                    f'{token["available"]:.1f}/{limits["burst"]} burst tokens available'
+                )
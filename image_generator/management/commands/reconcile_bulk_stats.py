@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from image_generator.models import BulkImageRequest
+from image_generator import stats
+
+
+class Command(BaseCommand):
+    help = 'Recount prompt statuses and rebuild the per-request and global counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk-id',
+            type=int,
+            help='Only reconcile a specific bulk request ID',
+        )
+        parser.add_argument(
+            '--skip-global',
+            action='store_true',
+            help='Do not rebuild the global stats table afterwards',
+        )
+
+    def handle(self, *args, **options):
+        bulk_id = options.get('bulk_id')
+
+        bulk_requests = BulkImageRequest.objects.order_by('id')
+        if bulk_id:
+            bulk_requests = bulk_requests.filter(id=bulk_id)
+            if not bulk_requests.exists():
+                self.stdout.write(self.style.ERROR(f'Bulk request with ID {bulk_id} not found'))
+                return
+
+        checked = 0
+        fixed = 0
+        # Each request is recounted in its own short transaction
+        for request_id in bulk_requests.values_list('id', flat=True).iterator():
+            drift = stats.reconcile_bulk_request(request_id)
+            checked += 1
+            if drift:
+                fixed += 1
+                changes = ', '.join(f'{field} {stored} -> {actual}' for field, (stored, actual) in drift.items())
+                self.stdout.write(self.style.WARNING(f'Bulk request {request_id}: {changes}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} bulk requests, fixed {fixed}'))
+
+        if not options.get('skip_global'):
+            stats.rebuild_global_stats()
+            totals = stats.get_totals()['all']
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt global stats: {totals["request_count"]} requests, {totals["prompt_count"]} prompts, '
+                f'{totals["completed_count"]} completed, {totals["failed_count"]} failed, '
+                f'{totals["in_flight_count"]} processing'
+            ))
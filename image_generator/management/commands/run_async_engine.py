@@ -0,0 +1,50 @@
+import asyncio
+import signal
+from django.core.management.base import BaseCommand
+from image_generator.async_engine import AsyncGenerationEngine
+
+
+class Command(BaseCommand):
+    help = 'Generate pending prompts with an asyncio engine that keeps many upstream calls in flight'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Prompts in flight at once in this process (default: 50)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when no prompts are pending (default: 2)',
+        )
+        parser.add_argument(
+            '--max-retries',
+            type=int,
+            default=3,
+            help='Retries of transient provider errors per prompt (default: 3)',
+        )
+        parser.add_argument(
+            '--until-idle',
+            action='store_true',
+            help='Exit once no prompts are pending or in flight',
+        )
+
+    def handle(self, *args, **options):
+        engine = AsyncGenerationEngine(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            max_retries=options['max_retries'],
+        )
+        self.stdout.write(f'Starting async engine with {options["concurrency"]} slots (Ctrl+C to stop)')
+        asyncio.run(self._run(engine, options.get('until_idle')))
+        self.stdout.write(self.style.SUCCESS('Async engine stopped'))
+
+    async def _run(self, engine, until_idle):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Stop claiming new prompts and let in-flight ones finish
+            loop.add_signal_handler(signum, engine.stop)
+        await engine.run(stop_when_idle=until_idle)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from image_generator import mock_provider
+
+
+def add_mock_arguments(parser):
+    """Options shaping the mock provider, shared with the benchmark command"""
+    parser.add_argument('--latency-median', type=float, default=0.5, help='Median seconds per call (default: 0.5)')
+    parser.add_argument('--latency-p99', type=float, default=2.0, help='99th percentile seconds per call (default: 2)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls answered with 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of calls answered with 429')
+    parser.add_argument('--auth-error-rate', type=float, default=0.0, help='Share of calls answered with 401')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='Share of calls answered with 400 (prompt blocked)')
+    parser.add_argument('--retry-after', type=int, default=5, help='Retry-After seconds sent with a 429 (default: 5)')
+    parser.add_argument('--image-bytes', type=int, default=300_000, help='Size of each generated image (default: 300000)')
+    parser.add_argument('--seed', type=int, help='Seed for reproducible latencies, errors and images')
+
+
+def mock_config(options):
+    return mock_provider.MockConfig(
+        latency_median=options['latency_median'],
+        latency_p99=options['latency_p99'],
+        error_rate=options['error_rate'],
+        rate_limit_rate=options['rate_limit_rate'],
+        auth_error_rate=options['auth_error_rate'],
+        reject_rate=options['reject_rate'],
+        retry_after=options['retry_after'],
+        image_bytes=options['image_bytes'],
+        seed=options['seed'],
+    )
+
+
+class Command(BaseCommand):
+    help = 'Serve stand-in Whisk and ImageFX generation endpoints for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        add_mock_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = mock_provider.make_server(options['host'], options['port'], mock_config(options))
+        self.stdout.write(
+            f'Mock provider listening on http://{options["host"]}:{options["port"]} (Ctrl+C to stop). '
+            f'Set PROVIDER_API_BASE_URL=http://{options["host"]}:{options["port"]} for the web app and workers.'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(str(server.RequestHandlerClass.stats.snapshot()))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from image_generator import scheduler
+from image_generator.models import BulkImageRequest
+
+
+def format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.1f}s'
+
+
+class Command(BaseCommand):
+    help = 'Show how the scheduler is sharing generation capacity between bulk requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recent',
+            type=int,
+            metavar='N',
+            help='Show the N most recent bulk requests instead of only running ones',
+        )
+
+    def handle(self, *args, **options):
+        bulk_requests = BulkImageRequest.objects.order_by('-created_at')
+        if options.get('recent'):
+            bulk_requests = bulk_requests[:options['recent']]
+        else:
+            bulk_requests = bulk_requests.filter(status='processing')
+        rows = scheduler.get_wait_stats(bulk_requests)
+        if not rows:
+            self.stdout.write('No running bulk requests')
+            return
+
+        total_priority = sum(row['bulk_request'].priority for row in rows if row['bulk_request'].pending_count)
+        total_in_flight = sum(row['bulk_request'].in_flight_count for row in rows)
+        for row in rows:
+            bulk_request = row['bulk_request']
+            line = (
+                f'#{bulk_request.id} {bulk_request.title[:30]!r} '
+                f'priority {bulk_request.get_priority_display()}: '
+                f'{bulk_request.pending_count} pending, {bulk_request.in_flight_count} in flight, '
+                f'{row["claimed"]} claimed, avg wait {format_seconds(row["avg_wait"])}, '
+                f'max wait {format_seconds(row["max_wait"])}, '
+                f'first claim after {format_seconds(row["time_to_first_claim"])}'
+            )
+            if total_in_flight and total_priority and bulk_request.pending_count:
+                # Requests with pending prompts should hold about their priority's share of the slots
+                fair_share = bulk_request.priority / total_priority
+                line += f', {bulk_request.in_flight_count / total_in_flight:.0%} of slots (fair share {fair_share:.0%})'
+            self.stdout.write(line)
@@ -0,0 +1,248 @@
+import atexit
+import logging
+import threading
+import time
+from contextvars import ContextVar
+import redis
+from django.conf import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'image_generator:metrics'
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 240)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name: (type, help, buckets)
+METRICS = {
+    'image_generator_upstream_request_seconds': ('histogram', 'Upstream generation call latency by provider and HTTP status', LATENCY_BUCKETS),
+    'image_generator_task_seconds': ('histogram', 'Generation task duration by task and final state', LATENCY_BUCKETS),
+    'image_generator_task_retries_total': ('counter', 'Task retries and deferrals by task and reason', None),
+    'image_generator_images_written_total': ('counter', 'Images saved to the image store, by whether the blob was new', None),
+    'image_generator_image_bytes_written_total': ('counter', 'Bytes of new image blobs written to the image store', None),
+    'image_generator_view_db_queries': ('histogram', 'Database queries per request by view', QUERY_BUCKETS),
+}
+
+# Buffered observations are added up in process and written at most this often
+BUFFER_FLUSH_INTERVAL = 5  # seconds
+
+# Counts the current request's queries; a list so sync_to_async threads, which get a copy of the context, share it
+_query_count = ContextVar('image_generator_query_count', default=None)
+_task_started = {}
+# {(name, field): amount} not yet written to Redis, see observe_buffered
+_buffer = {}
+_buffer_lock = threading.Lock()
+_buffer_flushed_at = time.monotonic()
+_broker_client = None
+
+
+def _key(name):
+    return f'{KEY_PREFIX}:{name}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in sorted((labels or {}).items()))
+
+
+def _sample(name, label_string, value):
+    labels = f'{{{label_string}}}' if label_string else ''
+    return f'{name}{labels} {float(value)!r}'
+
+
+def _observation(name, value, labels):
+    """The histogram fields one observation adds to, with their increments"""
+    label_string = _labels(labels)
+    buckets = METRICS[name][2]
+    bucket = next((str(bound) for bound in buckets if value <= bound), '+Inf')
+    # Buckets are stored individually and made cumulative when rendered
+    return [(f'{label_string}|{bucket}', 1), (f'{label_string}|count', 1), (f'{label_string}|sum', value)]
+
+
+def _queue_increment(pipe, name, field, amount):
+    if field.endswith('|sum'):
+        pipe.hincrbyfloat(_key(name), field, amount)
+    else:
+        pipe.hincrby(_key(name), field, amount)
+
+
+def _queue_observation(pipe, name, value, labels):
+    for field, amount in _observation(name, value, labels):
+        _queue_increment(pipe, name, field, amount)
+
+
+def observe(name, value, labels=None):
+    """Add an observation to a histogram shared by every process through Redis"""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        _queue_observation(pipe, name, value, labels)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+async def aobserve(client, name, value, labels=None):
+    """observe() for asyncio code, through its own async Redis client"""
+    try:
+        pipe = client.pipeline(transaction=False)
+        _queue_observation(pipe, name, value, labels)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+def observe_buffered(name, value, labels=None):
+    """observe() for every-request paths: added up in memory instead of a Redis round trip
+
+    Returns True once BUFFER_FLUSH_INTERVAL has passed since the last write;
+    the caller then calls flush_buffer(), from a thread if it is async code.
+    """
+    with _buffer_lock:
+        for field, amount in _observation(name, value, labels):
+            _buffer[name, field] = _buffer.get((name, field), 0) + amount
+        return time.monotonic() - _buffer_flushed_at >= BUFFER_FLUSH_INTERVAL
+
+
+def flush_buffer():
+    """Write buffered observations to Redis in one round trip"""
+    global _buffer, _buffer_flushed_at
+    with _buffer_lock:
+        pending, _buffer = _buffer, {}
+        _buffer_flushed_at = time.monotonic()
+    if not pending:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for (name, field), amount in pending.items():
+            _queue_increment(pipe, name, field, amount)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record {len(pending)} buffered metric values: {e}")
+
+
+# Do not drop the last few seconds of observations on a clean shutdown
+atexit.register(flush_buffer)
+
+
+def inc(name, labels=None, amount=1):
+    try:
+        get_redis().hincrbyfloat(_key(name), _labels(labels), amount)
+    except redis.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+async def ainc(client, name, labels=None, amount=1):
+    try:
+        await client.hincrbyfloat(_key(name), _labels(labels), amount)
+    except redis.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection; counts queries while a request is measured"""
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created handler"""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def start_counting_queries():
+    counter = [0]
+    return counter, _query_count.set(counter)
+
+
+def stop_counting_queries(token):
+    _query_count.reset(token)
+
+
+def task_started(task_id=None, **kwargs):
+    """Celery task_prerun handler"""
+    _task_started[task_id] = time.monotonic()
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    """Celery task_postrun handler"""
+    started = _task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        observe('image_generator_task_seconds', time.monotonic() - started, {'task': task.name, 'state': state or 'UNKNOWN'})
+
+
+def task_retried(sender=None, reason=None, **kwargs):
+    """Celery task_retry handler"""
+    inc('image_generator_task_retries_total', {'task': getattr(sender, 'name', 'unknown'), 'reason': type(reason).__name__})
+
+
+def queue_depth(queue):
+    """Messages waiting in a Celery queue on a Redis broker, or None for other brokers"""
+    broker_url = settings.CELERY_BROKER_URL
+    if not broker_url.startswith(('redis://', 'rediss://')):
+        return None
+    client = get_redis() if broker_url == settings.REDIS_URL else _get_broker_redis()
+    return client.llen(queue)
+
+
+def _get_broker_redis():
+    """Client for a broker on another Redis than REDIS_URL, created once per process"""
+    global _broker_client
+    if _broker_client is None:
+        _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _broker_client
+
+
+def _render_histogram(name, values, lines):
+    series = {}
+    for field, value in values.items():
+        label_string, _, part = field.rpartition('|')
+        series.setdefault(label_string, {})[part] = float(value)
+    for label_string, parts in sorted(series.items()):
+        prefix = f'{label_string},' if label_string else ''
+        cumulative = 0
+        for bound in METRICS[name][2]:
+            cumulative += parts.get(str(bound), 0)
+            lines.append(_sample(f'{name}_bucket', f'{prefix}le="{bound}"', cumulative))
+        lines.append(_sample(f'{name}_bucket', f'{prefix}le="+Inf"', parts.get('count', 0)))
+        lines.append(_sample(f'{name}_sum', label_string, parts.get('sum', 0)))
+        lines.append(_sample(f'{name}_count', label_string, parts.get('count', 0)))
+
+
+def render(gauges=()):
+    """All metrics in the Prometheus text exposition format
+
+    ``gauges`` adds values computed at scrape time, as ``(name, help, [(labels, value)])``.
+    If Redis is unreachable the stored metrics are rendered without samples.
+    """
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for name in METRICS:
+            pipe.hgetall(_key(name))
+        stored = pipe.execute()
+    except redis.RedisError as e:
+        # The scrape-time gauges come from the database and are still worth serving
+        logger.warning(f"Could not read metrics: {e}")
+        stored = [{} for _ in METRICS]
+    lines = []
+    for (name, (metric_type, help_text, _)), values in zip(METRICS.items(), stored):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        values = {field.decode(): value.decode() for field, value in values.items()}
+        if metric_type == 'histogram':
+            _render_histogram(name, values, lines)
+        else:
+            for label_string, value in sorted(values.items()):
+                lines.append(_sample(name, label_string, value))
+    for name, help_text, samples in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(_sample(name, _labels(labels), value))
+    return '\n'.join(lines) + '\n'
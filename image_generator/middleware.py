@@ -0,0 +1,38 @@
+import asyncio
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from . import metrics
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match else None) or 'unresolved'
+
+
+@sync_and_async_middleware
+def query_count_middleware(get_response):
+    """Record how many database queries each view runs, for /metrics
+
+    Under ASGI, sync views run in a thread with a copy of the request's
+    context, so the counter set here still sees their queries. Counts are
+    buffered in process, so a request costs no Redis round trip.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            counter, token = metrics.start_counting_queries()
+            try:
+                return await get_response(request)
+            finally:
+                metrics.stop_counting_queries(token)
+                if metrics.observe_buffered('image_generator_view_db_queries', counter[0], {'view': _view_name(request)}):
+                    await asyncio.to_thread(metrics.flush_buffer)
+    else:
+        def middleware(request):
+            counter, token = metrics.start_counting_queries()
+            try:
+                return get_response(request)
+            finally:
+                metrics.stop_counting_queries(token)
+                if metrics.observe_buffered('image_generator_view_db_queries', counter[0], {'view': _view_name(request)}):
+                    metrics.flush_buffer()
+    return middleware
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0004_imagefxsettings_bulkimagerequest_api_provider_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageprompt',
+            name='image_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 of the image blob in the image store', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='image_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='image_mime_type',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
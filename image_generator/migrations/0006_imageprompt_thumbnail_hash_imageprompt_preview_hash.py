@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0005_imageprompt_image_store_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageprompt',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the small grid thumbnail', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='preview_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the medium preview', max_length=64),
+        ),
+    ]
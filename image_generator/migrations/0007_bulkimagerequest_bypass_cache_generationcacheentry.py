@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0006_imageprompt_thumbnail_hash_imageprompt_preview_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='bypass_cache',
+            field=models.BooleanField(default=False, help_text='Always call the provider instead of reusing cached results'),
+        ),
+        migrations.CreateModel(
+            name='GenerationCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(help_text='SHA-256 over provider, request parameters and normalized prompt', max_length=64, unique=True)),
+                ('api_provider', models.CharField(choices=[('whisk', 'Whisk'), ('imagefx', 'ImageFX')], max_length=20)),
+                ('prompt_text', models.TextField(help_text='Normalized prompt the entry was generated for')),
+                ('images', models.JSONField(default=list, help_text='Metadata of the stored images returned by the provider')),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Generation Cache Entry',
+                'verbose_name_plural': 'Generation Cache Entries',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0007_bulkimagerequest_bypass_cache_generationcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='candidates_count',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Images (variants) to keep per prompt; ImageFX returns up to 4 per call'),
+        ),
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('image_hash', models.CharField(help_text='SHA-256 of the image blob in the image store', max_length=64)),
+                ('image_size', models.PositiveIntegerField(blank=True, null=True)),
+                ('image_mime_type', models.CharField(blank=True, default='', max_length=50)),
+                ('image_width', models.PositiveIntegerField(blank=True, null=True)),
+                ('image_height', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='image_generator.imageprompt')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('prompt', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_counters(apps, schema_editor):
+    BulkImageRequest = apps.get_model('image_generator', 'BulkImageRequest')
+    ImagePrompt = apps.get_model('image_generator', 'ImagePrompt')
+    counts = ImagePrompt.objects.values('bulk_request_id').annotate(
+        total=Count('id'),
+        processing=Count('id', filter=Q(status='processing')),
+        completed=Count('id', filter=Q(status='completed')),
+        failed=Count('id', filter=Q(status='failed')),
+    ).order_by()
+    for row in counts.iterator():
+        BulkImageRequest.objects.filter(id=row['bulk_request_id']).update(
+            total_count=row['total'],
+            in_flight_count=row['processing'],
+            completed_count=row['completed'],
+            failed_count=row['failed'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0008_bulkimagerequest_candidates_count_imagevariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='total_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of prompts in the request'),
+        ),
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='in_flight_count',
+            field=models.IntegerField(default=0, help_text='Prompts currently processing'),
+        ),
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='completed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='failed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:40
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Mod
+
+STATS_SHARDS = 16
+
+
+def populate_stats(apps, schema_editor):
+    BulkImageRequest = apps.get_model('image_generator', 'BulkImageRequest')
+    GenerationStats = apps.get_model('image_generator', 'GenerationStats')
+    rows = {
+        (row['api_provider'], row['shard']): row
+        for row in BulkImageRequest.objects.annotate(shard=Mod('id', STATS_SHARDS)).values(
+            'api_provider', 'shard'
+        ).annotate(
+            request_count=Count('id'),
+            prompt_count=Sum('total_count'),
+            in_flight_count=Sum('in_flight_count'),
+            completed_count=Sum('completed_count'),
+            failed_count=Sum('failed_count'),
+        ).order_by()
+    }
+    stats = []
+    for api_provider in ['whisk', 'imagefx']:
+        for shard in range(STATS_SHARDS):
+            row = rows.pop((api_provider, shard), {'api_provider': api_provider, 'shard': shard})
+            stats.append(GenerationStats(**row))
+    stats.extend(GenerationStats(**row) for row in rows.values())
+    GenerationStats.objects.bulk_create(stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0009_bulkimagerequest_status_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api_provider', models.CharField(choices=[('whisk', 'Whisk'), ('imagefx', 'ImageFX')], max_length=20)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('request_count', models.IntegerField(default=0)),
+                ('prompt_count', models.IntegerField(default=0)),
+                ('in_flight_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Generation Stats',
+                'verbose_name_plural': 'Generation Stats',
+                'unique_together': {('api_provider', 'shard')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bulkimagerequest',
+            index=models.Index(fields=['-created_at'], name='bulkrequest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bulkimagerequest',
+            index=models.Index(fields=['api_provider', '-created_at'], name='bulkrequest_provider_idx'),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking writes on the large prompt table
+    atomic = False
+
+    dependencies = [
+        ('image_generator', '0010_generationstats_bulkimagerequest_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='imageprompt',
+            index=models.Index(fields=['bulk_request', 'status'], name='imageprompt_bulk_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='imageprompt',
+            index=models.Index(fields=['bulk_request', 'updated_at'], name='imageprompt_bulk_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='imageprompt',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'processing'])), fields=['updated_at'], name='imageprompt_active_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='imageprompt',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='imageprompt_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 15:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking writes on the large prompt table
+    atomic = False
+
+    dependencies = [
+        ('image_generator', '0011_imageprompt_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageprompt',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', help_text='Worker currently holding this prompt', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text="When the worker's claim lapses unless renewed by a heartbeat", null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='imageprompt',
+            index=models.Index(condition=models.Q(('status', 'processing')), fields=['lease_expires_at'], name='imageprompt_lease_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-17 15:40
+
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Drop the index without locking writes on the large prompt table
+    atomic = False
+
+    dependencies = [
+        ('image_generator', '0012_imageprompt_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Low'), (2, 'Normal'), (4, 'High')], default=2, help_text='Share of generation capacity relative to other running requests'),
+        ),
+        # Prompts are now claimed per bulk request through imageprompt_bulk_status_idx
+        RemoveIndexConcurrently(
+            model_name='imageprompt',
+            name='imageprompt_pending_idx',
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0013_bulkimagerequest_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api_provider', models.CharField(choices=[('whisk', 'Whisk'), ('imagefx', 'ImageFX')], max_length=20)),
+                ('label', models.CharField(help_text='Name to recognise this account by', max_length=100)),
+                ('auth_token', models.CharField(help_text='Authentication token for the provider API', max_length=500)),
+                ('project_id', models.CharField(blank=True, default='', help_text='Whisk project ID used with this token', max_length=100)),
+                ('weight', models.PositiveSmallIntegerField(default=1, help_text="Share of calls relative to the provider's other credentials")),
+                ('daily_quota', models.PositiveIntegerField(blank=True, help_text='Calls allowed per UTC day; empty for no limit', null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Untick to take the credential out of rotation')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['api_provider', 'label'],
+            },
+        ),
+    ]
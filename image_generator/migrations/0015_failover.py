@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0014_providercredential'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='failover_policy',
+            field=models.CharField(choices=[('none', 'Selected provider only'), ('ordered', 'Fall back to the other provider'), ('cost', 'Cheapest available provider first')], default='none', help_text='Whether prompts may switch provider when theirs is throttled or down', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='imageprompt',
+            name='generated_provider',
+            field=models.CharField(blank=True, choices=[('whisk', 'Whisk'), ('imagefx', 'ImageFX')], default='', help_text='Provider that produced the image; differs from api_provider after a failover', max_length=20),
+        ),
+    ]
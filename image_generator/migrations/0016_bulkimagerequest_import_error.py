@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0015_failover'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimagerequest',
+            name='import_error',
+            field=models.TextField(blank=True, default='', help_text='Why importing the uploaded prompt file failed'),
+        ),
+    ]
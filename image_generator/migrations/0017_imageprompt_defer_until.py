@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_generator', '0016_bulkimagerequest_import_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageprompt',
+            name='defer_until',
+            field=models.DateTimeField(blank=True, help_text="The scheduler leaves the prompt pending until then, e.g. while its provider's quota is used up", null=True),
+        ),
+    ]
@@ -0,0 +1,159 @@
+import base64
+import io
+import json
+import logging
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+WHISK_PATH = '/v1/whisk:generateImage'
+IMAGEFX_PATH = '/v1:runImageFx'
+# Most candidates a runImageFx call returns, as upstream
+IMAGEFX_MAX_CANDIDATES = 4
+
+
+class MockConfig:
+    """How the mock provider behaves; every rate is a probability per call
+
+    Latency is log-normal around ``latency_median`` seconds, with ``latency_p99``
+    the 99th percentile, which matches the long tail real generation calls have.
+    """
+
+    def __init__(self, latency_median=0.5, latency_p99=2.0, error_rate=0.0, rate_limit_rate=0.0,
+                 auth_error_rate=0.0, reject_rate=0.0, retry_after=5, image_bytes=300_000, seed=None):
+        self.latency_median = latency_median
+        self.latency_p99 = max(latency_p99, latency_median)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.auth_error_rate = auth_error_rate
+        self.reject_rate = reject_rate
+        self.retry_after = retry_after
+        self.image_bytes = image_bytes
+        self.random = random.Random(seed)
+
+    def latency(self):
+        if self.latency_median <= 0:
+            return 0.0
+        # 2.326 is the 99th percentile of a standard normal
+        sigma = math.log(self.latency_p99 / self.latency_median) / 2.326
+        return self.random.lognormvariate(math.log(self.latency_median), sigma)
+
+
+class MockStats:
+    """Counts of calls and responses, safe to update from handler threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.bytes_sent = 0
+
+    def record(self, path, status, size):
+        with self.lock:
+            key = f'{path} {status}'
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.bytes_sent += size
+
+    def snapshot(self):
+        with self.lock:
+            return {'responses': dict(self.responses), 'bytes_sent': self.bytes_sent}
+
+
+def make_image(config):
+    """A distinct PNG of roughly ``config.image_bytes``
+
+    A small random-coloured image padded with random bytes after its end
+    chunk, which decoders ignore, so every image hashes differently and
+    payload size is whatever the benchmark asks for.
+    """
+    colour = tuple(config.random.randrange(256) for _ in range(3))
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 36), colour).save(buffer, format='PNG')
+    padding = max(0, config.image_bytes - buffer.tell())
+    return buffer.getvalue() + config.random.randbytes(padding)
+
+
+def generated_images(config, count):
+    return [
+        {'encodedImage': base64.b64encode(make_image(config)).decode('ascii'), 'seed': config.random.randrange(10**6)}
+        for _ in range(count)
+    ]
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Set on the subclass built by make_server
+    config = None
+    stats = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.stats.record(self.path, status, len(payload))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'Invalid JSON payload'}})
+            return
+        if self.path not in (WHISK_PATH, IMAGEFX_PATH):
+            self.send_json(404, {'error': {'message': f'No mock for {self.path}'}})
+            return
+
+        config = self.config
+        time.sleep(config.latency())
+        roll = config.random.random()
+        if roll < config.rate_limit_rate:
+            self.send_json(429, {'error': {'message': 'Resource has been exhausted'}}, {'Retry-After': str(config.retry_after)})
+            return
+        roll -= config.rate_limit_rate
+        if roll < config.error_rate:
+            self.send_json(503, {'error': {'message': 'The service is currently unavailable'}})
+            return
+        roll -= config.error_rate
+        if roll < config.auth_error_rate:
+            self.send_json(401, {'error': {'message': 'Request had invalid authentication credentials'}})
+            return
+        roll -= config.auth_error_rate
+        if roll < config.reject_rate:
+            self.send_json(400, {'error': {'message': 'Prompt was blocked'}})
+            return
+
+        if self.path == IMAGEFX_PATH:
+            count = min(int(body.get('userInput', {}).get('candidatesCount', IMAGEFX_MAX_CANDIDATES)), IMAGEFX_MAX_CANDIDATES)
+        else:
+            count = 1
+        self.send_json(200, {'imagePanels': [{'prompt': '', 'generatedImages': generated_images(config, count)}]})
+
+
+def make_server(host='127.0.0.1', port=8090, config=None):
+    """Build a threaded server answering generateImage and runImageFx like upstream"""
+    handler = type('ConfiguredMockProviderHandler', (MockProviderHandler,), {
+        'config': config or MockConfig(),
+        'stats': MockStats(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(host='127.0.0.1', port=8090, config=None):
+    """Start a mock server on a background thread; returns the server"""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name='mock-provider', daemon=True).start()
+    return server
@@ -1,4 +1,25 @@
+import base64
+import io
+import re
 from django.db import models
+from django.urls import reverse
+from django.utils import timezone
+from . import settings_cache
+from .storage import MIME_EXTENSIONS, get_image_store
+
+def blob_url(image_hash):
+    """URL serving a blob from the image store, or None for an empty hash"""
+    if image_hash:
+        return reverse('serve_image', args=[image_hash])
+    return None
+
+def prompt_image_url(prompt_id, image_hash, has_legacy_image):
+    """Build an image URL from plain column values, without loading the row"""
+    if image_hash:
+        return blob_url(image_hash)
+    if has_legacy_image:
+        return reverse('prompt_image', args=[prompt_id])
+    return None
 
 class WhiskSettings(models.Model):
     auth_token = models.CharField(max_length=500, help_text="Authentication token for Whisk API")
@@ -15,6 +36,11 @@ class WhiskSettings(models.Model):
 
     @classmethod
     def get_settings(cls):
+        """Cached copy of the settings row; see image_generator.settings_cache"""
+        return settings_cache.get_settings(cls, cls.load_settings)
+
+    @classmethod
+    def load_settings(cls):
         settings = cls.objects.first()
         if not settings:
             settings = cls.objects.create(
@@ -37,11 +63,41 @@ class ImageFXSettings(models.Model):
 
     @classmethod
     def get_settings(cls):
+        """Cached copy of the settings row; see image_generator.settings_cache"""
+        return settings_cache.get_settings(cls, cls.load_settings)
+
+    @classmethod
+    def load_settings(cls):
         settings = cls.objects.first()
         if not settings:
             settings = cls.objects.create(auth_token="")
         return settings
 
+class ProviderCredential(models.Model):
+    """One auth token in a provider's credential pool, see image_generator.credentials
+
+    Live health, cooldowns and daily usage are kept in Redis, keyed by token.
+    """
+    API_PROVIDER_CHOICES = [
+        ('whisk', 'Whisk'),
+        ('imagefx', 'ImageFX'),
+    ]
+    api_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES)
+    label = models.CharField(max_length=100, help_text="Name to recognise this account by")
+    auth_token = models.CharField(max_length=500, help_text="Authentication token for the provider API")
+    project_id = models.CharField(max_length=100, blank=True, default='', help_text="Whisk project ID used with this token")
+    weight = models.PositiveSmallIntegerField(default=1, help_text="Share of calls relative to the provider's other credentials")
+    daily_quota = models.PositiveIntegerField(blank=True, null=True, help_text="Calls allowed per UTC day; empty for no limit")
+    is_active = models.BooleanField(default=True, help_text="Untick to take the credential out of rotation")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['api_provider', 'label']
+
+    def __str__(self):
+        return f"{self.get_api_provider_display()} credential {self.label!r}"
+
 class BulkImageRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -52,15 +108,64 @@ class BulkImageRequest(models.Model):
         ('whisk', 'Whisk'),
         ('imagefx', 'ImageFX'),
     ]
+    # Upper bound on variants per prompt a bulk request may ask for
+    MAX_CANDIDATES = 8
+    # Relative share of generation capacity while several requests are running
+    PRIORITY_CHOICES = [
+        (1, 'Low'),
+        (2, 'Normal'),
+        (4, 'High'),
+    ]
+    # Which providers a prompt may be generated with, see generation.failover_order
+    FAILOVER_CHOICES = [
+        ('none', 'Selected provider only'),
+        ('ordered', 'Fall back to the other provider'),
+        ('cost', 'Cheapest available provider first'),
+    ]
     title = models.CharField(max_length=200, help_text="Name/title for this bulk generation")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     api_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES, default='whisk', help_text="API provider used for generation")
+    bypass_cache = models.BooleanField(default=False, help_text="Always call the provider instead of reusing cached results")
+    candidates_count = models.PositiveSmallIntegerField(default=1, help_text="Images (variants) to keep per prompt; ImageFX returns up to 4 per call")
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=2, help_text="Share of generation capacity relative to other running requests")
+    failover_policy = models.CharField(max_length=20, choices=FAILOVER_CHOICES, default='none', help_text="Whether prompts may switch provider when theirs is throttled or down")
+    # Maintained by image_generator.transitions on every prompt status change
+    total_count = models.PositiveIntegerField(default=0, help_text="Number of prompts in the request")
+    in_flight_count = models.IntegerField(default=0, help_text="Prompts currently processing")
+    completed_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    import_error = models.TextField(blank=True, default='', help_text="Why importing the uploaded prompt file failed")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='bulkrequest_created_idx'),
+            models.Index(fields=['api_provider', '-created_at'], name='bulkrequest_provider_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} ({self.status})"
 
+    @property
+    def pending_count(self):
+        return self.total_count - self.in_flight_count - self.completed_count - self.failed_count
+
+    @property
+    def importing(self):
+        """Prompts are still being added from an uploaded file"""
+        return self.status == 'pending'
+
+    def status_counts(self):
+        """Per-status prompt counts from the stored counters"""
+        return {
+            'total': self.total_count,
+            'completed': self.completed_count,
+            'failed': self.failed_count,
+            'processing': self.in_flight_count,
+            'pending': self.pending_count,
+        }
+
 class ImagePrompt(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -72,10 +177,191 @@ class ImagePrompt(models.Model):
         ('whisk', 'Whisk'),
         ('imagefx', 'ImageFX'),
     ]
+    # Columns written by set_image, saved together when a generation finishes
+    IMAGE_FIELDS = [
+        'generated_image', 'image_hash', 'image_size', 'image_mime_type',
+        'image_width', 'image_height', 'thumbnail_hash', 'preview_hash', 'generated_provider',
+    ]
     bulk_request = models.ForeignKey(BulkImageRequest, related_name='prompts', on_delete=models.CASCADE)
     prompt_text = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    generated_image = models.TextField(blank=True, null=True)  # Stores base64 image data
+    generated_image = models.TextField(blank=True, null=True)  # Legacy base64 data URL, see migrate_images_to_store
+    image_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, help_text="SHA-256 of the image blob in the image store")
+    image_size = models.PositiveIntegerField(blank=True, null=True)
+    image_mime_type = models.CharField(max_length=50, blank=True, default='')
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    thumbnail_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of the small grid thumbnail")
+    preview_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of the medium preview")
     api_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES, default='whisk', help_text="API provider used for generation")
+    generated_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES, blank=True, default='', help_text="Provider that produced the image; differs from api_provider after a failover")
+    lease_owner = models.CharField(max_length=100, blank=True, default='', help_text="Worker currently holding this prompt")
+    lease_expires_at = models.DateTimeField(blank=True, null=True, help_text="When the worker's claim lapses unless renewed by a heartbeat")
+    defer_until = models.DateTimeField(blank=True, null=True, help_text="The scheduler leaves the prompt pending until then, e.g. while its provider's quota is used up")
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Status filters within one bulk request: retry, reset stuck, fan-out
+            models.Index(fields=['bulk_request', 'status'], name='imageprompt_bulk_status_idx'),
+            # Cursor polling of a bulk request's changes
+            models.Index(fields=['bulk_request', 'updated_at'], name='imageprompt_bulk_updated_idx'),
+            # Stuck-prompt sweeps; only the small active slice of the table is indexed
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(status__in=['pending', 'processing']),
+                name='imageprompt_active_updated_idx'
+            ),
+            # Expired-lease reaping
+            models.Index(
+                fields=['lease_expires_at'],
+                condition=models.Q(status='processing'),
+                name='imageprompt_lease_idx'
+            ),
+        ]
+
+    @property
+    def has_image(self):
+        return bool(self.image_hash or self.generated_image)
+
+    @property
+    def image_url(self):
+        """URL the browser can load the image from"""
+        if self.image_hash:
+            return blob_url(self.image_hash)
+        return prompt_image_url(self.id, '', bool(self.generated_image))
+
+    @property
+    def thumbnail_url(self):
+        """Thumbnail URL, falling back to the original until renditions exist"""
+        return blob_url(self.thumbnail_hash) or self.image_url
+
+    @property
+    def preview_url(self):
+        return blob_url(self.preview_hash) or self.image_url
+
+    def set_image(self, stored_image, provider=''):
+        """Point this prompt at a blob written by the image store"""
+        self.generated_provider = provider
+        self.image_hash = stored_image.sha256
+        self.image_size = stored_image.size
+        self.image_mime_type = stored_image.mime_type
+        self.image_width = stored_image.width
+        self.image_height = stored_image.height
+        self.thumbnail_hash = ''
+        self.preview_hash = ''
+        self.generated_image = None
+
+    def replace_variants(self, stored_images):
+        """Record every image returned for this prompt, replacing earlier attempts"""
+        self.variants.all().delete()
+        ImageVariant.objects.bulk_create(self._build_variants(stored_images))
+
+    async def areplace_variants(self, stored_images):
+        await self.variants.all().adelete()
+        await ImageVariant.objects.abulk_create(self._build_variants(stored_images))
+
+    def _build_variants(self, stored_images):
+        return [
+            ImageVariant(
+                prompt=self,
+                position=position,
+                image_hash=image.sha256,
+                image_size=image.size,
+                image_mime_type=image.mime_type,
+                image_width=image.width,
+                image_height=image.height,
+            )
+            for position, image in enumerate(stored_images)
+        ]
+
+    def open_image(self):
+        """Return (extension, binary file object) for the image, or None"""
+        if self.image_hash:
+            extension = MIME_EXTENSIONS.get(self.image_mime_type, 'png')
+            return extension, get_image_store().open(self.image_hash)
+        image = self.get_image_content()
+        if image:
+            image_format, image_content = image
+            return image_format, io.BytesIO(image_content)
+        return None
+
+    def get_image_content(self):
+        """Return (extension, bytes) for the image, or None if there is none"""
+        if self.image_hash:
+            extension = MIME_EXTENSIONS.get(self.image_mime_type, 'png')
+            return extension, get_image_store().read(self.image_hash)
+        if self.generated_image:
+            match = re.match(r'data:image/(\w+);base64,(.+)', self.generated_image)
+            if match:
+                image_format, image_data = match.groups()
+                return image_format, base64.b64decode(image_data)
+        return None
+
+class ImageVariant(models.Model):
+    """One of several candidate images the provider returned for a prompt"""
+    prompt = models.ForeignKey(ImagePrompt, related_name='variants', on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField(default=0)
+    image_hash = models.CharField(max_length=64, help_text="SHA-256 of the image blob in the image store")
+    image_size = models.PositiveIntegerField(blank=True, null=True)
+    image_mime_type = models.CharField(max_length=50, blank=True, default='')
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['position']
+        unique_together = [('prompt', 'position')]
+
+    def __str__(self):
+        return f"Variant {self.position + 1} of prompt {self.prompt_id}"
+
+    @property
+    def image_url(self):
+        return blob_url(self.image_hash)
+
+class GenerationCacheEntry(models.Model):
+    API_PROVIDER_CHOICES = [
+        ('whisk', 'Whisk'),
+        ('imagefx', 'ImageFX'),
+    ]
+    cache_key = models.CharField(max_length=64, unique=True, help_text="SHA-256 over provider, request parameters and normalized prompt")
+    api_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES)
+    prompt_text = models.TextField(help_text="Normalized prompt the entry was generated for")
+    images = models.JSONField(default=list, help_text="Metadata of the stored images returned by the provider")
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Generation Cache Entry"
+        verbose_name_plural = "Generation Cache Entries"
+
+    def __str__(self):
+        return f"{self.api_provider}: {self.prompt_text[:50]} ({self.hit_count} hits)"
+
+class GenerationStats(models.Model):
+    """Global request and prompt counters, split into shards per provider
+
+    Kept up to date by image_generator.stats; sum the shards for totals.
+    """
+    API_PROVIDER_CHOICES = [
+        ('whisk', 'Whisk'),
+        ('imagefx', 'ImageFX'),
+    ]
+    api_provider = models.CharField(max_length=20, choices=API_PROVIDER_CHOICES)
+    shard = models.PositiveSmallIntegerField(default=0)
+    request_count = models.IntegerField(default=0)
+    prompt_count = models.IntegerField(default=0)
+    in_flight_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Generation Stats"
+        verbose_name_plural = "Generation Stats"
+        unique_together = [('api_provider', 'shard')]
+
+    def __str__(self):
+        return f"{self.api_provider} shard {self.shard}: {self.prompt_count} prompts"
@@ -0,0 +1,100 @@
+import json
+import re
+
+# Characters read from the source at a time
+READ_SIZE = 64 * 1024
+# A string longer than this is treated as broken input rather than buffered
+MAX_PROMPT_CHARS = 1024 * 1024
+# Text kept from the end of a chunk so a key split across chunks is still found
+ANCHOR_CARRY = 1024
+
+# One token inside an array: a complete string, a comma or the closing bracket.
+# The string pattern is the unrolled-loop form; it cannot backtrack.
+ARRAY_TOKEN = re.compile(r'\s*(?:("[^"\\]*(?:\\.[^"\\]*)*")|(,)|(\]))', re.DOTALL)
+
+_decoder = json.JSONDecoder(strict=False)
+
+
+def anchor_pattern(key='text'):
+    """Where an array of prompts starts: ``key`` then ``[``, or any ``[`` without a key"""
+    if not key:
+        return re.compile(r'\[')
+    return re.compile(rf'(?<!\w){re.escape(key)}\s*\[')
+
+
+def unescape(token):
+    """Decode a quoted string token the way JSON would"""
+    try:
+        return _decoder.decode(token)
+    except ValueError:
+        # Not valid JSON escapes; undo the two that matter
+        return token[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+
+def read_chunks(stream, read_size=READ_SIZE):
+    """Yield text from a file object opened in text mode"""
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def extract_prompts(chunks, key='text'):
+    """Yield prompts from an iterable of text chunks in a single pass
+
+    Scans for ``key [ "...", ... ]`` arrays, or every string array when
+    ``key`` is empty, holding at most one string and one chunk at a time.
+    Strings are yielded as soon as they are complete, stripped, with blank
+    ones skipped. An array that turns out to hold something other than
+    strings is abandoned at that point and scanning carries on after it.
+    """
+    anchor = anchor_pattern(key)
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = False
+    while True:
+        if not in_array:
+            match = anchor.search(buffer, pos)
+            if match:
+                pos = match.end()
+                in_array = True
+                continue
+            if eof:
+                return
+            keep_from = max(pos, len(buffer) - len(key) - ANCHOR_CARRY)
+        else:
+            match = ARRAY_TOKEN.match(buffer, pos)
+            if match:
+                pos = match.end()
+                if match.group(1):
+                    prompt = unescape(match.group(1)).strip()
+                    if prompt:
+                        yield prompt
+                elif match.group(3):
+                    in_array = False
+                continue
+            if eof or len(buffer) - pos > MAX_PROMPT_CHARS:
+                in_array = False
+                continue
+            # Most likely a string cut off by the end of the chunk
+            keep_from = pos
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            chunk = ''
+        buffer = buffer[keep_from:] + chunk
+        pos = 0
+
+
+def extract_prompts_from_string(content, key='text'):
+    return extract_prompts([content], key=key)
+
+
+def extract_prompts_from_file(path, key='text'):
+    """Yield prompts from a file without reading it into memory"""
+    with open(path, encoding='utf-8-sig') as stream:
+        yield from extract_prompts(read_chunks(stream), key=key)
@@ -0,0 +1,253 @@
+import codecs
+import json
+import logging
+import os
+import uuid
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from . import stats, tasks
+from .models import BulkImageRequest, ImagePrompt
+
+logger = logging.getLogger(__name__)
+
+# Characters decoded from the upload at a time
+READ_SIZE = 64 * 1024
+# Prompts inserted (and committed) per batch
+IMPORT_BATCH_SIZE = 1000
+# A single prompt longer than this is treated as a broken file rather than buffered
+MAX_PROMPT_CHARS = 1024 * 1024
+
+JSON_WHITESPACE = ' \t\n\r'
+
+
+class PromptFormatError(ValueError):
+    """The uploaded prompt list could not be parsed"""
+
+
+def read_text(stream, read_size=READ_SIZE):
+    """Yield decoded text from a binary or text stream, one chunk at a time"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        while True:
+            data = stream.read(read_size)
+            if not data:
+                break
+            text = data if isinstance(data, str) else decoder.decode(data)
+            if text:
+                yield text
+        tail = decoder.decode(b'', final=True)
+    except UnicodeDecodeError as e:
+        raise PromptFormatError(f'File is not valid UTF-8: {e}')
+    if tail:
+        yield tail
+
+
+def prompt_text(value):
+    """A prompt from one parsed element: a string, or an object with a "prompt" key"""
+    if isinstance(value, dict):
+        value = value.get('prompt')
+    if not isinstance(value, str):
+        raise PromptFormatError(f'Expected a prompt string, got {json.dumps(value)[:100]}')
+    return value.strip()
+
+
+def iter_prompts(stream):
+    """Yield prompts from a JSON array, JSONL or one-prompt-per-line file
+
+    The format is taken from the first non-blank character: ``[`` starts a
+    JSON array, anything else is read line by line, where a line may be a
+    JSON string, a JSON object with a ``prompt`` key, or plain text. Only one
+    prompt and one read chunk are held in memory at a time. Blank prompts
+    are skipped.
+    """
+    chunks = read_text(stream)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip()
+    if buffer.startswith('['):
+        prompts = _iter_json_array(chunks, buffer[1:])
+    else:
+        prompts = _iter_lines(chunks, buffer)
+    for prompt in prompts:
+        if prompt:
+            yield prompt
+
+
+def _iter_json_array(chunks, buffer):
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    expect = 'value_or_end'
+    index = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise PromptFormatError(f'JSON array ends after {index} prompts without a closing "]"')
+            buffer, pos = '', 0
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer = chunk
+            continue
+
+        char = buffer[pos]
+        if expect == 'comma_or_end':
+            if char == ',':
+                expect = 'value'
+                pos += 1
+                continue
+            if char == ']':
+                return
+            raise PromptFormatError(f'Expected "," or "]" after prompt {index}, found {char!r}')
+        if char == ']' and expect == 'value_or_end':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+            # A value running to the end of the buffer may continue in the next chunk
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError as e:
+            if eof:
+                raise PromptFormatError(f'Invalid JSON in prompt {index + 1}: {e.msg}')
+            complete = False
+        if not complete:
+            if len(buffer) - pos > MAX_PROMPT_CHARS:
+                raise PromptFormatError(f'Prompt {index + 1} is not valid JSON within {MAX_PROMPT_CHARS} characters')
+            chunk = next(chunks, None)
+            buffer = buffer[pos:] + (chunk or '')
+            pos = 0
+            eof = chunk is None
+            continue
+
+        index += 1
+        yield prompt_text(value)
+        pos = end
+        expect = 'comma_or_end'
+
+
+def _iter_lines(chunks, buffer):
+    line_number = 0
+    while True:
+        start = 0
+        newline = buffer.find('\n')
+        while newline != -1:
+            line_number += 1
+            yield _parse_line(buffer[start:newline], line_number)
+            start = newline + 1
+            newline = buffer.find('\n', start)
+        buffer = buffer[start:]
+        if len(buffer) > MAX_PROMPT_CHARS:
+            raise PromptFormatError(f'Line {line_number + 1} is longer than {MAX_PROMPT_CHARS} characters')
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buffer += chunk
+    if buffer:
+        yield _parse_line(buffer, line_number + 1)
+
+
+def _parse_line(line, line_number):
+    line = line.strip()
+    if line[:1] in ('"', '{'):
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError:
+            # Plain text that happens to start with a quote or brace
+            return line
+        try:
+            return prompt_text(value)
+        except PromptFormatError as e:
+            raise PromptFormatError(f'Line {line_number}: {e}')
+    return line
+
+
+def save_upload(uploaded_file):
+    """Copy an uploaded prompt file to PROMPT_UPLOAD_ROOT for the import task; returns its path"""
+    os.makedirs(settings.PROMPT_UPLOAD_ROOT, exist_ok=True)
+    path = os.path.join(settings.PROMPT_UPLOAD_ROOT, uuid.uuid4().hex)
+    with open(path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    return path
+
+
+def create_bulk_request(prompts, batch_size=IMPORT_BATCH_SIZE, progress=None, **fields):
+    """Create a bulk request from an iterable of prompts, a batch at a time
+
+    See import_prompts. If reading ``prompts`` fails part way, the partial
+    request is deleted and the error re-raised.
+    """
+    bulk_request = BulkImageRequest.objects.create(status='pending', total_count=0, **fields)
+    stats.record_bulk_created(bulk_request)
+    try:
+        return import_prompts(bulk_request, prompts, batch_size, progress)
+    except Exception:
+        delete_bulk_request(bulk_request)
+        raise
+
+
+def import_prompts(bulk_request, prompts, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Add an iterable of prompts to a ``pending`` bulk request, then release it
+
+    Each batch is committed on its own so memory stays bounded however long
+    ``prompts`` is, and total_count shows how far the import has got. The
+    request stays ``pending``, out of the scheduler's sight, until the last
+    batch is in. ``progress`` is called with the number of prompts imported
+    so far.
+    """
+    prompts = iter(prompts)
+    imported = 0
+    while True:
+        batch = list(islice(prompts, batch_size))
+        if not batch:
+            break
+        with transaction.atomic():
+            ImagePrompt.objects.bulk_create([
+                ImagePrompt(bulk_request=bulk_request, prompt_text=prompt, api_provider=bulk_request.api_provider)
+                for prompt in batch
+            ])
+            BulkImageRequest.objects.filter(id=bulk_request.id).update(total_count=F('total_count') + len(batch))
+            stats.adjust(bulk_request.api_provider, bulk_request.id, prompt_count=len(batch))
+        imported += len(batch)
+        if progress:
+            progress(imported)
+
+    bulk_request.total_count = imported
+    bulk_request.status = 'processing' if imported else 'completed'
+    bulk_request.save(update_fields=['status', 'updated_at'])
+    if imported:
+        tasks.kick_scheduler()
+    logger.info(f"Imported {imported} prompts into bulk request {bulk_request.id}")
+    return bulk_request
+
+
+def fail_import(bulk_request, error):
+    """Drop the prompts of an import that failed part way and record why
+
+    The request itself is kept, completed and empty, so the status page the
+    uploader was sent to can show ``error``.
+    """
+    with transaction.atomic():
+        locked = BulkImageRequest.objects.select_for_update().only('id', 'api_provider', 'total_count').filter(id=bulk_request.id).first()
+        if locked is None:
+            # Deleted while importing; its counters went with it
+            return
+        ImagePrompt.objects.filter(bulk_request_id=locked.id).delete()
+        stats.adjust(locked.api_provider, locked.id, prompt_count=-locked.total_count)
+        BulkImageRequest.objects.filter(id=locked.id).update(status='completed', total_count=0, import_error=error, updated_at=timezone.now())
+    logger.warning(f"Import into bulk request {bulk_request.id} failed: {error}")
+
+
+def delete_bulk_request(bulk_request):
+    with transaction.atomic():
+        stats.record_bulk_deleted(BulkImageRequest.objects.filter(id=bulk_request.id).select_for_update())
+        bulk_request.delete()
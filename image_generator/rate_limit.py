@@ -0,0 +1,263 @@
+import contextvars
+import hashlib
+import logging
+import math
+import time
+import asyncio
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+import redis
+from django.conf import settings
+from .exceptions import RateLimitedError
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'image_generator:ratelimit'
+
+# Refill the bucket for the time elapsed, then take one token if at least
+# one is available on top of ``reserve``. Returns 0 when a token was taken,
+# otherwise milliseconds until one will be.
+TOKEN_BUCKET_SCRIPT = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local state = redis.call('HMGET', key, 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate / 1000)
+local wait = 0
+if tokens >= 1 + reserve then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 + reserve - tokens) * 1000 / rate)
+end
+redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', key, math.ceil(capacity * 1000 / rate) + 60000)
+return wait
+"""
+
+# Sorted set of holders scored by lease expiry, so slots held by a crashed
+# worker free themselves once the lease runs out
+SEMAPHORE_ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local expires = tonumber(ARGV[3])
+local holder = ARGV[4]
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+if redis.call('ZCARD', key) < limit then
+    redis.call('ZADD', key, expires, holder)
+    redis.call('PEXPIREAT', key, expires)
+    return 1
+end
+return 0
+"""
+
+
+class RateLimitTimeout(RateLimitedError):
+    """Raised when no upstream slot frees up within RATE_LIMIT_MAX_WAIT"""
+    # Our own limiter said no; the provider itself is not misbehaving
+    trips_circuit = False
+    reached_provider = False
+
+
+# Set for single-image requests from the web UI, which may use reserved capacity
+_interactive = contextvars.ContextVar('rate_limit_interactive', default=False)
+
+
+@contextmanager
+def interactive_lane():
+    """Let upstream calls in the block use the capacity held back for interactive requests"""
+    token = _interactive.set(True)
+    try:
+        yield
+    finally:
+        _interactive.reset(token)
+
+
+def lane_limits(limits):
+    """Return ``(max_in_flight, reserved_tokens)`` for the caller's lane
+
+    Background work leaves INTERACTIVE_RESERVED_SHARE of the in-flight slots
+    and of the burst untouched, so a single image never queues behind a bulk
+    request. Background work always keeps at least one slot and one token.
+    """
+    if _interactive.get():
+        return limits['max_in_flight'], 0
+    share = settings.INTERACTIVE_RESERVED_SHARE
+    reserved_slots = min(limits['max_in_flight'] - 1, math.ceil(limits['max_in_flight'] * share))
+    reserved_tokens = min(limits['burst'] - 1, limits['burst'] * share)
+    return limits['max_in_flight'] - max(0, reserved_slots), max(0, reserved_tokens)
+
+
+def token_id(auth_token):
+    """Short, non-reversible identifier so tokens never appear in Redis keys"""
+    return hashlib.sha256((auth_token or '').encode('utf-8')).hexdigest()[:12]
+
+
+def _bucket_key(provider, auth_token):
+    return f'{KEY_PREFIX}:{provider}:{token_id(auth_token)}:bucket'
+
+
+def _inflight_key(provider, auth_token):
+    return f'{KEY_PREFIX}:{provider}:{token_id(auth_token)}:inflight'
+
+
+def _config_key(provider):
+    return f'{KEY_PREFIX}:config:{provider}'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_limits(provider):
+    """Return the effective limits: settings defaults overridden at runtime from Redis"""
+    try:
+        overrides = get_redis().hgetall(_config_key(provider))
+    except redis.RedisError:
+        overrides = {}
+    return _apply_overrides(provider, overrides)
+
+
+def _apply_overrides(provider, overrides):
+    limits = dict(settings.PROVIDER_RATE_LIMITS.get(provider, settings.PROVIDER_RATE_LIMITS['default']))
+    for field, value in overrides.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field in limits:
+            limits[field] = float(value) if field == 'rate' else int(value)
+    return limits
+
+
+def set_limits(provider, **limits):
+    """Change limits for every process at once; takes effect on the next call"""
+    values = {field: value for field, value in limits.items() if value is not None}
+    if values:
+        get_redis().hset(_config_key(provider), mapping=values)
+
+
+def reset_limits(provider):
+    get_redis().delete(_config_key(provider))
+
+
+@contextmanager
+def provider_slot(provider, auth_token):
+    """Hold one rate-limited, concurrency-capped upstream slot for the block
+
+    Waits for both a token-bucket token and a free in-flight slot for this
+    provider and auth token, shared by every process through Redis. If Redis
+    is unreachable the call goes through unthrottled rather than failing.
+    """
+    client = get_redis()
+    limits = get_limits(provider)
+    max_in_flight, reserved_tokens = lane_limits(limits)
+    holder = uuid.uuid4().hex
+    inflight_key = _inflight_key(provider, auth_token)
+    deadline = time.monotonic() + settings.RATE_LIMIT_MAX_WAIT
+    acquired = False
+
+    try:
+        while True:
+            wait_ms = client.eval(
+                TOKEN_BUCKET_SCRIPT, 1, _bucket_key(provider, auth_token),
+                limits['rate'], limits['burst'], _now_ms(), reserved_tokens
+            )
+            if not wait_ms:
+                now = _now_ms()
+                acquired = client.eval(
+                    SEMAPHORE_ACQUIRE_SCRIPT, 1, inflight_key,
+                    max_in_flight, now, now + settings.RATE_LIMIT_LEASE_SECONDS * 1000, holder
+                )
+                if acquired:
+                    break
+                # The token is spent; back off briefly before contending for a slot again
+                wait_ms = 250
+            if time.monotonic() + wait_ms / 1000 > deadline:
+                raise RateLimitTimeout(f'No {provider} upstream slot available within {settings.RATE_LIMIT_MAX_WAIT}s', provider)
+            time.sleep(wait_ms / 1000)
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, calling {provider} without limits: {e}")
+
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                client.zrem(inflight_key, holder)
+            except redis.RedisError as e:
+                logger.warning(f"Could not release {provider} in-flight slot: {e}")
+
+
+@asynccontextmanager
+async def aprovider_slot(provider, auth_token, client):
+    """Async counterpart of provider_slot using an asyncio Redis ``client``
+
+    Shares the same buckets and in-flight sets, so async engines and Celery
+    workers are throttled together. Waiting yields to the event loop.
+    """
+    holder = uuid.uuid4().hex
+    inflight_key = _inflight_key(provider, auth_token)
+    deadline = time.monotonic() + settings.RATE_LIMIT_MAX_WAIT
+    acquired = False
+
+    try:
+        limits = _apply_overrides(provider, await client.hgetall(_config_key(provider)))
+        max_in_flight, reserved_tokens = lane_limits(limits)
+        while True:
+            wait_ms = await client.eval(
+                TOKEN_BUCKET_SCRIPT, 1, _bucket_key(provider, auth_token),
+                limits['rate'], limits['burst'], _now_ms(), reserved_tokens
+            )
+            if not wait_ms:
+                now = _now_ms()
+                acquired = await client.eval(
+                    SEMAPHORE_ACQUIRE_SCRIPT, 1, inflight_key,
+                    max_in_flight, now, now + settings.RATE_LIMIT_LEASE_SECONDS * 1000, holder
+                )
+                if acquired:
+                    break
+                wait_ms = 250
+            if time.monotonic() + wait_ms / 1000 > deadline:
+                raise RateLimitTimeout(f'No {provider} upstream slot available within {settings.RATE_LIMIT_MAX_WAIT}s', provider)
+            await asyncio.sleep(wait_ms / 1000)
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, calling {provider} without limits: {e}")
+
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                await client.zrem(inflight_key, holder)
+            except redis.RedisError as e:
+                logger.warning(f"Could not release {provider} in-flight slot: {e}")
+
+
+def get_utilisation(provider):
+    """Return per-token in-flight counts and available burst tokens for a provider"""
+    client = get_redis()
+    limits = get_limits(provider)
+    now = _now_ms()
+    tokens = {}
+    try:
+        for key in client.scan_iter(match=f'{KEY_PREFIX}:{provider}:*'):
+            key = key.decode() if isinstance(key, bytes) else key
+            _, _, _, key_token_id, kind = key.split(':')
+            usage = tokens.setdefault(key_token_id, {'token_id': key_token_id, 'in_flight': 0, 'available': limits['burst']})
+            if kind == 'inflight':
+                usage['in_flight'] = client.zcount(key, now, '+inf')
+            elif kind == 'bucket':
+                state = client.hmget(key, 'tokens', 'updated')
+                if state[0] is not None:
+                    elapsed = max(0, now - int(float(state[1])))
+                    usage['available'] = min(limits['burst'], float(state[0]) + elapsed * limits['rate'] / 1000)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read {provider} rate limiter state: {e}")
+    return {
+        'provider': provider,
+        'limits': limits,
+        'tokens': sorted(tokens.values(), key=lambda usage: usage['token_id']),
+    }
@@ -0,0 +1,33 @@
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_redis_client = None
+_async_factory = None
+
+
+def get_redis():
+    """Return the shared synchronous Redis client for this process"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+def set_redis(client):
+    """Swap the shared client, e.g. for a fakeredis instance under test"""
+    global _redis_client
+    _redis_client = client
+
+
+def set_async_redis(factory):
+    """Build asyncio clients with ``factory``, e.g. fakeredis sharing set_redis's server"""
+    global _async_factory
+    _async_factory = factory
+
+
+def get_async_redis():
+    """Return a new asyncio client; callers own and close it"""
+    if _async_factory is not None:
+        return _async_factory()
+    return aioredis.Redis.from_url(settings.REDIS_URL)
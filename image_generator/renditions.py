@@ -0,0 +1,61 @@
+import io
+from PIL import Image, features
+from .models import ImagePrompt
+from .storage import get_image_store
+
+# Longest edge in pixels for each rendition kept alongside the original
+THUMBNAIL_SIZE = 256
+PREVIEW_SIZE = 768
+RENDITION_QUALITY = 80
+
+
+def _encode(image, max_size):
+    rendition = image.copy()
+    rendition.thumbnail((max_size, max_size), Image.LANCZOS)
+    output = io.BytesIO()
+    if features.check('webp'):
+        rendition.save(output, format='WEBP', quality=RENDITION_QUALITY, method=4)
+        return output.getvalue(), 'image/webp'
+    # Pillow built without libwebp: JPEG cannot carry alpha
+    rendition.convert('RGB').save(output, format='JPEG', quality=RENDITION_QUALITY, optimize=True)
+    return output.getvalue(), 'image/jpeg'
+
+
+def create_renditions(image_hash):
+    """Render and store the thumbnail and preview for a stored original
+
+    Returns a (thumbnail, preview) pair of StoredImage.
+    """
+    store = get_image_store()
+    with store.open(image_hash) as f:
+        image = Image.open(f)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    thumbnail = store.save(*_encode(image, THUMBNAIL_SIZE))
+    preview = store.save(*_encode(image, PREVIEW_SIZE))
+    return thumbnail, preview
+
+
+def apply_renditions(prompt):
+    """Create renditions for a prompt's stored image and record them on it"""
+    thumbnail, preview = create_renditions(prompt.image_hash)
+    prompt.thumbnail_hash = thumbnail.sha256
+    prompt.preview_hash = preview.sha256
+
+
+def reuse_renditions(prompt):
+    """Record renditions already made for the prompt's image, if any
+
+    Cache hits share their blob with an earlier prompt whose renditions already exist.
+    Returns whether any were found; otherwise the caller should apply_renditions.
+    """
+    existing = ImagePrompt.objects.filter(image_hash=prompt.image_hash).exclude(
+        thumbnail_hash=''
+    ).values('thumbnail_hash', 'preview_hash').first()
+    if not existing:
+        return False
+    prompt.thumbnail_hash = existing['thumbnail_hash']
+    prompt.preview_hash = existing['preview_hash']
+    return True
@@ -0,0 +1,155 @@
+import heapq
+import logging
+from itertools import chain, zip_longest
+import redis
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import leases, transitions
+from .models import BulkImageRequest, ImagePrompt
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+WAIT_KEY_PREFIX = 'image_generator:scheduler:waits'
+# Wait metrics outlive their bulk request by this long
+WAIT_KEY_TTL = 7 * 24 * 3600
+
+# Add a batch of claims to a request's wait totals and raise its maximum wait
+RECORD_WAITS_SCRIPT = """
+local key = KEYS[1]
+redis.call('HINCRBY', key, 'claimed', ARGV[1])
+redis.call('HINCRBYFLOAT', key, 'wait_total', ARGV[2])
+if tonumber(ARGV[3]) > (tonumber(redis.call('HGET', key, 'wait_max')) or 0) then
+    redis.call('HSET', key, 'wait_max', ARGV[3])
+end
+redis.call('HSETNX', key, 'first_claimed_at', ARGV[4])
+redis.call('EXPIRE', key, ARGV[5])
+"""
+
+
+def allocate(bulk_requests, slots):
+    """Split ``slots`` between bulk requests in proportion to their priority
+
+    Each slot goes to the request with the fewest prompts in flight per unit
+    of priority, so a small request is served alongside a large one instead
+    of queueing behind it. Returns ``{bulk_request_id: slots}``.
+    """
+    allocations = {}
+    heap = [
+        (bulk_request.in_flight_count / bulk_request.priority, bulk_request.id, bulk_request)
+        for bulk_request in bulk_requests
+        if bulk_request.pending_count > 0
+    ]
+    heapq.heapify(heap)
+    while slots > 0 and heap:
+        _, bulk_id, bulk_request = heapq.heappop(heap)
+        allocations[bulk_id] = allocations.get(bulk_id, 0) + 1
+        slots -= 1
+        if allocations[bulk_id] < bulk_request.pending_count:
+            share = (bulk_request.in_flight_count + allocations[bulk_id]) / bulk_request.priority
+            heapq.heappush(heap, (share, bulk_id, bulk_request))
+    return allocations
+
+
+def claim_prompts(limit, owner):
+    """Lease up to ``limit`` pending prompts to ``owner``, fairly across bulk requests
+
+    Returns prompt ids interleaved across bulk requests, so dispatching them
+    in order is fair too. Rows locked by another claimer or deferred until
+    later are skipped, and the slots a request cannot fill go round again to
+    the others.
+    """
+    if limit <= 0:
+        return []
+    active = list(BulkImageRequest.objects.filter(status='processing').only(
+        'id', 'priority', 'total_count', 'in_flight_count', 'completed_count', 'failed_count'
+    ))
+    lease = (owner, leases.lease_expiry())
+    now = timezone.now()
+    claimed = {}
+    while limit > 0 and active:
+        allocations = allocate(active, limit)
+        if not allocations:
+            break
+        short = set()
+        for bulk_request in active:
+            count = allocations.get(bulk_request.id)
+            if not count:
+                continue
+            prompt_ids = claim_from(bulk_request.id, count, lease, now)
+            claimed.setdefault(bulk_request.id, []).extend(prompt_ids)
+            # Counted as in flight, so the next round shares out fairly
+            bulk_request.in_flight_count += len(prompt_ids)
+            limit -= len(prompt_ids)
+            if len(prompt_ids) < count:
+                short.add(bulk_request.id)
+        active = [bulk_request for bulk_request in active if bulk_request.id not in short]
+    return [
+        prompt_id
+        for prompt_id in chain.from_iterable(zip_longest(*(sorted(prompt_ids) for prompt_ids in claimed.values())))
+        if prompt_id is not None
+    ]
+
+
+def claim_from(bulk_request_id, count, lease, now):
+    """Lease up to ``count`` of one request's claimable pending prompts, oldest first"""
+    with transaction.atomic():
+        candidates = dict(
+            ImagePrompt.objects.filter(bulk_request_id=bulk_request_id, status='pending')
+            .filter(Q(defer_until__isnull=True) | Q(defer_until__lte=now))
+            .order_by('id').select_for_update(skip_locked=True)
+            .values_list('id', 'updated_at')[:count]
+        )
+        if not candidates:
+            return []
+        prompt_ids = transitions.transition_prompts(
+            ImagePrompt.objects.filter(id__in=candidates), 'processing', lease=lease
+        )
+    record_waits(bulk_request_id, [candidates[prompt_id] for prompt_id in prompt_ids])
+    return prompt_ids
+
+
+def _wait_key(bulk_request_id):
+    return f'{WAIT_KEY_PREFIX}:{bulk_request_id}'
+
+
+def record_waits(bulk_request_id, pending_since):
+    """Count how long each claimed prompt sat in pending"""
+    if not pending_since:
+        return
+    now = timezone.now()
+    waits = [max(0.0, (now - since).total_seconds()) for since in pending_since]
+    try:
+        get_redis().eval(
+            RECORD_WAITS_SCRIPT, 1, _wait_key(bulk_request_id),
+            len(waits), sum(waits), max(waits), now.timestamp(), WAIT_KEY_TTL
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Could not record scheduler wait times for bulk request {bulk_request_id}: {e}")
+
+
+def get_wait_stats(bulk_requests):
+    """Per-request claim counts and pending wait times, in seconds
+
+    ``time_to_first_claim`` is how long the request waited for any capacity
+    at all, the clearest sign of starvation.
+    """
+    bulk_requests = list(bulk_requests)
+    client = get_redis()
+    pipe = client.pipeline()
+    for bulk_request in bulk_requests:
+        pipe.hgetall(_wait_key(bulk_request.id))
+    rows = []
+    for bulk_request, values in zip(bulk_requests, pipe.execute()):
+        values = {field.decode(): float(value) for field, value in values.items()}
+        claimed = int(values.get('claimed', 0))
+        first_claimed_at = values.get('first_claimed_at')
+        rows.append({
+            'bulk_request': bulk_request,
+            'claimed': claimed,
+            'avg_wait': values.get('wait_total', 0) / claimed if claimed else None,
+            'max_wait': values.get('wait_max'),
+            'time_to_first_claim': first_claimed_at - bulk_request.created_at.timestamp() if first_claimed_at else None,
+        })
+    return rows
@@ -0,0 +1,125 @@
+import copy
+import logging
+import os
+import threading
+import time
+import redis
+from django.conf import settings
+from django.db import transaction
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'image_generator:settings:version'
+INVALIDATE_CHANNEL = 'image_generator:settings:invalidate'
+# Seconds to wait before resubscribing after the listener loses Redis
+LISTENER_RETRY_SECONDS = 1
+
+_cache = {}
+_lock = threading.Lock()
+_listener_pid = None
+
+
+class _Entry:
+    def __init__(self, instance, version):
+        self.instance = instance
+        self.version = version
+        self.expires = time.monotonic() + settings.PROVIDER_SETTINGS_CACHE_TTL
+
+
+def _label(model_class):
+    return model_class._meta.label_lower
+
+
+def _current_version():
+    try:
+        return get_redis().get(VERSION_KEY)
+    except redis.RedisError:
+        return None
+
+
+def get_settings(model_class, loader):
+    """Return a copy of the settings row, loading it with ``loader`` on a miss
+
+    Entries are dropped as soon as another process announces a save over
+    Redis pub/sub. When the TTL runs out the shared version stamp is compared
+    instead of querying, so an unchanged row costs one Redis GET per TTL and
+    no database queries.
+    """
+    _ensure_listener()
+    label = _label(model_class)
+    entry = _cache.get(label)
+    if entry is not None and entry.expires <= time.monotonic():
+        version = _current_version()
+        if version is not None and version == entry.version:
+            entry.expires = time.monotonic() + settings.PROVIDER_SETTINGS_CACHE_TTL
+        else:
+            entry = None
+    if entry is None:
+        # Read the version first so a save racing with the load is never missed
+        version = _current_version()
+        entry = _Entry(loader(), version)
+        with _lock:
+            _cache[label] = entry
+    # Callers such as ModelForms mutate the instance; never hand out the cached one
+    return copy.copy(entry.instance)
+
+
+def clear(model_class=None):
+    """Drop cached entries in this process only"""
+    with _lock:
+        if model_class is None:
+            _cache.clear()
+        else:
+            _cache.pop(_label(model_class), None)
+
+
+def invalidate(model_class):
+    """Drop a model's settings in every web and worker process once committed"""
+    clear(model_class)
+
+    def broadcast():
+        clear(model_class)
+        try:
+            client = get_redis()
+            client.incr(VERSION_KEY)
+            client.publish(INVALIDATE_CHANNEL, _label(model_class))
+        except redis.RedisError as e:
+            logger.warning(f"Could not broadcast settings change, other processes will refresh within the TTL: {e}")
+
+    transaction.on_commit(broadcast)
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Anything published while we were disconnected was missed
+            clear()
+            for message in pubsub.listen():
+                label = message['data']
+                label = label.decode() if isinstance(label, bytes) else label
+                with _lock:
+                    _cache.pop(label, None)
+        except redis.RedisError as e:
+            logger.warning(f"Settings invalidation listener lost Redis, retrying: {e}")
+            time.sleep(LISTENER_RETRY_SECONDS)
+
+
+def _ensure_listener():
+    """Start the invalidation listener once per process, again after a fork"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        # Entries inherited from a parent process may already be stale
+        _cache.clear()
+    threading.Thread(target=_listen, name='settings-invalidation', daemon=True).start()
+
+
+def on_settings_saved(sender, **kwargs):
+    invalidate(sender)
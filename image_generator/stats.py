@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Mod
+from .models import BulkImageRequest, GenerationStats, ImagePrompt
+
+# Rows per provider in GenerationStats; spreading updates keeps workers
+# from queueing on a single hot row
+STATS_SHARDS = 16
+
+COUNTER_FIELDS = ['request_count', 'prompt_count', 'in_flight_count', 'completed_count', 'failed_count']
+# The same counters on each BulkImageRequest, where prompt_count is total_count
+REQUEST_COUNTER_FIELDS = ['total_count', 'in_flight_count', 'completed_count', 'failed_count']
+
+
+def _shard(bulk_request_id):
+    return bulk_request_id % STATS_SHARDS
+
+
+def adjust(api_provider, bulk_request_id, **deltas):
+    """Add ``deltas`` to the global counters, e.g. ``completed_count=1``"""
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not updates:
+        return
+    shard = _shard(bulk_request_id)
+    if not GenerationStats.objects.filter(api_provider=api_provider, shard=shard).update(**updates):
+        GenerationStats.objects.get_or_create(api_provider=api_provider, shard=shard)
+        GenerationStats.objects.filter(api_provider=api_provider, shard=shard).update(**updates)
+
+
+def record_bulk_created(bulk_request):
+    adjust(bulk_request.api_provider, bulk_request.id, request_count=1, prompt_count=bulk_request.total_count)
+
+
+def record_bulk_deleted(bulk_requests):
+    """Remove deleted requests' prompts from the global counters; call before deleting"""
+    for bulk_request in bulk_requests.only('id', 'api_provider', *REQUEST_COUNTER_FIELDS):
+        adjust(
+            bulk_request.api_provider, bulk_request.id,
+            request_count=-1,
+            prompt_count=-bulk_request.total_count,
+            in_flight_count=-bulk_request.in_flight_count,
+            completed_count=-bulk_request.completed_count,
+            failed_count=-bulk_request.failed_count,
+        )
+
+
+def get_totals():
+    """Return global request and prompt counts, overall and per provider"""
+    totals = {'all': dict.fromkeys(COUNTER_FIELDS, 0)}
+    rows = GenerationStats.objects.values('api_provider').annotate(
+        **{field: Sum(field) for field in COUNTER_FIELDS}
+    ).order_by()
+    for row in rows:
+        provider_totals = totals.setdefault(row['api_provider'], dict.fromkeys(COUNTER_FIELDS, 0))
+        for field in COUNTER_FIELDS:
+            provider_totals[field] += row[field] or 0
+            totals['all'][field] += row[field] or 0
+    return totals
+
+
+def count_prompts(bulk_request_id):
+    """Count a bulk request's prompts by status straight from ImagePrompt"""
+    return ImagePrompt.objects.filter(bulk_request_id=bulk_request_id).aggregate(
+        total_count=Count('id'),
+        in_flight_count=Count('id', filter=Q(status='processing')),
+        completed_count=Count('id', filter=Q(status='completed')),
+        failed_count=Count('id', filter=Q(status='failed')),
+    )
+
+
+def reconcile_bulk_request(bulk_request_id):
+    """Recount one request's prompts and fix its counters if they drifted
+
+    Returns ``{field: (stored, actual)}`` for every counter that was wrong.
+    The request row stays locked while counting, so transitions committing
+    meanwhile apply their deltas on top of the corrected values. The status
+    of a request that is still importing is left alone.
+    """
+    with transaction.atomic():
+        bulk_request = BulkImageRequest.objects.select_for_update().only(
+            'id', 'api_provider', 'status', *REQUEST_COUNTER_FIELDS
+        ).get(id=bulk_request_id)
+        actual = count_prompts(bulk_request_id)
+        drift = {
+            field: (getattr(bulk_request, field), value)
+            for field, value in actual.items()
+            if getattr(bulk_request, field) != value
+        }
+        if drift:
+            BulkImageRequest.objects.filter(id=bulk_request_id).update(**actual)
+            adjust(
+                bulk_request.api_provider, bulk_request_id,
+                prompt_count=actual['total_count'] - bulk_request.total_count,
+                **{field: actual[field] - getattr(bulk_request, field) for field in COUNTER_FIELDS[2:]}
+            )
+        # The importer releases a pending request once its last batch is in
+        if not bulk_request.importing:
+            finished = actual['completed_count'] + actual['failed_count'] >= actual['total_count']
+            if finished and bulk_request.status != 'completed':
+                BulkImageRequest.objects.filter(id=bulk_request_id).update(status='completed')
+                drift['status'] = (bulk_request.status, 'completed')
+            elif not finished and bulk_request.status == 'completed':
+                BulkImageRequest.objects.filter(id=bulk_request_id).update(status='processing')
+                drift['status'] = (bulk_request.status, 'processing')
+    return drift
+
+
+def rebuild_global_stats():
+    """Recompute every GenerationStats shard from the per-request counters"""
+    with transaction.atomic():
+        # Lock the shards so in-flight transitions apply their deltas after the rebuild
+        list(GenerationStats.objects.select_for_update().values_list('id', flat=True))
+        GenerationStats.objects.all().delete()
+        rows = BulkImageRequest.objects.annotate(shard=Mod('id', STATS_SHARDS)).values(
+            'api_provider', 'shard'
+        ).annotate(
+            request_count=Count('id'),
+            prompt_count=Sum('total_count'),
+            in_flight_count=Sum('in_flight_count'),
+            completed_count=Sum('completed_count'),
+            failed_count=Sum('failed_count'),
+        ).order_by()
+        GenerationStats.objects.bulk_create([GenerationStats(**row) for row in rows])
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import struct
+import tempfile
+from django.conf import settings
+from django.utils.module_loading import import_string
+from . import metrics
+
+# Magic-number prefixes for the formats the providers can hand back
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+MIME_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpeg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+
+
+def sniff_mime_type(data, default='image/png'):
+    """Guess the mime type of raw image bytes from their header"""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return default
+
+
+def image_dimensions(data):
+    """Return (width, height) read from the image header, or (None, None)"""
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return struct.unpack('>II', data[16:24])
+        if data.startswith(b'GIF'):
+            return struct.unpack('<HH', data[6:10])
+        if data.startswith(b'\xff\xd8'):
+            # Walk the JPEG segments until a start-of-frame marker
+            offset = 2
+            while offset + 9 < len(data):
+                if data[offset] != 0xFF:
+                    offset += 1
+                    continue
+                marker = data[offset + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                    continue
+                length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + length
+    except struct.error:
+        pass
+    return None, None
+
+
+class StoredImage:
+    """Metadata describing an image blob that has been written to a store"""
+
+    def __init__(self, sha256, size, mime_type, width=None, height=None):
+        self.sha256 = sha256
+        self.size = size
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+
+    def to_dict(self):
+        return {
+            'sha256': self.sha256,
+            'size': self.size,
+            'mime_type': self.mime_type,
+            'width': self.width,
+            'height': self.height,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['sha256'], data['size'], data['mime_type'], data.get('width'), data.get('height'))
+
+
+class ImageStore:
+    """Base class for content-addressed image stores keyed by SHA-256"""
+
+    def save(self, data, mime_type=None):
+        sha256 = hashlib.sha256(data).hexdigest()
+        written = not self.exists(sha256)
+        if written:
+            self._write(sha256, data)
+            metrics.inc('image_generator_image_bytes_written_total', {'store': type(self).__name__}, len(data))
+        metrics.inc('image_generator_images_written_total', {'store': type(self).__name__, 'new': str(written).lower()})
+        mime_type = mime_type or sniff_mime_type(data)
+        width, height = image_dimensions(data)
+        return StoredImage(sha256, len(data), mime_type, width, height)
+
+    def exists(self, sha256):
+        raise NotImplementedError
+
+    def open(self, sha256):
+        """Return a binary file object for the blob"""
+        raise NotImplementedError
+
+    def read(self, sha256):
+        with self.open(sha256) as f:
+            return f.read()
+
+    def delete(self, sha256):
+        raise NotImplementedError
+
+    def _write(self, sha256, data):
+        raise NotImplementedError
+
+
+class LocalImageStore(ImageStore):
+    """Stores blobs on the local filesystem under ab/cd/<sha256> shards"""
+
+    def __init__(self, root=None):
+        self.root = str(root or settings.IMAGE_STORE_ROOT)
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def open(self, sha256):
+        return open(self.path(sha256), 'rb')
+
+    def delete(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, sha256, data):
+        path = self.path(sha256)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_image_store = None
+
+
+def get_image_store():
+    """Return the process-wide store configured by IMAGE_STORE_BACKEND"""
+    global _image_store
+    if _image_store is None:
+        backend = getattr(settings, 'IMAGE_STORE_BACKEND', 'image_generator.storage.LocalImageStore')
+        _image_store = import_string(backend)()
+    return _image_store
@@ -1,69 +1,97 @@
 from celery import shared_task
-from .models import ImagePrompt, WhiskSettings, ImageFXSettings
-from . import whisk, imagefx
+from celery.signals import task_postrun, task_prerun, task_retry
+from django.conf import settings
+from .models import BulkImageRequest, ImagePrompt
+from .exceptions import CircuitOpenError, ProviderError
+from .redis_client import get_redis
+from . import events, generation, leases, metrics, prompt_import, renditions, scheduler, stats, transitions
 import logging
+import os
+import random
+import redis
 
 logger = logging.getLogger(__name__)
 
+SCHEDULER_LOCK_KEY = 'image_generator:scheduler:lock'
+# Set while a scheduling round is already queued, so kicks coalesce
+SCHEDULER_KICK_KEY = 'image_generator:scheduler:kicked'
+
+# Task durations and retries for /metrics, from every worker process
+task_prerun.connect(metrics.task_started)
+task_postrun.connect(metrics.task_finished)
+task_retry.connect(metrics.task_retried)
+
 @shared_task(
     bind=True,
     max_retries=3,
     name='image_generator.tasks.generate_image_task',
     queue='image_generation'
 )
-def generate_image_task(self, prompt_id):
+def generate_image_task(self, prompt_id, lease_owner=None):
     logger.info(f"Task started for prompt_id: {prompt_id}")
+    variant_hashes = []
+    retry_error = None
+    defer_countdown = None
+
+    # Get the prompt
     try:
-        # Get the prompt
-        try:
-            image_prompt = ImagePrompt.objects.get(id=prompt_id)
-        except ImagePrompt.DoesNotExist:
-            logger.error(f"ImagePrompt with id {prompt_id} not found")
-            return
+        image_prompt = ImagePrompt.objects.select_related('bulk_request').defer('generated_image').get(id=prompt_id)
+    except ImagePrompt.DoesNotExist:
+        logger.error(f"ImagePrompt with id {prompt_id} not found")
+        return
+
+    # Take over the lease the scheduler or a previous attempt holds, or claim a
+    # pending prompt queued directly. A duplicate delivery finds the lease gone.
+    owner = leases.new_owner()
+    leases.grant(image_prompt, owner)
+    from_status = 'processing' if lease_owner else 'pending'
+    if not transitions.transition_prompt(image_prompt, 'processing', [from_status], fields=['lease_owner', 'lease_expires_at'], owner=lease_owner):
+        logger.info(f"Prompt {prompt_id} is no longer ours to generate; skipping")
+        return
 
-        # Update status to processing
-        image_prompt.status = 'processing'
-        image_prompt.save()
+    try:
+        events.publish_prompt_status(image_prompt)
         logger.info(f"Starting image generation for prompt {prompt_id}: {image_prompt.prompt_text}")
         
         # Determine which API to use based on the prompt's api_provider
         api_provider = image_prompt.api_provider
         logger.info(f"Using API provider: {api_provider}")
         
-        if api_provider == 'imagefx':
-            # Check ImageFX settings
-            imagefx_settings = ImageFXSettings.get_settings()
-            if not imagefx_settings.auth_token:
-                logger.error("ImageFX settings not configured")
-                raise Exception('ImageFX API settings not configured. Please configure auth token.')
-            
-            logger.info("Using ImageFX API")
-            image_data = imagefx.generate_image(image_prompt.prompt_text)
-        else:
-            # Default to Whisk
-            whisk_settings = WhiskSettings.get_settings()
-            if not whisk_settings.auth_token or not whisk_settings.project_id:
-                logger.error("Whisk settings not configured")
-                raise Exception('Whisk API settings not configured. Please configure auth token and project ID.')
-            
-            logger.info("Using Whisk API")
-            image_data = whisk.generate_image(image_prompt.prompt_text)
-        if not image_data:
+        bulk_request = image_prompt.bulk_request
+        providers = generation.failover_order(bulk_request.failover_policy, api_provider, bulk_request.candidates_count)
+
+        # The upstream call can outlast the lease; keep renewing it until we are done
+        with leases.Heartbeat(prompt_id, owner):
+            stored_images, cache_hit, generated_provider = generation.generate_images_with_failover(
+                providers,
+                image_prompt.prompt_text,
+                bypass_cache=bulk_request.bypass_cache,
+                count=bulk_request.candidates_count
+            )
+        if not stored_images:
             raise Exception('Failed to generate image (empty response).')
 
-        # Extract the first image from the response
-        image_url = None
-        for panel in image_data.get('imagePanels', []):
-            for image in panel.get('generatedImages', []):
-                image_url = f"data:image/png;base64,{image.get('encodedImage')}"
-                break
-            if image_url:
-                break
-        
-        if image_url:
-            image_prompt.generated_image = image_url
-            image_prompt.status = 'completed'
+        # The first candidate is the prompt's primary image; all of them are kept as variants
+        stored_image = stored_images[0]
+        image_prompt.set_image(stored_image, generated_provider)
+        image_prompt.replace_variants(stored_images)
+        if len(stored_images) > 1:
+            variant_hashes = [image.sha256 for image in stored_images]
+        image_prompt.status = 'completed'
+        source = f'{generated_provider} cache' if cache_hit else generated_provider
+        logger.info(f"Stored {len(stored_images)} image(s) from {source} for prompt {prompt_id}, primary {stored_image.sha256} ({stored_image.size} bytes)")
+
+    except CircuitOpenError as e:
+        # Not the prompt's fault: park it until the circuit half-opens, without spending a retry
+        logger.warning(f"Deferring prompt {prompt_id}: {e}")
+        defer_countdown = (e.retry_after or settings.CIRCUIT_BREAKER_COOLDOWN) + random.uniform(0, settings.CIRCUIT_BREAKER_COOLDOWN)
+
+    except ProviderError as e:
+        if e.retryable and self.request.retries < self.max_retries:
+            logger.warning(f"Retryable error for prompt {prompt_id} (attempt {self.request.retries + 1}): {e}")
+            retry_error = e
         else:
+            logger.error(f"Error generating image for prompt {prompt_id}: {e}")
             image_prompt.status = 'failed'
 
     except Exception as e:
@@ -71,12 +99,174 @@ def generate_image_task(self, prompt_id):
         image_prompt.status = 'failed'
     
     finally:
-        image_prompt.save()
-        
-        # Check if all prompts in the bulk request are completed
-        bulk_request = image_prompt.bulk_request
-        all_prompts = bulk_request.prompts.all()
-        if all(p.status in ['completed', 'failed'] for p in all_prompts):
-            bulk_request.status = 'completed'
-            bulk_request.save()
-            logger.info(f"Bulk request {bulk_request.id} marked as completed")
+        if retry_error is not None:
+            defer_countdown = generation.retry_countdown(self.request.retries, retry_error.retry_after)
+        if defer_countdown is not None and defer_countdown > settings.GENERATION_MAX_COUNTDOWN:
+            # Too long to park in the broker, which would redeliver the task; the
+            # scheduler claims the prompt again, with fresh retries, once the wait is over
+            logger.warning(f"Handing prompt {prompt_id} back to the scheduler for {defer_countdown:.0f}s")
+            saved = leases.release_until(image_prompt, owner, defer_countdown)
+            if saved:
+                events.publish_prompt_status(image_prompt)
+                kick_scheduler()
+            retry_error = defer_countdown = None
+        elif defer_countdown is not None:
+            # Stay processing and keep the lease through the backoff, so neither
+            # the scheduler nor the reaper hands the prompt to someone else
+            saved = leases.hold(prompt_id, owner, defer_countdown)
+        else:
+            final_status = image_prompt.status
+            # Only write back if we still hold the lease, i.e. nobody reaped or reset the prompt
+            saved = transitions.transition_prompt(image_prompt, final_status, ['processing'], fields=ImagePrompt.IMAGE_FIELDS, owner=owner)
+            if saved:
+                events.publish_prompt_status(image_prompt, variant_hashes)
+                if final_status == 'completed' and image_prompt.image_hash:
+                    create_image_renditions_task.delay(image_prompt.id)
+                # A slot is free; let the scheduler fill it
+                kick_scheduler()
+        if not saved:
+            logger.warning(f"Prompt {prompt_id} was moved on by another process; discarding this result")
+
+    if not saved:
+        return
+    if retry_error is not None:
+        raise self.retry(args=(prompt_id,), kwargs={'lease_owner': owner}, exc=retry_error, countdown=defer_countdown)
+    if defer_countdown is not None:
+        generate_image_task.apply_async((prompt_id,), {'lease_owner': owner}, countdown=defer_countdown)
+
+
+@shared_task(
+    name='image_generator.tasks.import_prompts_task',
+    queue='image_generation'
+)
+def import_prompts_task(bulk_request_id, path):
+    """Import an uploaded prompt file into its pending bulk request
+
+    The upload view saves the file and redirects straight away; the status
+    page shows total_count growing as batches commit. The file is removed
+    once read, whether or not the import succeeded.
+    """
+    try:
+        try:
+            bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
+        except BulkImageRequest.DoesNotExist:
+            logger.error(f"BulkImageRequest with id {bulk_request_id} not found")
+            return
+        try:
+            with open(path, 'rb') as prompts_file:
+                prompt_import.import_prompts(
+                    bulk_request,
+                    prompt_import.iter_prompts(prompts_file),
+                    progress=lambda imported: logger.info(f"Imported {imported} prompts into bulk request {bulk_request_id}")
+                )
+        except prompt_import.PromptFormatError as e:
+            prompt_import.fail_import(bulk_request, f'Could not read the prompt file: {e}')
+        except Exception as e:
+            logger.error(f"Error importing prompts into bulk request {bulk_request_id}: {e}")
+            prompt_import.fail_import(bulk_request, 'The prompt file could not be imported; see the worker log.')
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@shared_task(
+    name='image_generator.tasks.reap_expired_leases_task',
+    queue='image_generation'
+)
+def reap_expired_leases_task():
+    """Put prompts whose worker stopped heartbeating back in the queue
+
+    Scheduled by Celery beat. Live workers keep renewing their leases, so a
+    prompt that is still being generated is never dispatched twice.
+    """
+    prompt_ids = leases.reap_expired()
+    if prompt_ids:
+        logger.warning(f"Re-queued {len(prompt_ids)} prompts with expired leases")
+        queue_generation(prompt_ids)
+    return len(prompt_ids)
+
+
+def queue_generation(prompt_ids):
+    """Let the scheduler know prompts went back to pending
+
+    The scheduler decides when each one runs, so resetting thousands of
+    prompts costs the caller at most one broker message.
+    """
+    if prompt_ids:
+        kick_scheduler()
+
+
+def kick_scheduler():
+    """Queue a scheduling round shortly, unless one is already queued
+
+    The async engine claims prompts itself, so nothing is queued for it.
+    """
+    if settings.GENERATION_ENGINE != 'celery':
+        return
+    delay = settings.GENERATION_SCHEDULER_KICK_DELAY
+    try:
+        if not get_redis().set(SCHEDULER_KICK_KEY, 1, nx=True, px=int(delay * 1000)):
+            return
+    except redis.RedisError as e:
+        logger.warning(f"Could not coalesce scheduler kicks: {e}")
+    schedule_generation_task.apply_async(countdown=delay)
+
+
+@shared_task(
+    name='image_generator.tasks.schedule_generation_task',
+    queue='image_generation'
+)
+def schedule_generation_task():
+    """Top the Celery queue up to GENERATION_SCHEDULER_WINDOW prompts, fairly
+
+    Prompts are leased to the scheduler and picked across bulk requests by
+    priority before their tasks are queued, so a large request cannot push
+    a small one to the back of a FIFO queue. Runs on a Celery beat schedule
+    and whenever kick_scheduler is called.
+    """
+    if settings.GENERATION_ENGINE != 'celery':
+        return 0
+    lock = get_redis().lock(SCHEDULER_LOCK_KEY, timeout=settings.PROMPT_LEASE_SECONDS)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        free = settings.GENERATION_SCHEDULER_WINDOW - stats.get_totals()['all']['in_flight_count']
+        owner = leases.new_owner()
+        prompt_ids = scheduler.claim_prompts(free, owner)
+        with generate_image_task.app.producer_or_acquire() as producer:
+            for prompt_id in prompt_ids:
+                generate_image_task.apply_async((prompt_id,), {'lease_owner': owner}, producer=producer)
+    finally:
+        lock.release()
+    if prompt_ids:
+        logger.info(f"Scheduled {len(prompt_ids)} prompts")
+    return len(prompt_ids)
+
+
+@shared_task(
+    name='image_generator.tasks.create_image_renditions_task',
+    queue='image_generation'
+)
+def create_image_renditions_task(prompt_id):
+    """Render the grid thumbnail and preview for a completed prompt"""
+    try:
+        image_prompt = ImagePrompt.objects.defer('generated_image', 'prompt_text').get(id=prompt_id)
+    except ImagePrompt.DoesNotExist:
+        logger.error(f"ImagePrompt with id {prompt_id} not found")
+        return
+    if not image_prompt.image_hash:
+        logger.warning(f"Prompt {prompt_id} has no stored image; skipping renditions")
+        return
+
+    try:
+        if not renditions.reuse_renditions(image_prompt):
+            renditions.apply_renditions(image_prompt)
+    except Exception as e:
+        logger.error(f"Error creating renditions for prompt {prompt_id}: {e}")
+        return
+    # Bumping updated_at lets cursor-based status polls pick up the thumbnail
+    image_prompt.save(update_fields=['thumbnail_hash', 'preview_hash', 'updated_at'])
+    events.publish_prompt_status(image_prompt)
+    logger.info(f"Created renditions for prompt {prompt_id}")
@@ -0,0 +1,24 @@
+import fakeredis
+from image_generator import metrics, redis_client
+
+
+class FakeRedisMixin:
+    """Point every Redis client at a fresh in-memory fakeredis server
+
+    Sync and asyncio clients share the server, so events published by one
+    reach subscribers of the other, as with a real Redis.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.redis_server)
+        redis_client.set_redis(self.redis)
+        redis_client.set_async_redis(lambda: fakeredis.aioredis.FakeRedis(server=self.redis_server))
+
+    def tearDown(self):
+        # Buffered view metrics belong to this test's server, not the next one's
+        metrics.flush_buffer()
+        redis_client.set_redis(None)
+        redis_client.set_async_redis(None)
+        super().tearDown()
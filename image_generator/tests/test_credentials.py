@@ -0,0 +1,150 @@
+import time
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from image_generator import credentials
+from image_generator.credentials import CredentialsExhaustedError, NoCredentialsError
+from image_generator.exceptions import AuthExpiredError, ContentRejectedError, RateLimitedError, ServerError
+from image_generator.models import ProviderCredential
+from image_generator.rate_limit import RateLimitTimeout
+from .fake_redis import FakeRedisMixin
+
+
+@override_settings(
+    CREDENTIAL_MIN_CALLS=4,
+    CREDENTIAL_ERROR_THRESHOLD=0.75,
+    CREDENTIAL_ERROR_WINDOW=300,
+    CREDENTIAL_COOLDOWN=60,
+    CREDENTIAL_AUTH_COOLDOWN=3600,
+)
+class CredentialPoolTests(FakeRedisMixin, SimpleTestCase):
+    """Calls go to healthy credentials by weight; failing or spent ones sit out"""
+
+    def setUp(self):
+        super().setUp()
+        self.alpha = ProviderCredential(api_provider='whisk', label='alpha', auth_token='token-alpha', project_id='p', weight=3)
+        self.beta = ProviderCredential(api_provider='whisk', label='beta', auth_token='token-beta', project_id='p', weight=1)
+        self.pool = [self.alpha, self.beta]
+        patcher = mock.patch.object(credentials, 'get_pool', lambda provider: self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Cooldowns compare against the clock; the Redis keys themselves expire in real time
+        self.now = time.time()
+        patcher = mock.patch.object(credentials.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def weights(self):
+        """{label: weight} choose() would pick from"""
+        with mock.patch.object(credentials.random, 'choices', return_value=[None]) as choices:
+            credentials.choose('whisk')
+        population, weights = choices.call_args.args
+        return {credential.label: weight for credential, weight in zip(population, weights)}
+
+    def record(self, credential, outcomes):
+        for failed in outcomes:
+            credentials.record_call(credential, failed)
+
+    def test_picks_in_proportion_to_weight(self):
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_recent_errors_scale_the_weight_down(self):
+        self.record(self.alpha, [True, True, False, False])
+
+        self.assertEqual(self.weights(), {'alpha': 1.5, 'beta': 1})
+
+    def test_errors_are_ignored_until_enough_calls(self):
+        self.record(self.alpha, [True, True])
+
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_failing_credential_cools_down_and_starts_a_fresh_window(self):
+        self.record(self.alpha, [False, True, True, True])
+
+        self.assertEqual(self.weights(), {'beta': 1})
+        self.now += 61
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_rejected_token_leaves_the_rotation(self):
+        credentials.record_outcome(self.alpha, AuthExpiredError('expired', 'whisk', 401))
+
+        self.assertEqual(self.weights(), {'beta': 1})
+        self.now += 3599
+        self.assertEqual(self.weights(), {'beta': 1})
+        self.now += 2
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_throttled_token_cools_down_as_long_as_asked(self):
+        credentials.record_outcome(self.alpha, RateLimitedError('slow down', 'whisk', 429, retry_after=120))
+
+        self.now += 100
+        self.assertEqual(self.weights(), {'beta': 1})
+        self.now += 21
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_rejected_prompt_counts_as_a_healthy_call(self):
+        for _ in range(4):
+            credentials.record_outcome(self.alpha, ContentRejectedError('no', 'whisk', 400))
+
+        self.assertEqual(self.weights(), {'alpha': 3, 'beta': 1})
+
+    def test_errors_raised_before_the_call_are_not_recorded(self):
+        for error in (RateLimitTimeout('busy', 'whisk'), CredentialsExhaustedError('none left', 'whisk', retry_after=30)):
+            credentials.record_outcome(self.alpha, error)
+
+        self.assertEqual(self.redis.keys('image_generator:credentials:*'), [])
+
+    def test_track_records_the_outcome(self):
+        with self.assertRaises(ServerError):
+            with credentials.track(self.alpha):
+                raise ServerError('boom', 'whisk', 503)
+        with credentials.track(self.alpha):
+            pass
+
+        health = credentials._read_health([self.alpha])[0]
+        self.assertEqual((health['calls'], health['errors'], health['used_today']), (2, 1, 2))
+
+    def test_credential_out_of_daily_quota_is_skipped(self):
+        self.alpha.daily_quota = 2
+        self.record(self.alpha, [False, False])
+
+        self.assertEqual(self.weights(), {'beta': 1})
+        statuses = {row['credential'].label: row['state'] for row in credentials.get_pool_status('whisk')}
+        self.assertEqual(statuses, {'alpha': 'quota exhausted', 'beta': 'active'})
+
+    def test_exhausted_pool_waits_for_the_first_credential_back(self):
+        credentials.cool_down(self.alpha, 300, 'test')
+        credentials.cool_down(self.beta, 90, 'test')
+
+        with self.assertRaises(CredentialsExhaustedError) as raised:
+            credentials.choose('whisk')
+
+        self.assertEqual(raised.exception.retry_after, 91)
+        self.assertFalse(raised.exception.trips_circuit)
+        self.assertFalse(raised.exception.reached_provider)
+
+    def test_pool_out_of_quota_waits_until_midnight(self):
+        self.pool = [self.alpha]
+        self.alpha.daily_quota = 1
+        self.record(self.alpha, [False])
+
+        with mock.patch.object(credentials, '_seconds_until_midnight', return_value=5000):
+            with self.assertRaises(CredentialsExhaustedError) as raised:
+                credentials.choose('whisk')
+
+        self.assertEqual(raised.exception.retry_after, 5001)
+
+    def test_empty_pool(self):
+        self.pool = []
+
+        with self.assertRaises(NoCredentialsError) as raised:
+            credentials.choose('whisk')
+        self.assertFalse(raised.exception.reached_provider)
+
+    def test_redis_outage_picks_by_weight_only(self):
+        credentials.cool_down(self.alpha, 300, 'test')
+        self.redis_server.connected = False
+
+        with self.assertLogs('image_generator.credentials', 'WARNING'), \
+                mock.patch.object(credentials.random, 'choices', return_value=[self.alpha]) as choices:
+            self.assertIs(credentials.choose('whisk'), self.alpha)
+        self.assertEqual(choices.call_args.args, (self.pool, [3, 1]))
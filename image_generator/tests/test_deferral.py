@@ -0,0 +1,72 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from image_generator import leases, scheduler, tasks
+from image_generator.credentials import CredentialsExhaustedError
+from image_generator.exceptions import CircuitOpenError
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+@override_settings(GENERATION_ENGINE='celery', GENERATION_MAX_COUNTDOWN=600)
+class DeferralTests(FakeRedisMixin, TestCase):
+    """Waits longer than the broker can hold a countdown go back to the scheduler"""
+
+    def setUp(self):
+        super().setUp()
+        self.bulk_request = BulkImageRequest.objects.create(title='Deferral', status='processing', total_count=1)
+        self.prompt = ImagePrompt.objects.create(bulk_request=self.bulk_request, prompt_text='a cat')
+        for name in ('apply_async', 'retry'):
+            patcher = mock.patch.object(tasks.generate_image_task, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks, 'kick_scheduler')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self, error):
+        owner = leases.new_owner()
+        self.assertEqual(scheduler.claim_prompts(1, owner), [self.prompt.id])
+        with mock.patch.object(tasks.generation, 'generate_images_with_failover', side_effect=error):
+            tasks.generate_image_task(self.prompt.id, lease_owner=owner)
+        self.prompt.refresh_from_db()
+
+    def test_short_deferral_parks_a_countdown_task(self):
+        self.run_task(CircuitOpenError('open', provider='whisk', retry_after=30))
+
+        self.assertEqual(self.prompt.status, 'processing')
+        self.assertIsNone(self.prompt.defer_until)
+        countdown = self.apply_async.call_args.kwargs['countdown']
+        self.assertLessEqual(countdown, 600)
+
+    def test_long_deferral_hands_the_prompt_back(self):
+        self.run_task(CircuitOpenError('open', provider='whisk', retry_after=3 * 3600))
+
+        self.apply_async.assert_not_called()
+        self.assertEqual(self.prompt.status, 'pending')
+        self.assertEqual(self.prompt.lease_owner, '')
+        self.assertGreater(self.prompt.defer_until, timezone.now() + timedelta(hours=3))
+        self.bulk_request.refresh_from_db()
+        self.assertEqual(self.bulk_request.in_flight_count, 0)
+
+    def test_long_retry_after_hands_the_prompt_back(self):
+        self.run_task(CredentialsExhaustedError('quota used up', provider='whisk', retry_after=8 * 3600))
+
+        self.retry.assert_not_called()
+        self.assertEqual(self.prompt.status, 'pending')
+        self.assertGreater(self.prompt.defer_until, timezone.now() + timedelta(hours=7))
+
+    def test_scheduler_skips_deferred_prompts_until_they_are_due(self):
+        self.prompt.defer_until = timezone.now() + timedelta(hours=1)
+        self.prompt.save()
+        other_request = BulkImageRequest.objects.create(title='Other', status='processing', total_count=2)
+        other_prompts = ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=other_request, prompt_text=f'a dog {index}') for index in range(2)
+        ])
+
+        # The deferred request's slot goes to the other request instead
+        self.assertEqual(scheduler.claim_prompts(2, leases.new_owner()), [prompt.id for prompt in other_prompts])
+
+        ImagePrompt.objects.filter(id=self.prompt.id).update(defer_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(scheduler.claim_prompts(2, leases.new_owner()), [self.prompt.id])
@@ -0,0 +1,123 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from image_generator import events
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+def prompt_event(prompt_id, status, bulk_request_id=1):
+    return SimpleNamespace(
+        id=prompt_id, bulk_request_id=bulk_request_id, status=status, image_url=None,
+        thumbnail_hash='', preview_hash='', generated_provider='',
+    )
+
+
+class StreamBulkEventsTests(FakeRedisMixin, SimpleTestCase):
+    async def collect(self, bulk_request_id, publish):
+        """Subscribe, run ``publish``, then read the stream until it ends"""
+        stream = events.stream_bulk_events(bulk_request_id)
+        # The first chunk is only sent once the stream has subscribed
+        received = [await anext(stream)]
+        publish()
+
+        async def drain():
+            async for chunk in stream:
+                received.append(chunk)
+
+        await asyncio.wait_for(drain(), timeout=5)
+        return received
+
+    def parse(self, chunk):
+        lines = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+        return lines['event'], json.loads(lines['data'])
+
+    async def test_events_arrive_in_publish_order(self):
+        def publish():
+            events.publish_prompt_status(prompt_event(1, 'processing'))
+            events.publish_prompt_status(prompt_event(1, 'completed'))
+            events.publish_prompt_status(prompt_event(2, 'failed'))
+            events.publish_bulk_status(SimpleNamespace(id=1, status='completed'))
+
+        received = await self.collect(1, publish)
+
+        self.assertEqual(received[0], f'retry: {events.SSE_RETRY_MS}\n\n')
+        received_events = [self.parse(chunk) for chunk in received[1:]]
+        self.assertEqual([(name, event['id'], event['status']) for name, event in received_events], [
+            ('prompt', 1, 'processing'),
+            ('prompt', 1, 'completed'),
+            ('prompt', 2, 'failed'),
+            ('bulk', 1, 'completed'),
+        ])
+
+    async def test_only_the_requests_own_events_are_streamed(self):
+        def publish():
+            events.publish_prompt_status(prompt_event(7, 'completed', bulk_request_id=2))
+            events.publish_bulk_status(SimpleNamespace(id=2, status='completed'))
+            events.publish_prompt_status(prompt_event(3, 'completed'))
+            events.publish_bulk_status(SimpleNamespace(id=1, status='completed'))
+
+        received = await self.collect(1, publish)
+
+        self.assertEqual([self.parse(chunk)[1]['id'] for chunk in received[1:]], [3, 1])
+
+    async def test_stream_continues_until_the_request_completes(self):
+        def publish():
+            events.publish_bulk_status(SimpleNamespace(id=1, status='processing'))
+            events.publish_prompt_status(prompt_event(1, 'completed'))
+            events.publish_bulk_status(SimpleNamespace(id=1, status='completed'))
+
+        received = await self.collect(1, publish)
+
+        self.assertEqual([self.parse(chunk)[0] for chunk in received[1:]], ['bulk', 'prompt', 'bulk'])
+
+    def test_publish_survives_redis_outage(self):
+        self.redis_server.connected = False
+        # Generation must carry on; the page picks the change up by polling
+        events.publish_prompt_status(prompt_event(1, 'completed'))
+
+
+class PollingFallbackTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bulk_request = BulkImageRequest.objects.create(title='Fallback', status='processing', total_count=3)
+        cls.prompts = ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=cls.bulk_request, prompt_text=f'prompt {index}') for index in range(3)
+        ])
+
+    def test_event_stream_refuses_wsgi_so_the_page_polls(self):
+        response = self.client.get(reverse('bulk_events', args=[self.bulk_request.id]))
+
+        self.assertEqual(response.status_code, 503)
+
+    async def test_event_stream_under_asgi(self):
+        response = await self.async_client.get(reverse('bulk_events', args=[self.bulk_request.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), f'retry: {events.SSE_RETRY_MS}\n\n'.encode())
+        events.publish_bulk_status(SimpleNamespace(id=self.bulk_request.id, status='completed'))
+        self.assertIn(b'"status": "completed"', await asyncio.wait_for(anext(chunks), timeout=5))
+
+    async def test_event_stream_for_unknown_request(self):
+        response = await self.async_client.get(reverse('bulk_events', args=[self.bulk_request.id + 1000]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_poll_since_cursor_returns_only_changed_prompts(self):
+        url = reverse('get_bulk_status', args=[self.bulk_request.id])
+        cursor = self.client.get(url).json()['cursor']
+        # Older than the cursor and its overlap window, as if updated long ago
+        ImagePrompt.objects.filter(bulk_request=self.bulk_request).update(
+            updated_at=timezone.now() - timezone.timedelta(minutes=5)
+        )
+        changed = self.prompts[1]
+        ImagePrompt.objects.filter(id=changed.id).update(status='completed', updated_at=timezone.now())
+
+        response = self.client.get(url, {'since': cursor}).json()
+
+        self.assertEqual([(prompt['id'], prompt['status']) for prompt in response['prompts']], [(changed.id, 'completed')])
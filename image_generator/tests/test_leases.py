@@ -0,0 +1,120 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from image_generator import leases, scheduler, tasks, transitions
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+@override_settings(GENERATION_ENGINE='async')
+class LeaseTests(FakeRedisMixin, TestCase):
+    """A prompt is only ever worked on, and finished, by its current lease owner"""
+
+    def setUp(self):
+        super().setUp()
+        self.bulk_request = BulkImageRequest.objects.create(title='Leases', status='processing', total_count=1)
+        self.prompt = ImagePrompt.objects.create(bulk_request=self.bulk_request, prompt_text='a cat')
+
+    def claim(self):
+        owner = leases.new_owner()
+        self.assertEqual(scheduler.claim_prompts(1, owner), [self.prompt.id])
+        return owner
+
+    def expire(self):
+        ImagePrompt.objects.filter(id=self.prompt.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_live_lease_is_not_reaped(self):
+        self.claim()
+
+        self.assertEqual(leases.reap_expired(), [])
+
+    def test_expired_lease_is_requeued_exactly_once(self):
+        self.claim()
+        self.expire()
+
+        with mock.patch.object(tasks, 'kick_scheduler') as kick_scheduler:
+            self.assertEqual(tasks.reap_expired_leases_task(), 1)
+            self.assertEqual(tasks.reap_expired_leases_task(), 0)
+        kick_scheduler.assert_called_once()
+
+        self.prompt.refresh_from_db()
+        self.assertEqual((self.prompt.status, self.prompt.lease_owner, self.prompt.lease_expires_at), ('pending', '', None))
+        self.bulk_request.refresh_from_db()
+        self.assertEqual(self.bulk_request.in_flight_count, 0)
+
+    def test_prompt_claimed_before_leases_existed_expires_with_age(self):
+        ImagePrompt.objects.filter(id=self.prompt.id).update(
+            status='processing', updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(leases.reap_expired(), [self.prompt.id])
+
+    def test_stale_owner_cannot_finish_a_reaped_prompt(self):
+        stale_owner = self.claim()
+        self.expire()
+        leases.reap_expired()
+        new_owner = self.claim()
+
+        stale = ImagePrompt.objects.get(id=self.prompt.id)
+        self.assertFalse(transitions.transition_prompt(stale, 'failed', ['processing'], owner=stale_owner))
+        self.assertEqual(leases.extend([self.prompt.id], stale_owner), 0)
+        self.assertFalse(leases.hold(self.prompt.id, stale_owner, 60))
+
+        current = ImagePrompt.objects.get(id=self.prompt.id)
+        self.assertTrue(transitions.transition_prompt(current, 'completed', ['processing'], owner=new_owner))
+        self.bulk_request.refresh_from_db()
+        self.assertEqual((self.bulk_request.completed_count, self.bulk_request.failed_count), (1, 0))
+
+    def test_duplicate_task_delivery_is_skipped(self):
+        scheduler_owner = self.claim()
+        calls = []
+
+        def generate(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                # The broker redelivers the message while the first delivery is still generating
+                tasks.generate_image_task(self.prompt.id, lease_owner=scheduler_owner)
+            raise Exception('upstream down')
+
+        with mock.patch.object(tasks.generation, 'generate_images_with_failover', side_effect=generate), \
+                mock.patch.object(tasks.leases, 'Heartbeat'), mock.patch.object(tasks, 'kick_scheduler'):
+            tasks.generate_image_task(self.prompt.id, lease_owner=scheduler_owner)
+
+        self.assertEqual(len(calls), 1)
+        self.prompt.refresh_from_db()
+        self.assertEqual(self.prompt.status, 'failed')
+
+    def test_extend_renews_only_the_owners_leases(self):
+        owner = self.claim()
+        self.prompt.refresh_from_db()
+        expires_at = self.prompt.lease_expires_at
+
+        with mock.patch.object(leases.timezone, 'now', return_value=timezone.now() + timedelta(seconds=30)):
+            self.assertEqual(leases.extend([self.prompt.id], owner), 1)
+        self.assertEqual(leases.extend([self.prompt.id], 'someone else'), 0)
+
+        self.prompt.refresh_from_db()
+        self.assertGreater(self.prompt.lease_expires_at, expires_at)
+
+
+@override_settings(PROMPT_LEASE_HEARTBEAT_SECONDS=0.01)
+class HeartbeatTests(SimpleTestCase):
+
+    def test_heartbeat_extends_until_the_lease_is_lost(self):
+        calls = []
+        lost = threading.Event()
+
+        def extend(prompt_ids, owner):
+            calls.append((prompt_ids, owner))
+            if len(calls) == 3:
+                lost.set()
+                return 0
+            return 1
+
+        with mock.patch.object(leases, 'extend', side_effect=extend):
+            with leases.Heartbeat(7, 'worker'):
+                self.assertTrue(lost.wait(5))
+        # Stops by itself once extend reports the lease gone
+        self.assertEqual(calls, [([7], 'worker')] * 3)
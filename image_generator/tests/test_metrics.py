@@ -0,0 +1,70 @@
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from image_generator import metrics
+from .fake_redis import FakeRedisMixin
+
+GAUGES = [('image_generator_prompts', 'Prompts by provider and status', [({'provider': 'whisk', 'status': 'pending'}, 3)])]
+
+
+class RenderTests(FakeRedisMixin, SimpleTestCase):
+
+    def test_renders_stored_metrics(self):
+        metrics.inc('image_generator_task_retries_total', {'task': 'generate', 'reason': 'Retry'})
+
+        text = metrics.render(GAUGES)
+
+        self.assertIn('image_generator_task_retries_total{reason="Retry",task="generate"} 1.0', text)
+        self.assertIn('image_generator_prompts{provider="whisk",status="pending"} 3.0', text)
+
+    def test_renders_gauges_when_redis_is_down(self):
+        self.redis_server.connected = False
+
+        with self.assertLogs('image_generator.metrics', 'WARNING'):
+            text = metrics.render(GAUGES)
+
+        for name in metrics.METRICS:
+            self.assertIn(f'# TYPE {name} ', text)
+        self.assertIn('image_generator_prompts{provider="whisk",status="pending"} 3.0', text)
+
+
+class BufferTests(FakeRedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Drop whatever other tests' requests left in the buffer
+        metrics.flush_buffer()
+        self.redis.flushall()
+
+    def test_buffered_observations_are_written_together(self):
+        with mock.patch.object(metrics, 'BUFFER_FLUSH_INTERVAL', 3600):
+            self.assertFalse(metrics.observe_buffered('image_generator_view_db_queries', 3, {'view': 'bulk_list'}))
+            self.assertFalse(metrics.observe_buffered('image_generator_view_db_queries', 40, {'view': 'bulk_list'}))
+        self.assertEqual(self.redis.keys(), [])
+
+        metrics.flush_buffer()
+
+        text = metrics.render()
+        self.assertIn('image_generator_view_db_queries_bucket{view="bulk_list",le="5"} 1.0', text)
+        self.assertIn('image_generator_view_db_queries_bucket{view="bulk_list",le="50"} 2.0', text)
+        self.assertIn('image_generator_view_db_queries_sum{view="bulk_list"} 43.0', text)
+        self.assertIn('image_generator_view_db_queries_count{view="bulk_list"} 2.0', text)
+
+    def test_flush_is_due_after_the_interval(self):
+        with mock.patch.object(metrics, 'BUFFER_FLUSH_INTERVAL', 0):
+            self.assertTrue(metrics.observe_buffered('image_generator_view_db_queries', 3, {'view': 'bulk_list'}))
+
+    def test_requests_do_not_call_redis(self):
+        with mock.patch.object(metrics, 'BUFFER_FLUSH_INTERVAL', 3600), mock.patch.object(metrics, 'get_redis') as get_redis:
+            self.client.get('/metrics-not-found/')
+        get_redis.assert_not_called()
+
+
+@override_settings(CELERY_BROKER_URL='redis://broker.invalid:6379/1', REDIS_URL='redis://localhost:6379/0')
+class QueueDepthTests(SimpleTestCase):
+
+    def test_broker_client_is_created_once(self):
+        with mock.patch.object(metrics, '_broker_client', None), mock.patch('redis.Redis.from_url') as from_url:
+            from_url.return_value.llen.return_value = 7
+            self.assertEqual(metrics.queue_depth('image_generation'), 7)
+            self.assertEqual(metrics.queue_depth('image_generation'), 7)
+        from_url.assert_called_once_with('redis://broker.invalid:6379/1')
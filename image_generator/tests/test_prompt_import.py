@@ -0,0 +1,78 @@
+import os
+import tempfile
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from image_generator import prompt_import, stats, tasks
+from image_generator.models import BulkImageRequest, WhiskSettings
+from .fake_redis import FakeRedisMixin
+
+
+# The async engine claims prompts itself, so nothing reaches the broker
+@override_settings(GENERATION_ENGINE='async')
+class PromptUploadTests(FakeRedisMixin, TestCase):
+    """Uploaded prompt files are imported by a Celery task after the redirect"""
+
+    def setUp(self):
+        super().setUp()
+        upload_root = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_root.cleanup)
+        settings_override = override_settings(PROMPT_UPLOAD_ROOT=upload_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        WhiskSettings.objects.create(auth_token='token', project_id='project')
+
+    def upload(self, content):
+        """Post a prompt file; returns the response and the queued task's arguments"""
+        with mock.patch.object(tasks.import_prompts_task, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('bulk_image_generator'), {
+                'title': 'Upload',
+                'api_provider': 'whisk',
+                'prompts_file': SimpleUploadedFile('prompts.txt', content),
+            })
+        delay.assert_called_once()
+        return response, delay.call_args.args
+
+    def test_upload_redirects_before_importing(self):
+        response, (bulk_request_id, path) = self.upload(b'a cat\na dog\n')
+
+        self.assertRedirects(response, reverse('bulk_status', args=[bulk_request_id]), fetch_redirect_response=False)
+        bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
+        self.assertTrue(bulk_request.importing)
+        self.assertEqual(bulk_request.total_count, 0)
+        self.assertTrue(os.path.exists(path))
+        status = self.client.get(reverse('get_bulk_status', args=[bulk_request_id])).json()
+        self.assertTrue(status['importing'])
+        self.assertEqual(status['prompts'], [])
+
+    def test_task_imports_the_file(self):
+        _, (bulk_request_id, path) = self.upload(b'a cat\n"a dog"\n{"prompt": "a fox"}\n')
+
+        tasks.import_prompts_task(bulk_request_id, path)
+
+        bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
+        self.assertEqual(bulk_request.status, 'processing')
+        self.assertEqual(list(bulk_request.prompts.order_by('id').values_list('prompt_text', flat=True)), ['a cat', 'a dog', 'a fox'])
+        self.assertEqual(bulk_request.total_count, 3)
+        self.assertEqual(stats.get_totals()['all']['prompt_count'], 3)
+        self.assertFalse(os.path.exists(path))
+        status = self.client.get(reverse('get_bulk_status', args=[bulk_request_id])).json()
+        self.assertFalse(status['importing'])
+        self.assertEqual(len(status['prompts']), 3)
+
+    def test_malformed_file_is_reported_on_the_status_page(self):
+        # The first batch commits before the bad element is reached
+        _, (bulk_request_id, path) = self.upload(b'[' + b'"a cat", ' * prompt_import.IMPORT_BATCH_SIZE + b'42]')
+
+        tasks.import_prompts_task(bulk_request_id, path)
+
+        bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
+        self.assertEqual(bulk_request.status, 'completed')
+        self.assertIn('Expected a prompt string', bulk_request.import_error)
+        self.assertFalse(bulk_request.prompts.exists())
+        self.assertEqual(bulk_request.total_count, 0)
+        self.assertEqual(stats.get_totals()['all']['prompt_count'], 0)
+        self.assertFalse(os.path.exists(path))
+        response = self.client.get(reverse('bulk_status', args=[bulk_request_id]))
+        self.assertContains(response, 'Expected a prompt string')
@@ -0,0 +1,152 @@
+import io
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from image_generator import stats
+from image_generator.management.commands.check_query_budgets import QUERY_BUDGETS, Command
+from image_generator.models import BulkImageRequest, ImagePrompt
+from image_generator.storage import LocalImageStore
+from .fake_redis import FakeRedisMixin
+
+STATUSES = ['completed', 'failed', 'pending', 'processing']
+
+
+def seed_bulk_request(size, title='Query budget', candidates_count=1):
+    """A processing request with prompts in every status
+
+    Everything is a day old, so the processing prompts' leases have expired
+    and the pending ones count as stuck.
+    """
+    day_ago = timezone.now() - timedelta(days=1)
+    bulk_request = BulkImageRequest.objects.create(title=title, status='processing', total_count=size, candidates_count=candidates_count)
+    ImagePrompt.objects.bulk_create([
+        ImagePrompt(bulk_request=bulk_request, prompt_text=f'prompt {index}', status=STATUSES[index % len(STATUSES)])
+        for index in range(size)
+    ])
+    bulk_request.prompts.update(updated_at=day_ago)
+    bulk_request.prompts.filter(status='processing').update(lease_owner='gone', lease_expires_at=day_ago)
+    stats.record_bulk_created(bulk_request)
+    stats.reconcile_bulk_request(bulk_request.id)
+    return bulk_request
+
+
+# Nothing may reach the broker while the retry paths run
+@override_settings(GENERATION_ENGINE='async')
+class QueryBudgetTests(FakeRedisMixin, TestCase):
+    """Every hot view and command runs a fixed number of queries
+
+    Each is run against a small and a large request; the count must be the
+    same for both, so a query per prompt fails the test.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bulk_requests = [seed_bulk_request(8, 'Small'), seed_bulk_request(400, 'Large')]
+        for index in range(12):
+            seed_bulk_request(4, f'Filler {index}')
+
+    def assertBudget(self, name, call):
+        for bulk_request in self.bulk_requests:
+            with self.subTest(prompts=bulk_request.total_count), self.assertNumQueries(QUERY_BUDGETS[name]):
+                call(bulk_request)
+
+    def test_bulk_list(self):
+        self.assertBudget('bulk_list', lambda bulk_request: self.client.get(reverse('bulk_list')))
+
+    def test_bulk_list_filtered(self):
+        self.assertBudget('bulk_list filtered', lambda bulk_request: self.client.get(
+            reverse('bulk_list'), {'api_provider': 'whisk', 'page': 2, 'search': 'Filler'}
+        ))
+
+    def test_bulk_status(self):
+        self.assertBudget('bulk_status', lambda bulk_request: self.client.get(reverse('bulk_status', args=[bulk_request.id])))
+
+    def test_get_bulk_status(self):
+        self.assertBudget('get_bulk_status', lambda bulk_request: self.client.get(
+            reverse('get_bulk_status', args=[bulk_request.id])
+        ))
+
+    def test_get_bulk_status_with_variants(self):
+        # One more query fetches the variants of every prompt in the response
+        BulkImageRequest.objects.filter(id__in=[bulk_request.id for bulk_request in self.bulk_requests]).update(candidates_count=4)
+        for bulk_request in self.bulk_requests:
+            with self.subTest(prompts=bulk_request.total_count), self.assertNumQueries(QUERY_BUDGETS['get_bulk_status'] + 1):
+                self.client.get(reverse('get_bulk_status', args=[bulk_request.id]))
+
+    def test_get_bulk_status_since(self):
+        cursor = (timezone.now() - timedelta(minutes=1)).isoformat()
+        self.assertBudget('get_bulk_status since', lambda bulk_request: self.client.get(
+            reverse('get_bulk_status', args=[bulk_request.id]), {'since': cursor}
+        ))
+
+    def test_download_all_images(self):
+        # The request, its counts, the summary rows, then the prompts and their
+        # variants once per 500-prompt chunk; every request here fits one chunk
+        store_root = tempfile.TemporaryDirectory()
+        self.addCleanup(store_root.cleanup)
+        store = LocalImageStore(store_root.name)
+        patcher = mock.patch('image_generator.storage._image_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        image_hash = store.save(b'not really a png', 'image/png').sha256
+        for bulk_request in self.bulk_requests:
+            bulk_request.prompts.filter(status='completed').update(image_hash=image_hash, image_mime_type='image/png')
+            with self.subTest(prompts=bulk_request.total_count), self.assertNumQueries(5):
+                response = self.client.get(reverse('download_all_images', args=[bulk_request.id]))
+                archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(len(archive.namelist()), 1 + bulk_request.total_count // len(STATUSES))
+
+    def test_retry_all_failed(self):
+        self.assertBudget('retry_all_failed', lambda bulk_request: self.client.post(
+            reverse('retry_all_failed', args=[bulk_request.id])
+        ))
+        for bulk_request in self.bulk_requests:
+            self.assertFalse(bulk_request.prompts.filter(status='failed').exists())
+
+    def test_reset_stuck_prompts(self):
+        self.assertBudget('reset_stuck_prompts', lambda bulk_request: self.client.post(
+            reverse('reset_stuck_prompts', args=[bulk_request.id])
+        ))
+        for bulk_request in self.bulk_requests:
+            self.assertFalse(bulk_request.prompts.filter(status='processing').exists())
+
+    def test_fix_stuck_images(self):
+        self.assertBudget('fix_stuck_images', lambda bulk_request: call_command(
+            'fix_stuck_images', bulk_id=bulk_request.id, include_pending=True, stdout=io.StringIO()
+        ))
+        for bulk_request in self.bulk_requests:
+            self.assertFalse(bulk_request.prompts.filter(status='processing').exists())
+
+
+class IndexUsageTests(TestCase):
+    """The hot prompt queries can be answered from their indexes
+
+    The planner rightly prefers sequential scans on a test-sized table, so
+    they are switched off for the transaction: a query whose filter does not
+    match any index, including the conditions of the partial ones, still
+    falls back to a sequential scan and fails. check_query_budgets checks
+    the same plans on a realistic seeded dataset.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bulk_request = seed_bulk_request(400)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {ImagePrompt._meta.db_table}')
+            cursor.execute(f'ANALYZE {BulkImageRequest._meta.db_table}')
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_queries_use_their_indexes(self):
+        for name, queryset, index in Command().plans(self.bulk_request):
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIn(index, plan, f'{name} should use {index}:\n{plan}')
@@ -0,0 +1,160 @@
+import time
+from contextlib import ExitStack
+from unittest import mock
+import fakeredis
+from django.test import SimpleTestCase, override_settings
+from image_generator import rate_limit
+from image_generator.rate_limit import RateLimitTimeout
+from .fake_redis import FakeRedisMixin
+
+
+@override_settings(RATE_LIMIT_MAX_WAIT=0, RATE_LIMIT_LEASE_SECONDS=180, INTERACTIVE_RESERVED_SHARE=0)
+class ProviderSlotTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Real time: the in-flight sets expire at an absolute timestamp
+        self.now_ms = int(time.time() * 1000)
+        patcher = mock.patch.object(rate_limit, '_now_ms', lambda: self.now_ms)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def take(self, token='token-a', provider='whisk'):
+        """Acquire and release a slot"""
+        with rate_limit.provider_slot(provider, token):
+            pass
+
+    def hold(self, stack, token='token-a', provider='whisk'):
+        stack.enter_context(rate_limit.provider_slot(provider, token))
+
+    def test_burst_then_empty_bucket(self):
+        rate_limit.set_limits('whisk', rate=1, burst=2, max_in_flight=10)
+
+        self.take()
+        self.take()
+        with self.assertRaises(RateLimitTimeout):
+            self.take()
+
+    def test_tokens_refill_at_the_configured_rate(self):
+        rate_limit.set_limits('whisk', rate=2, burst=2, max_in_flight=10)
+        self.take()
+        self.take()
+
+        self.now_ms += 500
+        self.take()
+        with self.assertRaises(RateLimitTimeout):
+            self.take()
+
+        # Never more than the burst, however long the bucket sat idle
+        self.now_ms += 60_000
+        self.take()
+        self.take()
+        with self.assertRaises(RateLimitTimeout):
+            self.take()
+
+    @override_settings(RATE_LIMIT_MAX_WAIT=10)
+    def test_waits_for_the_next_token(self):
+        rate_limit.set_limits('whisk', rate=4, burst=1, max_in_flight=10)
+        self.take()
+
+        def sleep(seconds):
+            self.now_ms += int(seconds * 1000)
+
+        with mock.patch.object(rate_limit.time, 'sleep', side_effect=sleep) as sleep_mock:
+            self.take()
+
+        sleep_mock.assert_called_once_with(0.25)
+
+    def test_in_flight_cap(self):
+        rate_limit.set_limits('whisk', rate=100, burst=100, max_in_flight=2)
+        with ExitStack() as stack:
+            self.hold(stack)
+            self.hold(stack)
+            with self.assertRaises(RateLimitTimeout):
+                self.take()
+            self.assertEqual(rate_limit.get_utilisation('whisk')['tokens'][0]['in_flight'], 2)
+        # Both slots were released on exit
+        self.take()
+
+    def test_limits_are_per_auth_token(self):
+        rate_limit.set_limits('whisk', rate=1, burst=1, max_in_flight=1)
+        with ExitStack() as stack:
+            self.hold(stack, token='token-a')
+            self.take(token='token-b')
+            with self.assertRaises(RateLimitTimeout):
+                self.take(token='token-a')
+
+    def test_limits_are_per_provider(self):
+        rate_limit.set_limits('whisk', rate=1, burst=1, max_in_flight=1)
+        self.take(provider='whisk')
+        self.take(provider='imagefx')
+
+    def test_slot_of_a_crashed_worker_expires(self):
+        rate_limit.set_limits('whisk', rate=100, burst=100, max_in_flight=1)
+        # Entered and never exited, as when a worker dies mid-call
+        crashed = rate_limit.provider_slot('whisk', 'token-a')
+        crashed.__enter__()
+        with self.assertRaises(RateLimitTimeout):
+            self.take()
+
+        self.now_ms += 181_000
+        self.take()
+
+    @override_settings(INTERACTIVE_RESERVED_SHARE=0.5)
+    def test_interactive_lane_uses_reserved_capacity(self):
+        rate_limit.set_limits('whisk', rate=100, burst=100, max_in_flight=2)
+        with ExitStack() as stack:
+            self.hold(stack)
+            with self.assertRaises(RateLimitTimeout):
+                self.take()
+            with rate_limit.interactive_lane():
+                self.take()
+
+    @override_settings(INTERACTIVE_RESERVED_SHARE=0.5)
+    def test_interactive_lane_uses_reserved_tokens(self):
+        rate_limit.set_limits('whisk', rate=1, burst=4, max_in_flight=10)
+        self.take()
+        self.take()
+        with self.assertRaises(RateLimitTimeout):
+            self.take()
+
+        with rate_limit.interactive_lane():
+            self.take()
+            self.take()
+            with self.assertRaises(RateLimitTimeout):
+                self.take()
+
+    @override_settings(INTERACTIVE_RESERVED_SHARE=1)
+    def test_background_work_keeps_one_slot_and_token(self):
+        self.assertEqual(rate_limit.lane_limits({'rate': 1, 'burst': 3, 'max_in_flight': 3}), (1, 2))
+        with rate_limit.interactive_lane():
+            self.assertEqual(rate_limit.lane_limits({'rate': 1, 'burst': 3, 'max_in_flight': 3}), (3, 0))
+
+    def test_runtime_limits_override_settings(self):
+        rate_limit.set_limits('imagefx', max_in_flight=7)
+        self.assertEqual(rate_limit.get_limits('imagefx')['max_in_flight'], 7)
+
+        rate_limit.reset_limits('imagefx')
+        with self.settings(PROVIDER_RATE_LIMITS={'default': {'rate': 3.0, 'burst': 6, 'max_in_flight': 5}}):
+            self.assertEqual(rate_limit.get_limits('imagefx'), {'rate': 3.0, 'burst': 6, 'max_in_flight': 5})
+
+    def test_redis_outage_lets_calls_through(self):
+        self.redis_server.connected = False
+        with self.assertLogs('image_generator.rate_limit', 'WARNING'):
+            self.take()
+
+    async def test_async_slots_share_the_sync_limits(self):
+        rate_limit.set_limits('whisk', rate=100, burst=100, max_in_flight=1)
+        client = fakeredis.aioredis.FakeRedis(server=self.redis_server)
+        with ExitStack() as stack:
+            self.hold(stack)
+            with self.assertRaises(RateLimitTimeout):
+                async with rate_limit.aprovider_slot('whisk', 'token-a', client):
+                    pass
+        async with rate_limit.aprovider_slot('whisk', 'token-a', client):
+            self.assertEqual(self.redis.zcard(rate_limit._inflight_key('whisk', 'token-a')), 1)
+        self.assertEqual(self.redis.zcard(rate_limit._inflight_key('whisk', 'token-a')), 0)
+        await client.aclose()
+
+    def test_auth_tokens_never_appear_in_keys(self):
+        self.take(token='secret-token')
+        self.assertFalse([key for key in self.redis.keys('*') if b'secret-token' in key])
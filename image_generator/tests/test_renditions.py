@@ -0,0 +1,46 @@
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from image_generator import renditions, tasks
+from image_generator.async_engine import AsyncGenerationEngine
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+class RenditionReuseTests(FakeRedisMixin, TestCase):
+    """A cache hit takes the renditions of the earlier prompt with the same image"""
+
+    def setUp(self):
+        super().setUp()
+        bulk_request = BulkImageRequest.objects.create(title='Renditions', status='processing', total_count=2)
+        self.original, self.cache_hit = ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=bulk_request, prompt_text='a cat', status='completed', image_hash='a' * 64,
+                        thumbnail_hash='b' * 64, preview_hash='c' * 64),
+            ImagePrompt(bulk_request=bulk_request, prompt_text='a cat', status='completed', image_hash='a' * 64),
+        ])
+        patcher = mock.patch.object(renditions, 'apply_renditions')
+        self.apply_renditions = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertReused(self):
+        self.apply_renditions.assert_not_called()
+        self.cache_hit.refresh_from_db()
+        self.assertEqual((self.cache_hit.thumbnail_hash, self.cache_hit.preview_hash), ('b' * 64, 'c' * 64))
+
+    def test_celery_task_reuses_existing_renditions(self):
+        tasks.create_image_renditions_task(self.cache_hit.id)
+
+        self.assertReused()
+
+    def test_async_engine_reuses_existing_renditions(self):
+        async_to_sync(AsyncGenerationEngine().create_renditions)(self.cache_hit)
+
+        self.assertReused()
+
+    def test_new_image_is_rendered(self):
+        ImagePrompt.objects.filter(id=self.cache_hit.id).update(image_hash='d' * 64)
+        self.cache_hit.refresh_from_db()
+
+        async_to_sync(AsyncGenerationEngine().create_renditions)(self.cache_hit)
+
+        self.apply_renditions.assert_called_once_with(self.cache_hit)
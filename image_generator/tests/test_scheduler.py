@@ -0,0 +1,101 @@
+from unittest import mock
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
+from image_generator import leases, rate_limit, scheduler, stats, tasks
+from image_generator.models import BulkImageRequest, ImagePrompt
+from image_generator.rate_limit import RateLimitTimeout
+from .fake_redis import FakeRedisMixin
+
+
+@override_settings(GENERATION_ENGINE='async')
+class SchedulerTests(FakeRedisMixin, TestCase):
+    """Capacity is shared across bulk requests by priority, not by arrival"""
+
+    def create_bulk_request(self, size, priority=2, title='Scheduler'):
+        bulk_request = BulkImageRequest.objects.create(title=title, status='processing', priority=priority, total_count=size)
+        ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=bulk_request, prompt_text=f'{title} {index}') for index in range(size)
+        ])
+        stats.record_bulk_created(bulk_request)
+        return bulk_request
+
+    def test_allocation_follows_priority(self):
+        low = BulkImageRequest(id=1, priority=1, total_count=100)
+        high = BulkImageRequest(id=2, priority=4, total_count=100)
+
+        self.assertEqual(scheduler.allocate([low, high], 10), {1: 2, 2: 8})
+
+    def test_allocation_counts_prompts_already_in_flight(self):
+        busy = BulkImageRequest(id=1, priority=2, total_count=100, in_flight_count=6)
+        idle = BulkImageRequest(id=2, priority=2, total_count=100)
+
+        self.assertEqual(scheduler.allocate([busy, idle], 6), {2: 6})
+
+    def test_allocation_never_exceeds_the_pending_prompts(self):
+        small = BulkImageRequest(id=1, priority=4, total_count=2)
+        done = BulkImageRequest(id=2, priority=4, total_count=5, completed_count=5)
+        large = BulkImageRequest(id=3, priority=1, total_count=100)
+
+        self.assertEqual(scheduler.allocate([small, done, large], 10), {1: 2, 3: 8})
+
+    def test_small_high_priority_request_is_served_ahead_of_a_large_one(self):
+        large = self.create_bulk_request(1000, priority=2, title='Large')
+        small = self.create_bulk_request(3, priority=4, title='Small')
+
+        claimed = scheduler.claim_prompts(5, leases.new_owner())
+
+        small_ids = set(small.prompts.values_list('id', flat=True))
+        self.assertEqual(len(claimed), 5)
+        # Arriving later does not put the small request behind the large one's thousand prompts
+        self.assertTrue(small_ids <= set(claimed))
+        self.assertEqual(ImagePrompt.objects.filter(bulk_request=large, status='processing').count(), 2)
+        small.refresh_from_db()
+        self.assertEqual(small.in_flight_count, 3)
+
+    def test_claims_are_interleaved_across_requests(self):
+        first = self.create_bulk_request(3, title='First')
+        second = self.create_bulk_request(3, title='Second')
+
+        claimed = scheduler.claim_prompts(6, leases.new_owner())
+
+        owners = dict(ImagePrompt.objects.filter(id__in=claimed).values_list('id', 'bulk_request_id'))
+        self.assertEqual(
+            sorted([owners[prompt_id] for prompt_id in claimed[:2]]),
+            sorted([first.id, second.id]),
+        )
+        self.assertEqual(scheduler.claim_prompts(6, leases.new_owner()), [])
+
+    def test_claiming_skips_requests_that_are_not_running(self):
+        importing = self.create_bulk_request(3, title='Importing')
+        BulkImageRequest.objects.filter(id=importing.id).update(status='pending')
+
+        self.assertEqual(scheduler.claim_prompts(3, leases.new_owner()), [])
+
+
+@override_settings(GENERATION_ENGINE='async', RATE_LIMIT_MAX_WAIT=0, INTERACTIVE_RESERVED_SHARE=0.5)
+class InteractiveReserveTests(FakeRedisMixin, TestCase):
+    """Scheduled prompts run in the background lane and leave the reserve to single images"""
+
+    def test_scheduled_prompt_cannot_take_the_reserved_slot(self):
+        rate_limit.set_limits('whisk', rate=100, burst=100, max_in_flight=2)
+        bulk_request = BulkImageRequest.objects.create(title='Reserve', status='processing', total_count=1)
+        ImagePrompt.objects.create(bulk_request=bulk_request, prompt_text='a cat')
+        owner = leases.new_owner()
+        [prompt_id] = scheduler.claim_prompts(1, owner)
+
+        def generate(providers, prompt_text, **kwargs):
+            with rate_limit.provider_slot('whisk', 'token'):
+                pass
+
+        # Another bulk prompt holds the only background slot; the other one is reserved
+        with rate_limit.provider_slot('whisk', 'token'), \
+                mock.patch.object(tasks.generation, 'generate_images_with_failover', side_effect=generate), \
+                mock.patch.object(tasks.leases, 'Heartbeat'), \
+                mock.patch.object(tasks.generate_image_task, 'retry', return_value=Retry()) as retry:
+            with self.assertRaises(Retry):
+                tasks.generate_image_task(prompt_id, lease_owner=owner)
+            self.assertIsInstance(retry.call_args.kwargs['exc'], RateLimitTimeout)
+
+            # A single image from the web UI still gets through
+            with rate_limit.interactive_lane(), rate_limit.provider_slot('whisk', 'token'):
+                pass
@@ -0,0 +1,69 @@
+from django.test import TestCase
+from django.urls import reverse
+from image_generator import stats
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+class BulkStatsTests(FakeRedisMixin, TestCase):
+    def create_bulk_request(self, statuses, api_provider='whisk', status='processing'):
+        bulk_request = BulkImageRequest.objects.create(title='Stats', api_provider=api_provider, status=status, total_count=len(statuses))
+        ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=bulk_request, prompt_text=f'prompt {index}', status=status, api_provider=api_provider)
+            for index, status in enumerate(statuses)
+        ])
+        stats.record_bulk_created(bulk_request)
+        return bulk_request
+
+    def test_reconcile_fixes_drifted_counters(self):
+        bulk_request = self.create_bulk_request(['completed', 'failed', 'processing', 'pending'])
+
+        drift = stats.reconcile_bulk_request(bulk_request.id)
+
+        self.assertEqual(drift, {'in_flight_count': (0, 1), 'completed_count': (0, 1), 'failed_count': (0, 1)})
+        bulk_request.refresh_from_db()
+        self.assertEqual(bulk_request.status_counts(), {'total': 4, 'completed': 1, 'failed': 1, 'processing': 1, 'pending': 1})
+        totals = stats.get_totals()['whisk']
+        self.assertEqual((totals['prompt_count'], totals['completed_count'], totals['failed_count']), (4, 1, 1))
+        self.assertEqual(stats.reconcile_bulk_request(bulk_request.id), {})
+
+    def test_reconcile_completes_a_finished_request(self):
+        bulk_request = self.create_bulk_request(['completed', 'failed'])
+
+        drift = stats.reconcile_bulk_request(bulk_request.id)
+
+        self.assertEqual(drift['status'], ('processing', 'completed'))
+
+    def test_reconcile_leaves_an_importing_request_pending(self):
+        bulk_request = self.create_bulk_request([], status='pending')
+
+        self.assertEqual(stats.reconcile_bulk_request(bulk_request.id), {})
+        bulk_request.refresh_from_db()
+        self.assertEqual(bulk_request.status, 'pending')
+
+    def test_reconcile_counts_batches_already_imported(self):
+        # Every imported batch is committed, so the counters may be corrected mid-import
+        bulk_request = self.create_bulk_request(['pending', 'pending'], status='pending')
+        BulkImageRequest.objects.filter(id=bulk_request.id).update(total_count=1)
+
+        drift = stats.reconcile_bulk_request(bulk_request.id)
+
+        self.assertEqual(drift, {'total_count': (1, 2)})
+        bulk_request.refresh_from_db()
+        self.assertEqual(bulk_request.status, 'pending')
+
+    def test_deleting_a_request_removes_it_from_the_totals(self):
+        kept = self.create_bulk_request(['completed'], api_provider='imagefx')
+        deleted = self.create_bulk_request(['completed', 'failed', 'pending'], api_provider='imagefx')
+        stats.reconcile_bulk_request(kept.id)
+        stats.reconcile_bulk_request(deleted.id)
+
+        response = self.client.delete(reverse('delete_bulk_request', args=[deleted.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BulkImageRequest.objects.filter(id=deleted.id).exists())
+        totals = stats.get_totals()['imagefx']
+        self.assertEqual(
+            (totals['request_count'], totals['prompt_count'], totals['completed_count'], totals['failed_count']),
+            (1, 1, 1, 0),
+        )
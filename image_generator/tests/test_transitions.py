@@ -0,0 +1,126 @@
+from django.test import TestCase
+from image_generator import leases, stats, transitions
+from image_generator.models import BulkImageRequest, ImagePrompt
+from .fake_redis import FakeRedisMixin
+
+
+class TransitionTests(FakeRedisMixin, TestCase):
+    """Status changes and the counters they move stay in step"""
+
+    def setUp(self):
+        super().setUp()
+        self.bulk_request = self.create_bulk_request(['pending', 'pending', 'processing', 'completed', 'failed'])
+
+    def create_bulk_request(self, statuses):
+        bulk_request = BulkImageRequest.objects.create(title='Transitions', status='processing', total_count=len(statuses))
+        ImagePrompt.objects.bulk_create([
+            ImagePrompt(bulk_request=bulk_request, prompt_text=f'prompt {index}', status=status)
+            for index, status in enumerate(statuses)
+        ])
+        stats.record_bulk_created(bulk_request)
+        stats.reconcile_bulk_request(bulk_request.id)
+        return bulk_request
+
+    def prompts(self, status):
+        return list(self.bulk_request.prompts.filter(status=status).order_by('id'))
+
+    def assertCounts(self, **counts):
+        """Check the given status counts, and that every counter matches the prompts"""
+        self.bulk_request.refresh_from_db()
+        stored = self.bulk_request.status_counts()
+        self.assertEqual({status: stored[status] for status in counts}, counts)
+        self.assertEqual(stats.count_prompts(self.bulk_request.id), {
+            'total_count': self.bulk_request.total_count,
+            'in_flight_count': self.bulk_request.in_flight_count,
+            'completed_count': self.bulk_request.completed_count,
+            'failed_count': self.bulk_request.failed_count,
+        })
+        totals = stats.get_totals()['all']
+        self.assertEqual(
+            (totals['in_flight_count'], totals['completed_count'], totals['failed_count']),
+            (self.bulk_request.in_flight_count, self.bulk_request.completed_count, self.bulk_request.failed_count),
+        )
+
+    def test_transition_moves_the_counters(self):
+        prompt = self.prompts('processing')[0]
+
+        self.assertTrue(transitions.transition_prompt(prompt, 'completed', ['processing']))
+
+        self.assertCounts(processing=0, completed=2, failed=1, pending=2)
+
+    def test_second_transition_of_the_same_prompt_is_rejected(self):
+        prompt = self.prompts('processing')[0]
+        duplicate = ImagePrompt.objects.get(id=prompt.id)
+
+        self.assertTrue(transitions.transition_prompt(prompt, 'completed', ['processing']))
+        self.assertFalse(transitions.transition_prompt(duplicate, 'failed', ['processing']))
+
+        self.assertEqual(ImagePrompt.objects.get(id=prompt.id).status, 'completed')
+        self.assertCounts(processing=0, completed=2, failed=1)
+
+    def test_transition_by_another_owner_is_rejected(self):
+        prompt = self.prompts('pending')[0]
+        leases.grant(prompt, 'worker-a')
+        self.assertTrue(transitions.transition_prompt(prompt, 'processing', ['pending'], fields=['lease_owner', 'lease_expires_at']))
+
+        self.assertFalse(transitions.transition_prompt(prompt, 'completed', ['processing'], owner='worker-b'))
+
+        prompt.refresh_from_db()
+        self.assertEqual((prompt.status, prompt.lease_owner), ('processing', 'worker-a'))
+        self.assertCounts(processing=2, completed=1)
+        self.assertTrue(transitions.transition_prompt(prompt, 'completed', ['processing'], owner='worker-a'))
+        prompt.refresh_from_db()
+        self.assertEqual((prompt.status, prompt.lease_owner, prompt.lease_expires_at), ('completed', '', None))
+        self.assertCounts(processing=1, completed=2)
+
+    def test_bulk_transition_returns_and_counts_every_changed_prompt(self):
+        expected = sorted(prompt.id for prompt in self.prompts('processing') + self.prompts('failed') + self.prompts('completed'))
+
+        prompt_ids = transitions.transition_prompts(
+            self.bulk_request.prompts.filter(status__in=['processing', 'failed', 'completed']), 'pending'
+        )
+
+        self.assertEqual(sorted(prompt_ids), expected)
+        self.assertCounts(total=5, processing=0, completed=0, failed=0, pending=5)
+        # Finished prompts going back to pending reopen nothing here; the request was still running
+        self.assertEqual(self.bulk_request.status, 'processing')
+
+    def test_bulk_transition_grants_the_lease(self):
+        expires_at = leases.lease_expiry()
+
+        prompt_ids = transitions.transition_prompts(self.bulk_request.prompts.filter(status='pending'), 'processing', lease=('engine', expires_at))
+
+        self.assertEqual(len(prompt_ids), 2)
+        for prompt in ImagePrompt.objects.filter(id__in=prompt_ids):
+            self.assertEqual((prompt.lease_owner, prompt.lease_expires_at), ('engine', expires_at))
+        self.assertCounts(processing=3, pending=0)
+
+    def test_repeating_a_bulk_transition_changes_nothing(self):
+        queryset = self.bulk_request.prompts.filter(status='pending')
+        self.assertEqual(len(transitions.transition_prompts(queryset, 'processing')), 2)
+
+        self.assertEqual(transitions.transition_prompts(queryset, 'processing'), [])
+
+        self.assertCounts(processing=3, pending=0)
+
+    def test_bulk_transition_across_requests_moves_each_requests_counters(self):
+        # Reconciled as completed, since every prompt has finished
+        other = self.create_bulk_request(['failed', 'failed'])
+
+        transitions.transition_prompts(ImagePrompt.objects.filter(status='failed'), 'pending')
+
+        other.refresh_from_db()
+        self.assertEqual((other.failed_count, other.status), (0, 'processing'))
+        self.assertCounts(failed=0, pending=3)
+        self.assertEqual(stats.get_totals()['all']['failed_count'], 0)
+
+    def test_last_finished_prompt_completes_the_request_and_a_reset_reopens_it(self):
+        for prompt in self.prompts('pending') + self.prompts('processing'):
+            transitions.transition_prompt(prompt, 'completed', ['pending', 'processing'])
+        self.assertCounts(completed=4, failed=1, pending=0)
+        self.assertEqual(self.bulk_request.status, 'completed')
+
+        transitions.transition_prompts(self.bulk_request.prompts.filter(status='failed'), 'pending')
+
+        self.assertCounts(failed=0, pending=1)
+        self.assertEqual(self.bulk_request.status, 'processing')
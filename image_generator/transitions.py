@@ -0,0 +1,113 @@
+import logging
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from . import events, stats
+from .models import BulkImageRequest, ImagePrompt
+
+logger = logging.getLogger(__name__)
+
+# Written whenever a prompt leaves processing, so finished prompts hold no lease
+RELEASED_LEASE = {'lease_owner': '', 'lease_expires_at': None}
+
+# Prompt statuses counted on BulkImageRequest; pending is whatever is left of total_count
+STATUS_COUNTERS = {
+    'processing': 'in_flight_count',
+    'completed': 'completed_count',
+    'failed': 'failed_count',
+}
+
+
+def record_transitions(bulk_request_id, api_provider, changes):
+    """Apply ``{(old_status, new_status): prompts}`` to a bulk request's counters
+
+    Counters move with F() expressions so concurrent workers never lose an
+    update. The request is marked completed by whichever transition finishes
+    its last prompt, and reopened when finished prompts go back to pending.
+    """
+    deltas = Counter()
+    for (old_status, new_status), count in changes.items():
+        if old_status == new_status:
+            continue
+        if old_status in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[old_status]] -= count
+        if new_status in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[new_status]] += count
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not updates:
+        return
+
+    now = timezone.now()
+    bulk_requests = BulkImageRequest.objects.filter(id=bulk_request_id)
+    bulk_requests.update(updated_at=now, **updates)
+    stats.adjust(api_provider, bulk_request_id, **deltas)
+
+    finished = F('completed_count') + F('failed_count')
+    # Row locks make exactly one of two racing transitions see the request unfinished
+    if bulk_requests.exclude(status='completed').filter(total_count__lte=finished).update(status='completed', updated_at=now):
+        events.publish_bulk_status(BulkImageRequest(id=bulk_request_id, status='completed'))
+        logger.info(f"Bulk request {bulk_request_id} marked as completed")
+    elif bulk_requests.filter(status='completed', total_count__gt=finished).update(status='processing', updated_at=now):
+        events.publish_bulk_status(BulkImageRequest(id=bulk_request_id, status='processing'))
+
+
+def transition_prompt(prompt, new_status, from_statuses, fields=(), owner=None):
+    """Move one prompt to ``new_status`` if it is currently in ``from_statuses``
+
+    ``fields`` are also written from the in-memory prompt. With ``owner`` the
+    prompt must still be leased to that worker. Returns False, and writes
+    nothing, when another process has already moved the prompt on.
+    """
+    with transaction.atomic():
+        prompts = ImagePrompt.objects.select_for_update().filter(id=prompt.id, status__in=from_statuses)
+        if owner is not None:
+            prompts = prompts.filter(lease_owner=owner)
+        old_status = prompts.values_list('status', flat=True).first()
+        if old_status is None:
+            return False
+        prompt.status = new_status
+        prompt.updated_at = timezone.now()
+        # Skip deferred columns; reading them would load e.g. a legacy base64 image
+        deferred = prompt.get_deferred_fields()
+        values = {field: getattr(prompt, field) for field in fields if field not in deferred}
+        if new_status != 'processing':
+            for field, value in RELEASED_LEASE.items():
+                setattr(prompt, field, value)
+            values.update(RELEASED_LEASE)
+        ImagePrompt.objects.filter(id=prompt.id).update(status=new_status, updated_at=prompt.updated_at, **values)
+        record_transitions(prompt.bulk_request_id, prompt.api_provider, {(old_status, new_status): 1})
+    return True
+
+
+def transition_prompts(queryset, new_status, skip_locked=False, lease=None):
+    """Move every prompt in ``queryset`` to ``new_status`` and return their ids
+
+    ``lease`` is an ``(owner, expires_at)`` pair granted to every claimed
+    prompt; any other status releases the lease. Runs as a single ``UPDATE ... FROM (SELECT ... FOR UPDATE) RETURNING``, so
+    the rows changed, their previous statuses and the returned ids always
+    agree, however many prompts match. With ``skip_locked`` rows locked by
+    another transaction are left alone, which lets several claimers take
+    disjoint batches.
+    """
+    table = connection.ops.quote_name(ImagePrompt._meta.db_table)
+    lease_owner, lease_expires_at = lease or (RELEASED_LEASE['lease_owner'], RELEASED_LEASE['lease_expires_at'])
+    with transaction.atomic():
+        locked = queryset.select_for_update(skip_locked=skip_locked).values('id', 'status')
+        select_sql, select_params = locked.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} AS prompt SET status = %s, updated_at = %s, '
+                f'lease_owner = %s, lease_expires_at = %s '
+                f'FROM ({select_sql}) AS previous WHERE prompt.id = previous.id '
+                f'RETURNING prompt.id, prompt.bulk_request_id, prompt.api_provider, previous.status',
+                [new_status, timezone.now(), lease_owner, lease_expires_at, *select_params]
+            )
+            rows = cursor.fetchall()
+        changes = {}
+        for _, bulk_request_id, api_provider, old_status in rows:
+            bulk_changes = changes.setdefault((bulk_request_id, api_provider), Counter())
+            bulk_changes[(old_status, new_status)] += 1
+        for (bulk_request_id, api_provider), bulk_changes in changes.items():
+            record_transitions(bulk_request_id, api_provider, bulk_changes)
+    return [prompt_id for prompt_id, _, _, _ in rows]
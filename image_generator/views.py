@@ -1,29 +1,51 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, FileResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
 from django.conf import settings
 from django.views.decorators.http import require_http_methods
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, Prefetch, Q
+from django.utils.dateparse import parse_datetime
 from django.contrib import messages
-from .models import BulkImageRequest, ImagePrompt, WhiskSettings, ImageFXSettings
+from .models import BulkImageRequest, ImagePrompt, ImageVariant, WhiskSettings, ImageFXSettings, blob_url, prompt_image_url
 from .forms import WhiskSettingsForm, ImageFXSettingsForm
-from .tasks import generate_image_task
-from . import whisk, imagefx
+from .tasks import import_prompts_task, kick_scheduler, queue_generation
+from .storage import MIME_EXTENSIONS, get_image_store, sniff_mime_type
+from .zipstream import ZipEntry, stream_zip
+from . import credentials, events, generation, leases, metrics, prompt_import, rate_limit, circuit_breaker, stats, transitions
+from .exceptions import (
+    AuthExpiredError, CircuitOpenError, ContentRejectedError, ProviderError, RateLimitedError, ServerError
+)
+from .rate_limit import RateLimitTimeout
+from .credentials import CredentialsExhaustedError
 import zipfile
-import io
-import base64
 import re
 import json
 import logging
+import redis
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+STATUS_CURSOR_OVERLAP = timedelta(seconds=2)
+
+# Rows per INSERT when saving a bulk submission
+BULK_CREATE_BATCH_SIZE = 1000
+
+PROVIDER_ERROR_MESSAGES = {
+    RateLimitedError: 'The API is rate limiting requests right now. Please try again in a minute.',
+    RateLimitTimeout: 'Too many images are being generated right now. Please try again in a minute.',
+    CredentialsExhaustedError: 'Every configured auth token is cooling down or out of quota. Please try again later or add a token in Settings.',
+    AuthExpiredError: 'The API rejected the auth token. Please update it in Settings.',
+    ServerError: 'The API is having problems. Please try again shortly.',
+    ContentRejectedError: 'The API did not return an image for this prompt. Try rewording it.',
+    CircuitOpenError: 'The API is temporarily unavailable after repeated errors. Please try again shortly.',
+}
+
 def index(request):
-    # Check if settings are configured for both APIs
-    whisk_settings = WhiskSettings.get_settings()
-    imagefx_settings = ImageFXSettings.get_settings()
-    
-    whisk_configured = bool(whisk_settings.auth_token and whisk_settings.project_id)
-    imagefx_configured = bool(imagefx_settings.auth_token)
+    # Check if credentials are configured for both APIs
+    whisk_configured = credentials.is_configured('whisk')
+    imagefx_configured = credentials.is_configured('imagefx')
     
     return render(request, 'image_generator/index.html', {
         'whisk_configured': whisk_configured,
@@ -35,6 +57,7 @@ def generate_image_view(request):
     if request.method == 'POST':
         prompt = request.POST.get('prompt')
         api_provider = request.POST.get('api_provider', 'whisk')
+        bypass_cache = request.POST.get('bypass_cache') == 'on'
         
         if not prompt:
             return render(request, 'image_generator/index.html', {'error': 'Prompt is required.'})
@@ -42,62 +65,55 @@ def generate_image_view(request):
         try:
             # Check settings based on selected API provider
             if api_provider == 'imagefx':
-                imagefx_settings = ImageFXSettings.get_settings()
-                if not imagefx_settings.auth_token:
+                if not credentials.is_configured('imagefx'):
                     return render(request, 'image_generator/index.html', {
                         'error': 'Please configure your ImageFX API settings first. Go to Settings to add your auth token.',
                         'prompt': prompt,
                         'api_provider': api_provider
                     })
                 
-                # Generate image using ImageFX
-                image_data = imagefx.generate_image(prompt)
             else:
                 # Default to Whisk
-                whisk_settings = WhiskSettings.get_settings()
-                if not whisk_settings.auth_token or not whisk_settings.project_id:
+                if not credentials.is_configured('whisk'):
                     return render(request, 'image_generator/index.html', {
                         'error': 'Please configure your Whisk API settings first. Go to Settings to add your auth token and project ID.',
                         'prompt': prompt,
                         'api_provider': api_provider
                     })
-                
-                # Generate image using Whisk
-                image_data = whisk.generate_image(prompt)
             
-            if not image_data:
-                raise Exception('Failed to generate image')
-
-            # Extract the first image URL
-            image_url = None
-            for panel in image_data.get('imagePanels', []):
-                for image in panel.get('generatedImages', []):
-                    image_url = f"data:image/png;base64,{image.get('encodedImage')}"
-                    break
-                if image_url:
-                    break
-
-            if not image_url:
+            # Single images skip the bulk queues and may use the capacity reserved for them
+            with rate_limit.interactive_lane():
+                stored_images, cache_hit = generation.generate_images(api_provider, prompt, bypass_cache=bypass_cache)
+            if not stored_images:
                 raise Exception('No image generated')
 
+            # The image lives in the image store, so the page only carries its URL
+            image_url = blob_url(stored_images[0].sha256)
+
             # Return to the same page with the generated image
             return render(request, 'image_generator/index.html', {
                 'generated_image': image_url,
+                'cache_hit': cache_hit,
+                'bypass_cache': bypass_cache,
                 'prompt': prompt,
                 'api_provider': api_provider,
-                'whisk_configured': bool(WhiskSettings.get_settings().auth_token and WhiskSettings.get_settings().project_id),
-                'imagefx_configured': bool(ImageFXSettings.get_settings().auth_token),
+                'whisk_configured': credentials.is_configured('whisk'),
+                'imagefx_configured': credentials.is_configured('imagefx'),
                 'settings_configured': True
             })
 
         except Exception as e:
             logger.error(f"Error generating image: {str(e)}")
+            if isinstance(e, ProviderError) and not settings.DEBUG:
+                error = PROVIDER_ERROR_MESSAGES.get(type(e), 'Failed to generate image. Please try again.')
+            else:
+                error = str(e) if settings.DEBUG else 'Failed to generate image. Please try again.'
             return render(request, 'image_generator/index.html', {
-                'error': str(e) if settings.DEBUG else 'Failed to generate image. Please try again.',
+                'error': error,
                 'prompt': prompt,
                 'api_provider': api_provider,
-                'whisk_configured': bool(WhiskSettings.get_settings().auth_token and WhiskSettings.get_settings().project_id),
-                'imagefx_configured': bool(ImageFXSettings.get_settings().auth_token),
+                'whisk_configured': credentials.is_configured('whisk'),
+                'imagefx_configured': credentials.is_configured('imagefx'),
                 'settings_configured': True
             })
     else:
@@ -113,14 +129,15 @@ def bulk_list(request):
     search_query = request.GET.get('search', '')
     page_number = request.GET.get('page', 1)
     
-    # Base queryset with annotations
-    bulk_requests = BulkImageRequest.objects.annotate(
-        completed_count=Count('prompts', filter=Q(prompts__status='completed')),
-        failed_count=Count('prompts', filter=Q(prompts__status='failed')),
-        processing_count=Count('prompts', filter=Q(prompts__status='processing')),
-        pending_count=Count('prompts', filter=Q(prompts__status='pending')),
-        total_count=Count('prompts')
-    )
+    # Per-status counts are stored on each request, no join needed; the
+    # preview prefetch loads at most four thumbnails per request on the page
+    bulk_requests = BulkImageRequest.objects.prefetch_related(Prefetch(
+        'prompts',
+        queryset=ImagePrompt.objects.filter(status='completed').exclude(image_hash='').only(
+            'id', 'bulk_request_id', 'image_hash', 'thumbnail_hash'
+        ).order_by('id')[:4],
+        to_attr='preview_prompts'
+    ))
     
     # Apply filters
     if api_provider != 'all':
@@ -132,16 +149,17 @@ def bulk_list(request):
     # Order by creation date (newest first)
     bulk_requests = bulk_requests.order_by('-created_at')
     
-    # Calculate statistics
-    all_requests = BulkImageRequest.objects.all()
-    stats = {
-        'total_requests': all_requests.count(),
-        'whisk_requests': all_requests.filter(api_provider='whisk').count(),
-        'imagefx_requests': all_requests.filter(api_provider='imagefx').count(),
-        'total_images': ImagePrompt.objects.count(),
-        'completed_images': ImagePrompt.objects.filter(status='completed').count(),
-        'processing_images': ImagePrompt.objects.filter(status='processing').count(),
-        'failed_images': ImagePrompt.objects.filter(status='failed').count(),
+    # Calculate statistics from the rolled-up counters
+    totals = stats.get_totals()
+    empty = dict.fromkeys(stats.COUNTER_FIELDS, 0)
+    page_stats = {
+        'total_requests': totals['all']['request_count'],
+        'whisk_requests': totals.get('whisk', empty)['request_count'],
+        'imagefx_requests': totals.get('imagefx', empty)['request_count'],
+        'total_images': totals['all']['prompt_count'],
+        'completed_images': totals['all']['completed_count'],
+        'processing_images': totals['all']['in_flight_count'],
+        'failed_images': totals['all']['failed_count'],
     }
     
     # Pagination
@@ -151,7 +169,7 @@ def bulk_list(request):
     return render(request, 'image_generator/bulk_list.html', {
         'page_obj': page_obj,
         'bulk_requests': page_obj.object_list,
-        'stats': stats,
+        'stats': page_stats,
         'current_api_provider': api_provider,
         'search_query': search_query,
         'paginator': paginator,
@@ -162,7 +180,9 @@ def delete_bulk_request(request, request_id):
     """Delete a bulk request and all its associated images"""
     try:
         bulk_request = get_object_or_404(BulkImageRequest, id=request_id)
-        bulk_request.delete()
+        with transaction.atomic():
+            stats.record_bulk_deleted(BulkImageRequest.objects.filter(id=bulk_request.id).select_for_update())
+            bulk_request.delete()
         return JsonResponse({'status': 'success'})
     except Exception as e:
         logger.error(f"Error deleting bulk request {request_id}: {str(e)}")
@@ -179,8 +199,11 @@ def bulk_delete_requests(request):
         if not request_ids:
             return JsonResponse({'status': 'error', 'message': 'No requests selected'}, status=400)
         
-        deleted_count = BulkImageRequest.objects.filter(id__in=request_ids).count()
-        BulkImageRequest.objects.filter(id__in=request_ids).delete()
+        with transaction.atomic():
+            bulk_requests = BulkImageRequest.objects.filter(id__in=request_ids).select_for_update()
+            deleted_count = bulk_requests.count()
+            stats.record_bulk_deleted(bulk_requests)
+            bulk_requests.delete()
         
         return JsonResponse({
             'status': 'success', 
@@ -190,8 +213,53 @@ def bulk_delete_requests(request):
         logger.error(f"Error bulk deleting requests: {str(e)}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+def sanitize_title(title):
+    """Turn a bulk request title into a safe file or folder name"""
+    sanitized = re.sub(r'[^\w\s-]', '', title)
+    return re.sub(r'[-\s]+', '_', sanitized).strip('_')
+
+def prompt_zip_entry(prompt, filename_stem):
+    """Build a stored (uncompressed) ZIP entry that opens the image lazily"""
+    if prompt.image_hash:
+        extension = MIME_EXTENSIONS.get(prompt.image_mime_type, 'png')
+        return ZipEntry(f"{filename_stem}.{extension}", lambda: get_image_store().open(prompt.image_hash))
+    # Legacy rows: generated_image is deferred, so it is only loaded here, one row at a time
+    image = prompt.open_image()
+    if not image:
+        return None
+    image_format, image_file = image
+    return ZipEntry(f"{filename_stem}.{image_format}", lambda: image_file)
+
+def variant_zip_entry(variant, filename_stem):
+    extension = MIME_EXTENSIONS.get(variant.image_mime_type, 'png')
+    return ZipEntry(f"{filename_stem}.{extension}", lambda: get_image_store().open(variant.image_hash))
+
+def iter_prompt_zip_entries(prompts, filename_stem, completed_only=False):
+    """Yield ZIP entries for prompts; filename_stem(index) names each file by position
+
+    Prompts with several variants get one file per variant, suffixed _v1, _v2, ...
+    """
+    prompts = prompts.defer('generated_image').prefetch_related(
+        Prefetch('variants', queryset=ImageVariant.objects.only('prompt_id', 'position', 'image_hash', 'image_mime_type'))
+    ).iterator(chunk_size=500)
+    for index, prompt in enumerate(prompts, 1):
+        if completed_only and prompt.status != 'completed':
+            continue
+        try:
+            variants = list(prompt.variants.all())
+            if len(variants) > 1:
+                for variant in variants:
+                    yield variant_zip_entry(variant, f"{filename_stem(index)}_v{variant.position + 1}")
+                continue
+            entry = prompt_zip_entry(prompt, filename_stem(index))
+        except Exception as e:
+            logger.error(f"Error processing image for prompt {prompt.id}: {str(e)}")
+            continue
+        if entry:
+            yield entry
+
 def bulk_download_requests(request):
-    """Download images from multiple bulk requests as a ZIP file"""
+    """Download images from multiple bulk requests as a streamed ZIP file"""
     try:
         request_ids = request.GET.get('ids', '').split(',')
         request_ids = [int(id) for id in request_ids if id.isdigit()]
@@ -199,39 +267,19 @@ def bulk_download_requests(request):
         if not request_ids:
             return JsonResponse({'status': 'error', 'message': 'No requests selected'}, status=400)
         
-        bulk_requests = BulkImageRequest.objects.filter(id__in=request_ids)
-        
-        # Create a BytesIO buffer to store the ZIP file
-        buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        bulk_requests = list(BulkImageRequest.objects.filter(id__in=request_ids).only('id', 'title'))
+
+        def entries():
             for bulk_request in bulk_requests:
                 # Create folder for each bulk request
-                folder_name = re.sub(r'[^\w\s-]', '', bulk_request.title)
-                folder_name = re.sub(r'[-\s]+', '_', folder_name).strip('_')
-                
+                folder_name = sanitize_title(bulk_request.title)
                 completed_prompts = bulk_request.prompts.filter(status='completed').order_by('id')
-                
-                for index, prompt in enumerate(completed_prompts, 1):
-                    if prompt.generated_image:
-                        # Extract the base64 data from the data URL
-                        match = re.match(r'data:image/(\w+);base64,(.+)', prompt.generated_image)
-                        if match:
-                            image_format, image_data = match.groups()
-                            
-                            # Create filename with bulk request folder
-                            filename = f"{folder_name}/{index:03d}_{folder_name}.{image_format}"
-                            
-                            # Decode base64 and write to zip
-                            try:
-                                image_content = base64.b64decode(image_data)
-                                zip_file.writestr(filename, image_content)
-                            except Exception as e:
-                                logger.error(f"Error processing image for prompt {prompt.id}: {str(e)}")
-        
-        # Prepare the response
-        buffer.seek(0)
-        response = HttpResponse(buffer.getvalue(), content_type='application/zip')
+                yield from iter_prompt_zip_entries(
+                    completed_prompts,
+                    lambda index: f"{folder_name}/{index:03d}_{folder_name}"
+                )
+
+        response = StreamingHttpResponse(stream_zip(entries()), content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename=bulk_images_{len(request_ids)}_requests.zip'
         
         return response
@@ -244,17 +292,38 @@ def bulk_image_generator(request):
     if request.method == 'POST':
         title = request.POST.get('title', '').strip()
         prompts_str = request.POST.get('prompts', '')
+        prompts_file = request.FILES.get('prompts_file')
         api_provider = request.POST.get('api_provider', 'whisk')
+        bypass_cache = request.POST.get('bypass_cache') == 'on'
+        try:
+            candidates_count = int(request.POST.get('candidates_count', 1))
+        except ValueError:
+            candidates_count = 1
+        candidates_count = min(max(candidates_count, 1), BulkImageRequest.MAX_CANDIDATES)
+        try:
+            priority = int(request.POST.get('priority', 2))
+        except ValueError:
+            priority = 2
+        if priority not in dict(BulkImageRequest.PRIORITY_CHOICES):
+            priority = 2
+        failover_policy = request.POST.get('failover_policy', 'none')
+        if failover_policy not in dict(BulkImageRequest.FAILOVER_CHOICES):
+            failover_policy = 'none'
         
         if not title:
             return render(request, 'image_generator/bulk_generator.html', {
                 'error': 'Title is required for bulk generation.',
                 'prompts': prompts_str,
-                'api_provider': api_provider
+                'api_provider': api_provider,
+                'bypass_cache': bypass_cache,
+                'candidates_count': candidates_count,
+                'priority': priority,
+                'failover_policy': failover_policy
             })
         
         try:
-            prompts = json.loads(prompts_str)
+            # An uploaded file is parsed as it is imported, by import_prompts_task
+            prompts = json.loads(prompts_str) if not prompts_file else []
             if not isinstance(prompts, list):
                 raise ValueError("Input must be a JSON array of strings.")
         except (json.JSONDecodeError, ValueError) as e:
@@ -262,120 +331,224 @@ def bulk_image_generator(request):
                 'error': str(e),
                 'title': title,
                 'prompts': prompts_str,
-                'api_provider': api_provider
+                'api_provider': api_provider,
+                'bypass_cache': bypass_cache,
+                'candidates_count': candidates_count,
+                'priority': priority,
+                'failover_policy': failover_policy
             })
 
         # Validate API provider settings
         if api_provider == 'imagefx':
-            imagefx_settings = ImageFXSettings.get_settings()
-            if not imagefx_settings.auth_token:
+            if not credentials.is_configured('imagefx'):
                 return render(request, 'image_generator/bulk_generator.html', {
                     'error': 'Please configure your ImageFX API settings first.',
                     'title': title,
                     'prompts': prompts_str,
-                    'api_provider': api_provider
+                    'api_provider': api_provider,
+                    'bypass_cache': bypass_cache,
+                    'candidates_count': candidates_count,
+                    'priority': priority,
+                    'failover_policy': failover_policy
                 })
         else:
-            whisk_settings = WhiskSettings.get_settings()
-            if not whisk_settings.auth_token or not whisk_settings.project_id:
+            if not credentials.is_configured('whisk'):
                 return render(request, 'image_generator/bulk_generator.html', {
                     'error': 'Please configure your Whisk API settings first.',
                     'title': title,
                     'prompts': prompts_str,
-                    'api_provider': api_provider
+                    'api_provider': api_provider,
+                    'bypass_cache': bypass_cache,
+                    'candidates_count': candidates_count,
+                    'priority': priority,
+                    'failover_policy': failover_policy
                 })
 
-        bulk_request = BulkImageRequest.objects.create(
-            title=title, 
-            status='processing',
-            api_provider=api_provider
-        )
-        
-        for prompt_text in prompts:
-            image_prompt = ImagePrompt.objects.create(
-                bulk_request=bulk_request,
-                prompt_text=prompt_text,
-                api_provider=api_provider
+        if prompts_file:
+            # Imported by a Celery task; the status page shows its progress
+            path = prompt_import.save_upload(prompts_file)
+            with transaction.atomic():
+                bulk_request = BulkImageRequest.objects.create(
+                    title=title,
+                    status='pending',
+                    api_provider=api_provider,
+                    bypass_cache=bypass_cache,
+                    candidates_count=candidates_count,
+                    priority=priority,
+                    failover_policy=failover_policy,
+                    total_count=0
+                )
+                stats.record_bulk_created(bulk_request)
+                transaction.on_commit(lambda: import_prompts_task.delay(bulk_request.id, path))
+            return redirect('bulk_status', bulk_request_id=bulk_request.id)
+
+        prompts = [str(prompt_text) for prompt_text in prompts]
+        with transaction.atomic():
+            bulk_request = BulkImageRequest.objects.create(
+                title=title, 
+                status='processing' if prompts else 'completed',
+                api_provider=api_provider,
+                bypass_cache=bypass_cache,
+                candidates_count=candidates_count,
+                priority=priority,
+                failover_policy=failover_policy,
+                total_count=len(prompts)
             )
-            generate_image_task.delay(image_prompt.id)
-        
-        # Check if all tasks are completed to update the bulk request status
-        # This is a simplified check; a more robust solution might use Celery chains or groups
-        all_prompts = ImagePrompt.objects.filter(bulk_request=bulk_request)
-        if all(p.status == 'completed' for p in all_prompts):
-            bulk_request.status = 'completed'
-            bulk_request.save()
+            stats.record_bulk_created(bulk_request)
+            ImagePrompt.objects.bulk_create(
+                [
+                    ImagePrompt(bulk_request=bulk_request, prompt_text=prompt_text, api_provider=api_provider)
+                    for prompt_text in prompts
+                ],
+                batch_size=BULK_CREATE_BATCH_SIZE
+            )
+            if prompts:
+                # The scheduler must not look for the prompts before they are committed
+                transaction.on_commit(kick_scheduler)
 
         return redirect('bulk_status', bulk_request_id=bulk_request.id)
     
-    # Check settings for both APIs
-    whisk_settings = WhiskSettings.get_settings()
-    imagefx_settings = ImageFXSettings.get_settings()
-    
+    # Check credentials for both APIs
     return render(request, 'image_generator/bulk_generator.html', {
-        'whisk_configured': bool(whisk_settings.auth_token and whisk_settings.project_id),
-        'imagefx_configured': bool(imagefx_settings.auth_token)
+        'whisk_configured': credentials.is_configured('whisk'),
+        'imagefx_configured': credentials.is_configured('imagefx'),
+        'max_candidates': BulkImageRequest.MAX_CANDIDATES
     })
 
 def bulk_status(request, bulk_request_id):
     bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
-    # Get prompts in the correct order (by ID, which represents creation order)
-    ordered_prompts = bulk_request.prompts.all().order_by('id')
+    # Get prompts in the correct order (by ID, which represents creation order).
+    # The related manager sets each prompt's bulk_request from its key, so the
+    # key must be loaded or every row costs a query.
+    ordered_prompts = bulk_request.prompts.only('id', 'bulk_request', 'prompt_text', 'status').order_by('id')
+    if bulk_request.importing:
+        # The page reloads once the uploaded file is in
+        ordered_prompts = ordered_prompts.none()
     return render(request, 'image_generator/bulk_status.html', {
         'bulk_request': bulk_request,
         'ordered_prompts': ordered_prompts
     })
 
 def get_bulk_status(request, bulk_request_id):
-    bulk_request = BulkImageRequest.objects.get(id=bulk_request_id)
-    
-    # Get prompts in the correct order (by ID, which represents creation order)
-    ordered_prompts = bulk_request.prompts.all().order_by('id')
-    
-    # Add sequential numbering to each prompt
-    prompts_with_numbers = []
-    for index, prompt in enumerate(ordered_prompts, 1):
-        prompts_with_numbers.append({
-            'id': prompt.id,
-            'prompt_text': prompt.prompt_text,
-            'status': prompt.status,
-            'generated_image': prompt.generated_image,
-            'sequence_number': index
+    """Poll prompt statuses, optionally only those changed since a cursor
+
+    Pass the ``cursor`` from the previous response as ``?since=`` to receive just
+    the prompts updated after it. Images are referenced by URL, never inlined.
+    """
+    bulk_request = get_object_or_404(BulkImageRequest, id=bulk_request_id)
+
+    since = None
+    since_param = request.GET.get('since')
+    if since_param:
+        since = parse_datetime(since_param)
+        if since is None:
+            return JsonResponse({'status': 'error', 'message': 'Invalid since cursor'}, status=400)
+
+    if bulk_request.importing:
+        # The page lists the prompts once the import is done; until then only the count moves
+        return JsonResponse({
+            'status': bulk_request.get_status_display(),
+            'importing': True,
+            'prompts': [],
+            'cursor': None,
+            'counts': bulk_request.status_counts(),
         })
-    
-    # Calculate status counts
-    status_counts = bulk_request.prompts.aggregate(
-        total=Count('id'),
-        completed=Count('id', filter=Q(status='completed')),
-        failed=Count('id', filter=Q(status='failed')),
-        processing=Count('id', filter=Q(status='processing')),
-        pending=Count('id', filter=Q(status='pending'))
-    )
-    
-    return JsonResponse({
+
+    prompts = bulk_request.prompts.annotate(
+        has_legacy_image=ExpressionWrapper(
+            Q(generated_image__isnull=False) & ~Q(generated_image=''),
+            output_field=BooleanField()
+        )
+    ).order_by('id')
+    if since is not None:
+        # Overlap the window slightly so a save that committed just after the
+        # previous poll read its rows is not skipped; updates are idempotent
+        prompts = prompts.filter(updated_at__gt=since - STATUS_CURSOR_OVERLAP)
+        fields = ['id', 'status', 'image_hash', 'thumbnail_hash', 'preview_hash', 'generated_provider', 'has_legacy_image', 'updated_at']
+    else:
+        fields = ['id', 'prompt_text', 'status', 'image_hash', 'thumbnail_hash', 'preview_hash', 'generated_provider', 'has_legacy_image', 'updated_at']
+
+    cursor = since
+    prompts_data = []
+    for index, prompt in enumerate(prompts.values(*fields), 1):
+        if cursor is None or prompt['updated_at'] > cursor:
+            cursor = prompt['updated_at']
+        item = {
+            'id': prompt['id'],
+            'status': prompt['status'],
+            'image_url': prompt_image_url(prompt['id'], prompt['image_hash'], prompt['has_legacy_image']),
+            'thumbnail_url': blob_url(prompt['thumbnail_hash']),
+            'preview_url': blob_url(prompt['preview_hash']),
+            'generated_provider': prompt['generated_provider'],
+        }
+        if since is None:
+            # Only a full listing knows each prompt's position
+            item['prompt_text'] = prompt['prompt_text']
+            item['sequence_number'] = index
+        prompts_data.append(item)
+
+    if bulk_request.candidates_count > 1 and prompts_data:
+        # One query for every variant of the prompts in this response
+        variant_urls = {}
+        variants = ImageVariant.objects.filter(
+            prompt_id__in=[prompt['id'] for prompt in prompts_data]
+        ).order_by('prompt_id', 'position').values_list('prompt_id', 'image_hash')
+        for prompt_id, image_hash in variants:
+            variant_urls.setdefault(prompt_id, []).append(blob_url(image_hash))
+        for prompt in prompts_data:
+            prompt['variant_urls'] = variant_urls.get(prompt['id'], [])
+
+    response = {
         'status': bulk_request.get_status_display(),
-        'prompts': prompts_with_numbers,
-        'counts': status_counts
-    })
+        'importing': False,
+        'prompts': prompts_data,
+        'cursor': cursor.isoformat() if cursor else None,
+    }
+    if bulk_request.import_error:
+        response['import_error'] = bulk_request.import_error
+
+    # Counts can only have moved if some prompt changed
+    if since is None or prompts_data:
+        response['counts'] = bulk_request.status_counts()
+
+    return JsonResponse(response)
+
+async def bulk_events(request, bulk_request_id):
+    """Server-Sent Events stream of prompt status changes for a bulk request"""
+    if not isinstance(request, ASGIRequest):
+        # An endless stream would pin a WSGI worker; the page falls back to polling
+        return HttpResponse('Event stream requires the ASGI server', status=503)
+    if not await BulkImageRequest.objects.filter(id=bulk_request_id).aexists():
+        raise Http404('Bulk request not found')
+    response = StreamingHttpResponse(
+        events.stream_bulk_events(bulk_request_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 def download_all_images(request, bulk_request_id):
-    """Download all generated images as a ZIP file with summary"""
+    """Download all generated images as a streamed ZIP file with summary"""
     bulk_request = get_object_or_404(BulkImageRequest, id=bulk_request_id)
     
-    # Create a BytesIO buffer to store the ZIP file
-    buffer = io.BytesIO()
-    
     # Get all prompts in the order they were created
     all_prompts = bulk_request.prompts.all().order_by('id')
-    completed_prompts = all_prompts.filter(status='completed')
-    failed_prompts = all_prompts.filter(status='failed')
     
     # Calculate statistics
-    total_count = all_prompts.count()
-    completed_count = completed_prompts.count()
-    failed_count = failed_prompts.count()
-    processing_count = all_prompts.filter(status='processing').count()
-    pending_count = all_prompts.filter(status='pending').count()
+    status_counts = bulk_request.prompts.aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+        failed=Count('id', filter=Q(status='failed')),
+        processing=Count('id', filter=Q(status='processing')),
+        pending=Count('id', filter=Q(status='pending'))
+    )
+    total_count = status_counts['total']
+    completed_count = status_counts['completed']
+    failed_count = status_counts['failed']
+    processing_count = status_counts['processing']
+    pending_count = status_counts['pending']
+    success_rate = (completed_count / total_count * 100) if total_count else 0
     
     # Create summary text content
     summary_content = f"""BULK IMAGE GENERATION SUMMARY
@@ -392,66 +565,89 @@ Failed: {failed_count}
 Processing: {processing_count}
 Pending: {pending_count}
 
-SUCCESS RATE: {(completed_count/total_count*100):.1f}%
+SUCCESS RATE: {success_rate:.1f}%
 
 """
     
+    failed_lines = []
+    completed_lines = []
+    if failed_count > 0 or completed_count > 0:
+        prompt_rows = all_prompts.values_list('status', 'prompt_text').iterator(chunk_size=2000)
+        for index, (status, prompt_text) in enumerate(prompt_rows, 1):
+            if status == 'failed':
+                failed_lines.append(f"#{index:03d}: {prompt_text}\n")
+            elif status == 'completed':
+                completed_lines.append(f"#{index:03d}: {prompt_text}\n")
+    
     if failed_count > 0:
         summary_content += "\nFAILED IMAGES:\n"
         summary_content += "-" * 50 + "\n"
-        for index, prompt in enumerate(all_prompts, 1):
-            if prompt.status == 'failed':
-                summary_content += f"#{index:03d}: {prompt.prompt_text}\n"
+        summary_content += "".join(failed_lines)
     
     if completed_count > 0:
         summary_content += f"\nSUCCESSFUL IMAGES ({completed_count} files):\n"
         summary_content += "-" * 50 + "\n"
-        for index, prompt in enumerate(all_prompts, 1):
-            if prompt.status == 'completed':
-                summary_content += f"#{index:03d}: {prompt.prompt_text}\n"
+        summary_content += "".join(completed_lines)
     
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Add summary text file
-        zip_file.writestr('SUMMARY.txt', summary_content.encode('utf-8'))
+    sanitized_title = sanitize_title(bulk_request.title)
+
+    def entries():
+        # Add summary text file; images are already compressed so they are stored as-is
+        yield ZipEntry('SUMMARY.txt', summary_content.encode('utf-8'), zipfile.ZIP_DEFLATED)
         
-        # Add completed images
-        for index, prompt in enumerate(all_prompts, 1):
-            if prompt.status == 'completed' and prompt.generated_image:
-                # Extract the base64 data from the data URL
-                match = re.match(r'data:image/(\w+);base64,(.+)', prompt.generated_image)
-                if match:
-                    image_format, image_data = match.groups()
-                    
-                    # Create filename with sequence number matching the prompt order
-                    sanitized_title = re.sub(r'[^\w\s-]', '', bulk_request.title)
-                    sanitized_title = re.sub(r'[-\s]+', '_', sanitized_title).strip('_')
-                    filename = f"{index:03d}_{sanitized_title}.{image_format}"
-                    
-                    # Decode base64 and write to zip
-                    try:
-                        image_content = base64.b64decode(image_data)
-                        zip_file.writestr(filename, image_content)
-                    except Exception as e:
-                        logger.error(f"Error processing image for prompt {prompt.id}: {str(e)}")
+        # Add completed images with sequence numbers matching the prompt order.
+        # The related manager sets each prompt's bulk_request from its key, so
+        # the key must be loaded or every row costs a query.
+        yield from iter_prompt_zip_entries(
+            all_prompts.only('id', 'bulk_request', 'status', 'image_hash', 'image_mime_type'),
+            lambda index: f"{index:03d}_{sanitized_title}",
+            completed_only=True
+        )
     
     # Prepare the response with bulk title in zip filename
-    buffer.seek(0)
-    sanitized_title = re.sub(r'[^\w\s-]', '', bulk_request.title)
-    sanitized_title = re.sub(r'[-\s]+', '_', sanitized_title).strip('_')
-    response = HttpResponse(buffer.getvalue(), content_type='application/zip')
+    response = StreamingHttpResponse(stream_zip(entries()), content_type='application/zip')
     response['Content-Disposition'] = f'attachment; filename={sanitized_title}_images.zip'
     
     return response
 
+def prompt_image(request, prompt_id):
+    """Serve a prompt's image, decoding legacy base64 rows on the fly"""
+    prompt = get_object_or_404(ImagePrompt, id=prompt_id)
+    if prompt.image_hash:
+        return redirect('serve_image', image_hash=prompt.image_hash)
+    image = prompt.get_image_content()
+    if not image:
+        raise Http404('Image not found')
+    image_format, image_content = image
+    return HttpResponse(image_content, content_type=f'image/{image_format}')
+
+def serve_image(request, image_hash):
+    """Serve an image blob from the content-addressed image store"""
+    # Blobs are immutable, so the hash doubles as a strong ETag
+    etag = f'"{image_hash}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            image_file = get_image_store().open(image_hash)
+        except FileNotFoundError:
+            raise Http404('Image not found')
+        # Originals and renditions share the store, so sniff rather than look up the type
+        content_type = sniff_mime_type(image_file.read(16))
+        image_file.seek(0)
+        response = FileResponse(image_file, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @require_http_methods(["POST"])
 def retry_failed_prompt(request, prompt_id):
     """Retry a single failed image prompt"""
     try:
         prompt = get_object_or_404(ImagePrompt, id=prompt_id)
-        if prompt.status == 'failed':
-            prompt.status = 'pending'
-            prompt.save()
-            generate_image_task.delay(prompt.id)
+        if transitions.transition_prompt(prompt, 'pending', ['failed']):
+            events.publish_prompt_status(prompt)
+            queue_generation([prompt.id])
             return JsonResponse({'status': 'success'})
         return JsonResponse({'status': 'error', 'message': 'Only failed prompts can be retried'}, status=400)
     except Exception as e:
@@ -463,12 +659,9 @@ def retry_all_failed(request, bulk_request_id):
     """Retry all failed image prompts in a bulk request"""
     try:
         bulk_request = get_object_or_404(BulkImageRequest, id=bulk_request_id)
-        failed_prompts = bulk_request.prompts.filter(status='failed')
-        for prompt in failed_prompts:
-            prompt.status = 'pending'
-            prompt.save()
-            generate_image_task.delay(prompt.id)
-        return JsonResponse({'status': 'success', 'retried_count': failed_prompts.count()})
+        failed_ids = transitions.transition_prompts(bulk_request.prompts.filter(status='failed'), 'pending')
+        queue_generation(failed_ids)
+        return JsonResponse({'status': 'success', 'retried_count': len(failed_ids)})
     except Exception as e:
         logger.error(f"Error retrying failed prompts for bulk request {bulk_request_id}: {str(e)}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
@@ -478,9 +671,8 @@ def mark_prompt_completed(request, prompt_id):
     """Manually mark a prompt as completed (for stuck processing tasks)"""
     try:
         prompt = get_object_or_404(ImagePrompt, id=prompt_id)
-        if prompt.status == 'processing':
-            prompt.status = 'completed'
-            prompt.save()
+        if transitions.transition_prompt(prompt, 'completed', ['processing']):
+            events.publish_prompt_status(prompt)
             return JsonResponse({'status': 'success'})
         return JsonResponse({'status': 'error', 'message': 'Only processing prompts can be marked as completed'}, status=400)
     except Exception as e:
@@ -489,25 +681,15 @@ def mark_prompt_completed(request, prompt_id):
 
 @require_http_methods(["POST"])
 def reset_stuck_prompts(request, bulk_request_id):
-    """Reset all stuck processing prompts in a bulk request"""
+    """Reset the processing prompts in a bulk request whose worker lease has expired"""
     try:
         bulk_request = get_object_or_404(BulkImageRequest, id=bulk_request_id)
-        from datetime import timedelta
-        from django.utils import timezone
-        
-        # Find prompts stuck in processing for more than 5 minutes
-        cutoff_time = timezone.now() - timedelta(minutes=5)
-        stuck_prompts = bulk_request.prompts.filter(
-            status='processing',
-            updated_at__lt=cutoff_time
-        )
-        
-        for prompt in stuck_prompts:
-            prompt.status = 'pending'
-            prompt.save()
-            generate_image_task.delay(prompt.id)
+
+        # Prompts still heartbeating are being generated; resetting them would run them twice
+        stuck_ids = leases.reap_expired(bulk_request.prompts.all())
+        queue_generation(stuck_ids)
             
-        return JsonResponse({'status': 'success', 'reset_count': stuck_prompts.count()})
+        return JsonResponse({'status': 'success', 'reset_count': len(stuck_ids)})
     except Exception as e:
         logger.error(f"Error resetting stuck prompts for bulk request {bulk_request_id}: {str(e)}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
@@ -536,9 +718,17 @@ def settings_view(request):
     """View current settings (read-only)"""
     whisk_settings = WhiskSettings.get_settings()
     imagefx_settings = ImageFXSettings.get_settings()
+    rate_limit_usage = []
+    for provider in ['whisk', 'imagefx']:
+        usage = rate_limit.get_utilisation(provider)
+        in_flight = {token['token_id']: token['in_flight'] for token in usage['tokens']}
+        usage['circuit'] = circuit_breaker.get_state(provider)
+        usage['credentials'] = credentials.get_pool_status(provider, in_flight)
+        rate_limit_usage.append(usage)
     return render(request, 'image_generator/settings_view.html', {
         'whisk_settings': whisk_settings,
-        'imagefx_settings': imagefx_settings
+        'imagefx_settings': imagefx_settings,
+        'rate_limit_usage': rate_limit_usage
     })
 
 def imagefx_settings(request):
@@ -559,4 +749,29 @@ def imagefx_settings(request):
     return render(request, 'image_generator/imagefx_settings.html', {
         'form': form,
         'settings': settings_obj
-    })
\ No newline at end of file
+    })
+
+
+def metrics_view(request):
+    """Prometheus metrics for every web and worker process, collected through Redis"""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse('Unauthorized', status=401)
+
+    prompt_samples = []
+    for provider, provider_totals in stats.get_totals().items():
+        if provider == 'all':
+            continue
+        pending = provider_totals['prompt_count'] - provider_totals['in_flight_count'] - provider_totals['completed_count'] - provider_totals['failed_count']
+        for status, value in (('pending', pending), ('processing', provider_totals['in_flight_count']),
+                              ('completed', provider_totals['completed_count']), ('failed', provider_totals['failed_count'])):
+            prompt_samples.append(({'provider': provider, 'status': status}, value))
+    gauges = [('image_generator_prompts', 'Prompts by provider and status', prompt_samples)]
+    try:
+        depth = metrics.queue_depth('image_generation')
+    except redis.RedisError as e:
+        logger.warning(f"Could not read queue depth: {e}")
+        depth = None
+    if depth is not None:
+        gauges.append(('image_generator_queue_depth', 'Messages waiting in the Celery queue', [({'queue': 'image_generation'}, depth)]))
+
+    return HttpResponse(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,7 +1,11 @@
-import requests
 import json
 from django.conf import settings
-from .models import WhiskSettings
+from . import http_client
+from .exceptions import ContentRejectedError, ServerError, raise_for_response
+
+IMAGE_MODEL = "IMAGEN_3_5"
+ASPECT_RATIO = "IMAGE_ASPECT_RATIO_LANDSCAPE"
+SEED = 0
 
 def get_new_project_id(title):
     url = "https://labs.google/fx/api/trpc/media.createOrUpdateWorkflow"
@@ -18,7 +22,7 @@ def get_new_project_id(title):
             "workflowMetadata": {"workflowName": title}
         }
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post('whisk', url, headers=headers, json=data)
     if response.status_code == 200:
         try:
             data = response.json()
@@ -27,32 +31,39 @@ def get_new_project_id(title):
             return None
     return None
 
-def generate_image(prompt):
-    url = "https://aisandbox-pa.googleapis.com/v1/whisk:generateImage"
-    whisk_settings = WhiskSettings.get_settings()
-    
+def build_generate_request(prompt, auth_token, project_id):
+    """Return the (url, headers, body) of a generateImage call"""
+    url = f"{settings.PROVIDER_API_BASE_URL}/v1/whisk:generateImage"
     headers = {
-        "Authorization": f"Bearer {whisk_settings.auth_token}",
+        "Authorization": f"Bearer {auth_token}",
         "Content-Type": "application/json",
     }
     data = {
         "clientContext": {
-            "workflowId": whisk_settings.project_id,
+            "workflowId": project_id,
             "tool": "BACKBONE",
             "sessionId": ";1748281496093"
         },
         "imageModelSettings": {
-            "imageModel": "IMAGEN_3_5",
-            "aspectRatio": "IMAGE_ASPECT_RATIO_LANDSCAPE",
+            "imageModel": IMAGE_MODEL,
+            "aspectRatio": ASPECT_RATIO,
         },
-        "seed": 0,
+        "seed": SEED,
         "prompt": prompt,
         "mediaCategory": "MEDIA_CATEGORY_BOARD"
     }
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code == 200:
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return None
-    return None
+    return url, headers, data
+
+def parse_generate_response(response):
+    """Return the imagePanels result of a generateImage response or raise a ProviderError
+
+    Works with both ``requests`` and ``httpx`` responses.
+    """
+    raise_for_response('whisk', response)
+    try:
+        result = response.json()
+    except json.JSONDecodeError as e:
+        raise ServerError('whisk returned invalid JSON', 'whisk', response.status_code) from e
+    if not result.get('imagePanels'):
+        raise ContentRejectedError('whisk returned no images for the prompt', 'whisk', response.status_code)
+    return result
@@ -0,0 +1,71 @@
+import io
+import time
+import zipfile
+
+# Bytes read from a source file per write into the archive
+CHUNK_SIZE = 64 * 1024
+
+
+class ZipEntry:
+    """A file to add to a streamed archive
+
+    ``source`` is either ``bytes`` or a zero-argument callable returning a binary
+    file object, so the file is only opened when the archive reaches it.
+    """
+
+    def __init__(self, name, source, compress_type=zipfile.ZIP_STORED):
+        self.name = name
+        self.source = source
+        self.compress_type = compress_type
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive piece by piece from an iterable of ZipEntry
+
+    The archive is never held in memory: at most one ``chunk_size`` read (or one
+    ``bytes`` source) is buffered before it is yielded to the response.
+    """
+    buffer = _ChunkBuffer()
+    # An unseekable target makes zipfile emit data descriptors instead of
+    # seeking back to patch local headers
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=time.localtime()[:6])
+            info.compress_type = entry.compress_type
+            with archive.open(info, 'w', force_zip64=True) as dest:
+                if isinstance(entry.source, bytes):
+                    dest.write(entry.source)
+                else:
+                    with entry.source() as source:
+                        while True:
+                            chunk = source.read(chunk_size)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
@@ -13,7 +13,8 @@ NC='\033[0m' # No Color
 cleanup() {
     echo -e "${RED}Cleaning up processes...${NC}"
     pkill -f "runserver"
-    pkill -f "celery worker"
+    pkill -f "celery -A whisk_project worker"
+    pkill -f "celery -A whisk_project beat"
     echo -e "${GREEN}All services stopped.${NC}"
     exit 0
 }
@@ -41,9 +42,13 @@ python manage.py runserver 0.0.0.0:8000 > logs/django.log 2>&1 &
 echo -e "${BLUE}Starting Celery worker...${NC}"
 celery -A whisk_project worker -l info -Q image_generation > logs/celery.log 2>&1 &
 
+# Start Celery beat: it feeds the fair scheduler and reaps expired prompt leases
+echo -e "${BLUE}Starting Celery beat...${NC}"
+celery -A whisk_project beat -l info > logs/celery_beat.log 2>&1 &
+
 # Function to monitor logs
 monitor_logs() {
-    tail -f logs/django.log logs/celery.log &
+    tail -f logs/django.log logs/celery.log logs/celery_beat.log &
     TAIL_PID=$!
     trap "kill $TAIL_PID" EXIT
 }
@@ -56,5 +61,6 @@ echo -e "${GREEN}All services started successfully!${NC}"
 echo -e "${BLUE}Logs are being saved to:${NC}"
 echo -e "  - Django logs: ${GREEN}logs/django.log${NC}"
 echo -e "  - Celery logs: ${GREEN}logs/celery.log${NC}"
+echo -e "  - Celery beat logs: ${GREEN}logs/celery_beat.log${NC}"
 echo -e "${BLUE}Press Ctrl+C to stop all services.${NC}"
 wait
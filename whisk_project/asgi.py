@@ -2,6 +2,8 @@
 ASGI config for whisk_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The bulk progress event stream (``/api/bulk_events/<id>/``) is only served when
+running under an ASGI server, e.g. ``uvicorn whisk_project.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -28,6 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Redis used for pub/sub progress events
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -56,6 +59,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'image_generator.middleware.query_count_middleware',
 ]
 
 ROOT_URLCONF = 'whisk_project.urls'
@@ -133,6 +137,91 @@ STATICFILES_DIRS = [
     BASE_DIR / 'image_generator/static',
 ]
 
+# Generated image storage
+# Blobs are content-addressed by SHA-256 and sharded as <root>/ab/cd/<hash>
+IMAGE_STORE_BACKEND = config('IMAGE_STORE_BACKEND', default='image_generator.storage.LocalImageStore')
+IMAGE_STORE_ROOT = config('IMAGE_STORE_ROOT', default=str(BASE_DIR / 'image_store'))
+
+# Uploaded prompt files wait here for the Celery import task, so web and workers must share it
+PROMPT_UPLOAD_ROOT = config('PROMPT_UPLOAD_ROOT', default=str(BASE_DIR / 'prompt_uploads'))
+
+# Generation result cache
+# Identical (provider, model, aspect ratio, seed, normalized prompt) requests reuse stored images
+GENERATION_CACHE_ENABLED = config('GENERATION_CACHE_ENABLED', default=True, cast=bool)
+GENERATION_CACHE_TTL = config('GENERATION_CACHE_TTL', default=7 * 24 * 60 * 60, cast=int)  # seconds
+GENERATION_CACHE_MAX_ENTRIES = config('GENERATION_CACHE_MAX_ENTRIES', default=100000, cast=int)
+GENERATION_CACHE_PRUNE_PROBABILITY = 0.01  # chance that a cache write also prunes
+
+# Upstream rate limiting, shared by all web and worker processes through Redis
+# Limits apply per provider and per auth token; `manage.py rate_limits` changes them at runtime
+PROVIDER_RATE_LIMITS = {
+    'default': {'rate': 1.0, 'burst': 5, 'max_in_flight': 4},  # rate is requests per second
+    'whisk': {'rate': 1.0, 'burst': 5, 'max_in_flight': 4},
+    'imagefx': {'rate': 1.0, 'burst': 5, 'max_in_flight': 4},
+}
+RATE_LIMIT_MAX_WAIT = 120  # seconds a call may queue for a slot before giving up
+RATE_LIMIT_LEASE_SECONDS = 180  # in-flight slots of crashed workers free up after this
+
+# Retries of retryable provider errors (429, 5xx, timeouts) in generate_image_task
+GENERATION_RETRY_BACKOFF_BASE = 10  # seconds before the first retry, doubled each attempt
+GENERATION_RETRY_BACKOFF_CAP = 300
+# Longest retry or deferral countdown parked in the broker. Longer waits, such as a
+# credential quota that resets at midnight, hand the prompt back to the scheduler
+# until then. Must stay well below the broker's visibility timeout, after which
+# Redis redelivers a countdown task that is still waiting.
+GENERATION_MAX_COUNTDOWN = 600  # seconds
+
+# Credential pool health; see image_generator.credentials
+CREDENTIAL_ERROR_WINDOW = 300  # seconds over which a credential's error rate is measured
+CREDENTIAL_MIN_CALLS = 5  # calls in the window before the error rate counts
+CREDENTIAL_ERROR_THRESHOLD = 0.5  # error rate that takes a credential out of rotation
+CREDENTIAL_COOLDOWN = 60  # seconds out of rotation after errors or a 429
+CREDENTIAL_AUTH_COOLDOWN = 3600  # seconds out of rotation after the token is rejected
+
+# Relative cost of one upstream call per provider, for the 'cost' failover policy
+PROVIDER_COSTS = {
+    'whisk': config('WHISK_CALL_COST', default=1.0, cast=float),
+    'imagefx': config('IMAGEFX_CALL_COST', default=1.0, cast=float),
+}
+
+# Bearer token required to scrape /metrics; empty leaves the endpoint open
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Per-provider circuit breaker, shared through Redis
+CIRCUIT_BREAKER_THRESHOLD = 5  # retryable failures within the window that open the circuit
+CIRCUIT_BREAKER_WINDOW = 60  # seconds
+CIRCUIT_BREAKER_COOLDOWN = 30  # seconds the circuit stays open before a probe is allowed
+
+# Pooled HTTP sessions for upstream calls, one per process
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5, cast=float)  # seconds
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=90, cast=float)  # seconds; generation takes 10-40s
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=4, cast=int)  # distinct hosts kept pooled
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=10, cast=int)  # keep-alive connections per host
+
+# Where generateImage and runImageFx calls go; point at `manage.py run_mock_provider` to benchmark without quota
+PROVIDER_API_BASE_URL = config('PROVIDER_API_BASE_URL', default='https://aisandbox-pa.googleapis.com')
+
+# Which engine generates queued prompts: 'celery' queues generate_image_task per prompt,
+# 'async' leaves them pending for `manage.py run_async_engine` to claim
+GENERATION_ENGINE = config('GENERATION_ENGINE', default='celery')
+
+# Fair scheduling across bulk requests, see image_generator.scheduler
+GENERATION_SCHEDULER_WINDOW = config('GENERATION_SCHEDULER_WINDOW', default=16, cast=int)  # prompts queued or generating at once under Celery; about the workers' total concurrency
+GENERATION_SCHEDULER_INTERVAL = config('GENERATION_SCHEDULER_INTERVAL', default=10, cast=int)  # seconds between beat-driven rounds
+GENERATION_SCHEDULER_KICK_DELAY = 1  # seconds; kicks within this window share one round
+# Share of each provider's in-flight slots and burst held back for single-image requests
+INTERACTIVE_RESERVED_SHARE = config('INTERACTIVE_RESERVED_SHARE', default=0.25, cast=float)
+
+# Process-local cache of WhiskSettings/ImageFXSettings; saves are broadcast through Redis,
+# so this only bounds staleness if a process misses the broadcast
+PROVIDER_SETTINGS_CACHE_TTL = config('PROVIDER_SETTINGS_CACHE_TTL', default=30, cast=int)  # seconds
+
+# Workers lease the prompts they claim and renew the lease while generating;
+# the reaper re-queues processing prompts whose lease ran out
+PROMPT_LEASE_SECONDS = config('PROMPT_LEASE_SECONDS', default=90, cast=int)
+PROMPT_LEASE_HEARTBEAT_SECONDS = config('PROMPT_LEASE_HEARTBEAT_SECONDS', default=30, cast=int)
+PROMPT_LEASE_REAP_INTERVAL = config('PROMPT_LEASE_REAP_INTERVAL', default=60, cast=int)  # seconds between beat runs
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -145,6 +234,19 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}  # seconds; see GENERATION_MAX_COUNTDOWN
+CELERY_BEAT_SCHEDULE = {
+    'reap-expired-prompt-leases': {
+        'task': 'image_generator.tasks.reap_expired_leases_task',
+        'schedule': PROMPT_LEASE_REAP_INTERVAL,
+        'options': {'queue': 'image_generation'},
+    },
+    'schedule-generation': {
+        'task': 'image_generator.tasks.schedule_generation_task',
+        'schedule': GENERATION_SCHEDULER_INTERVAL,
+        'options': {'queue': 'image_generation'},
+    },
+}
 
 
 LOGGING = {